@@ -0,0 +1,99 @@
+"""
+批量导入（core.bulk_import）的吞吐量
+
+生成 --files 个合成记录文件（其中一部分是重复的文件，节点 ID 全部冲突；另有 --broken 个损坏的文件），
+分别用 1 个和 --workers 个工作进程导入，报告每秒文件数、MB/s、加速比和主进程占用的 CPU 时间：
+    memory - import_records()，导入到内存中的树；
+    file   - import_records_to_file()，直接写入记录文件（命令行 import 使用的方式）。
+主进程 CPU 时间占单进程耗时的比例越小，增加 CPU 核数时的加速越明显。
+最后检查各次导入的树结构相同（重新生成的 ID 除外）、没有重复的节点 ID。
+
+用法:
+    python benchmarks/bulk_import.py --files 200 --workers 8
+    python benchmarks/bulk_import.py --files 500 --depth 3 --fanout 5 --workers 4 --mode file --verbose
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generate_tree
+from core.bulk_import import format_import_report, import_records, import_records_to_file
+from core.records import load_tree, save_tree
+from core.tree import Tree
+
+
+def write_files(folder, count, depth, fanout, msgs, broken):
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"export-{i:04d}.json")
+        # 每 10 个文件中有一个与之前的文件完全相同，节点 ID 全部冲突
+        save_tree(generate_tree(depth, fanout, msgs, seed=i - i % 10 if i % 10 == 9 else i), path)
+        paths.append(path)
+    for i in range(broken):
+        path = os.path.join(folder, f"broken-{i}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"topic": "截断的文件", "chats": ["你: 你好')
+        paths.append(path)
+    return paths
+
+
+def run(paths, workers, mode, folder):
+    """导入一次，返回 (报告, 主进程 CPU 时间, 树结构)"""
+    started = time.process_time()
+    if mode == 'memory':
+        tree = Tree()
+        report = import_records(tree.root, paths, workers)
+    else:
+        store = os.path.join(folder, "store.json")
+        if os.path.exists(store):
+            os.remove(store)
+        report = import_records_to_file(store, paths, workers=workers)
+    cpu = time.process_time() - started
+    if mode == 'file':
+        tree = load_tree(store)
+    ids = [node.id for node in tree.root.walk()]
+    if len(ids) != len(set(ids)):
+        raise AssertionError("导入后存在重复的节点 ID")
+    # 只比较主题和聊天记录，冲突的节点 ID 每次都重新生成
+    shape = [(node.topic, len(node.chats), len(node.children)) for node in tree.root.walk()]
+    return report, cpu, shape
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入记录文件的吞吐量")
+    parser.add_argument("--files", type=int, default=200, help="记录文件数")
+    parser.add_argument("--broken", type=int, default=1, help="其中损坏的文件数")
+    parser.add_argument("--depth", type=int, default=3, help="每棵树的深度")
+    parser.add_argument("--fanout", type=int, default=4, help="每个节点的子节点数")
+    parser.add_argument("--msgs", type=int, default=4, help="每个节点的消息数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="并行导入的工作进程数")
+    parser.add_argument("--mode", choices=["memory", "file", "both"], default="both", help="导入方式")
+    parser.add_argument("--verbose", action="store_true", help="列出每个文件的耗时")
+    args = parser.parse_args(argv)
+
+    modes = ['memory', 'file'] if args.mode == 'both' else [args.mode]
+    shapes = []
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_files(folder, args.files, args.depth, args.fanout, args.msgs, args.broken)
+        for mode in modes:
+            serial, _, serial_shape = run(paths, 1, mode, folder)
+            parallel, cpu, parallel_shape = run(paths, args.workers, mode, folder)
+            shapes.extend([serial_shape, parallel_shape])
+            print(f"[{mode}] 单进程:")
+            print(format_import_report(serial))
+            print(f"[{mode}] {parallel['workers']} 个工作进程:")
+            print(format_import_report(parallel, args.verbose))
+            print(f"[{mode}] 加速比 {serial['elapsed'] / parallel['elapsed']:.2f}x（{os.cpu_count()} 个 CPU），"
+                  f"主进程 CPU {cpu:.2f}s，占单进程耗时的 {cpu / serial['elapsed']:.0%}\n")
+    if any(shape != shapes[0] for shape in shapes):
+        raise AssertionError("各次导入的结果不同")
+    print("各次导入的结果相同")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
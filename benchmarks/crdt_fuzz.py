@@ -0,0 +1,251 @@
+"""
+core.crdt 的随机收敛测试和合并开销测试
+
+收敛测试: 若干副本从同一棵树出发，随机地在本地修改（创建、移动 — 包括并发的交叉移动、删除、重命名、追加消息，
+一部分通过修改 Tree 再 record() 产生），随机两两同步（增量经过 JSON 序列化，随机重复发送旧的增量、
+乱序到达），随机垃圾回收和保存 / 加载。最后全部同步，检查:
+    - 所有副本的树（to_tree() 的 Merkle 哈希）完全相同；
+    - 可见的节点没有环，每个节点只出现一次；
+    - 各副本通过 update_tree() 增量维护的 Tree 与 to_tree() 相同。
+任何一轮失败时打印种子，用 --seed 复现。
+
+合并开销测试（--bench）: 在较大的树上，两个副本各做 k 个修改后交换增量，合并耗时应只与 k 有关，与树的大小无关。
+
+用法:
+    python benchmarks/crdt_fuzz.py --rounds 200
+    python benchmarks/crdt_fuzz.py --seed 17 --replicas 4 --steps 500
+    python benchmarks/crdt_fuzz.py --bench --depth 5 --fanout 6
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generate_tree
+from core.crdt import CrdtTree
+
+
+def visible_nodes(crdt):
+    return [node_id for node_id in list(crdt._parent) if crdt.is_visible(node_id)]
+
+
+def random_local_op(crdt, tree, rng, counter):
+    """在副本上做一个随机的本地修改，一部分通过修改 Tree 后 record()"""
+    nodes = visible_nodes(crdt)
+    choice = rng.random()
+    if choice < 0.25:
+        crdt.create(rng.choice(nodes), f"节点 {counter}")
+    elif choice < 0.45 and len(nodes) > 2:
+        node_id = rng.choice(nodes[1:])
+        targets = [n for n in nodes if not crdt.is_ancestor(node_id, n)]
+        if targets:
+            crdt.move(node_id, rng.choice(targets))
+    elif choice < 0.55 and len(nodes) > 3:
+        crdt.delete(rng.choice([n for n in nodes if n != crdt.root_id]))
+    elif choice < 0.7:
+        crdt.rename(rng.choice(nodes), f"主题 {counter}")
+    elif choice < 0.85:
+        crdt.append(rng.choice(nodes), f"你: 消息 {counter}\n")
+    elif tree is not None:
+        # 通过 Tree 修改，再由 record() 转换为操作
+        crdt.update_tree(tree)
+        live = list(tree.root.walk())
+        node = rng.choice(live)
+        action = rng.random()
+        if action < 0.4:
+            node.chats.append(f"AI: 回复 {counter}\n")
+        elif action < 0.7:
+            from core.tree import TreeNode
+            child = TreeNode(f"界面节点 {counter}")
+            child.chats.append(f"你: 提问 {counter}\n")
+            node.add_child(child)
+        elif node is not tree.root:
+            targets = [n for n in live if not node.is_ancestor_of(n)]
+            if targets:
+                node.move_to(rng.choice(targets))
+        crdt.record(tree)
+
+
+def sync(sender, receiver, rng, inbox):
+    """sender 向 receiver 发送增量（经过 JSON 序列化），随机重放之前的消息"""
+    message = json.loads(json.dumps(sender.delta(receiver.version()), ensure_ascii=False))
+    inbox.append((receiver, message))
+    result = receiver.merge(message)
+    if rng.random() < 0.2 and inbox:
+        # 重复或迟到的旧消息
+        old_receiver, old_message = rng.choice(inbox)
+        old_receiver.merge(old_message)
+    return result
+
+
+def check_tree(crdt):
+    """检查结构：可见节点从根节点出发恰好到达一次"""
+    seen = set()
+    stack = [crdt.root_id]
+    while stack:
+        node_id = stack.pop()
+        if node_id in seen:
+            raise AssertionError(f"节点 {node_id} 出现多次")
+        seen.add(node_id)
+        stack.extend(crdt.children(node_id))
+    expected = set(visible_nodes(crdt))
+    if seen != expected:
+        raise AssertionError(f"从根节点到达 {len(seen)} 个节点，可见节点 {len(expected)} 个")
+
+
+def run_round(seed, replicas, steps, gc_rate):
+    rng = random.Random(seed)
+    base = generate_tree(3, 3, 2, seed=seed)
+    names = [f"r{i}" for i in range(replicas)]
+    crdts = [CrdtTree.from_tree(base, name) for name in names]
+    trees = [crdt.to_tree() for crdt in crdts]
+    for crdt in crdts:
+        for name in names:
+            crdt.add_peer(name)
+    inbox = []
+    stats = {'ops': 0, 'syncs': 0, 'redone': 0, 'gc_log': 0, 'gc_ops': 0, 'delta_ops': 0, 'states': 0}
+    with tempfile.TemporaryDirectory() as folder:
+        for step in range(steps):
+            if step == steps // 2:
+                # 中途加入的新副本：其他副本没有登记它，先在一个已有副本登记，再从它取得完整状态
+                joiner = CrdtTree.from_tree(base, f"r{len(crdts)}")
+                crdts[0].merge(joiner.delta(crdts[0].version()))
+                joiner.merge(json.loads(json.dumps(crdts[0].delta(joiner.version()))))
+                stats['states'] += 1
+                crdts.append(joiner)
+                trees.append(base)
+                names.append(joiner.replica)
+            i = rng.randrange(len(crdts))
+            action = rng.random()
+            if action < 0.6:
+                random_local_op(crdts[i], trees[i], rng, step)
+                stats['ops'] += 1
+            elif action < 0.9:
+                j = rng.choice([j for j in range(len(crdts)) if j != i])
+                delta = crdts[i].delta(crdts[j].version())
+                stats['delta_ops'] += len(delta.get('ops', ()))
+                stats['states'] += 'state' in delta
+                result = sync(crdts[i], crdts[j], rng, inbox)
+                stats['syncs'] += 1
+                stats['redone'] += result['redone']
+            elif action < 0.9 + gc_rate:
+                collected = crdts[i].collect_garbage()
+                stats['gc_log'] += collected['log']
+                stats['gc_ops'] += collected['ops']
+            else:
+                # 保存后重新加载，Tree 中未同步的修改先记录
+                crdts[i].record(trees[i])
+                path = os.path.join(folder, f"{names[i]}.json")
+                crdts[i].save(path)
+                loaded = CrdtTree.load(path)
+                loaded._synced = crdts[i]._synced
+                loaded._dirty = crdts[i]._dirty
+                crdts[i] = loaded
+            if rng.random() < 0.3:
+                crdts[i].update_tree(trees[i])
+
+        # 全部同步直到没有新操作
+        for crdt, tree in zip(crdts, trees):
+            crdt.record(tree)
+        for _ in range(2):
+            for i in range(len(crdts)):
+                for j in range(len(crdts)):
+                    if i != j:
+                        crdts[j].merge(json.loads(json.dumps(crdts[i].delta(crdts[j].version()))))
+    hashes = set()
+    for crdt, tree in zip(crdts, trees):
+        check_tree(crdt)
+        expected = crdt.to_tree().root.subtree_hash()
+        hashes.add(expected)
+        crdt.update_tree(tree)
+        if tree.root.subtree_hash() != expected:
+            raise AssertionError(f"副本 {crdt.replica} 通过 update_tree() 维护的树与状态不一致")
+    if len(hashes) != 1:
+        raise AssertionError(f"{len(hashes)} 个不同的结果")
+    stats['nodes'] = len(visible_nodes(crdts[0]))
+    return stats
+
+
+def fuzz(args):
+    totals = {}
+    started = time.perf_counter()
+    seeds = [args.seed] if args.seed is not None else range(args.rounds)
+    for seed in seeds:
+        try:
+            stats = run_round(seed, args.replicas, args.steps, args.gc_rate)
+        except Exception:
+            print(f"种子 {seed} 失败，复现: python benchmarks/crdt_fuzz.py --seed {seed} "
+                  f"--replicas {args.replicas} --steps {args.steps}")
+            raise
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+    elapsed = time.perf_counter() - started
+    print(f"{len(seeds)} 轮全部收敛，耗时 {elapsed:.1f}s")
+    print(f"  本地修改 {totals['ops']} 次，同步 {totals['syncs']} 次（增量共 {totals['delta_ops']} 个操作，"
+          f"完整状态 {totals['states']} 次），撤销重做 {totals['redone']} 条")
+    print(f"  回收 move 日志 {totals['gc_log']} 条、操作 {totals['gc_ops']} 个，最终平均 {totals['nodes'] / len(seeds):.0f} 个节点")
+    return 0
+
+
+def bench_ops(crdt, ids, rng, count):
+    """在大树上做 count 个随机修改（不遍历整棵树）"""
+    created = []
+    for step in range(count):
+        choice = rng.random()
+        if choice < 0.3:
+            created.append(crdt.create(rng.choice(ids), f"节点 {step}"))
+        elif choice < 0.5:
+            node_id, parent_id = rng.choice(ids[1:] + created), rng.choice(ids + created)
+            if crdt.is_visible(node_id) and crdt.is_visible(parent_id) and not crdt.is_ancestor(node_id, parent_id):
+                crdt.move(node_id, parent_id)
+        elif choice < 0.7:
+            crdt.rename(rng.choice(ids), f"主题 {step}")
+        else:
+            crdt.append(rng.choice(ids + created), f"你: 消息 {step}\n")
+
+
+def bench(args):
+    base = generate_tree(args.depth, args.fanout, 2, seed=0)
+    ids = [node.id for node in base.root.walk()]
+    print(f"基础树 {len(ids)} 个节点")
+    for k in (10, 100, 1000):
+        a = CrdtTree.from_tree(base, "a")
+        b = CrdtTree.from_tree(base, "b")
+        rng = random.Random(k)
+        for crdt in (a, b):
+            bench_ops(crdt, ids, rng, k)
+        # 两边的时钟同步增长、时间戳交错，合并时要撤销并重做本地时间戳更大的操作
+        to_b = a.delta(b.version())
+        to_a = b.delta(a.version())
+        started = time.perf_counter()
+        result_b = b.merge(to_b)
+        result_a = a.merge(to_a)
+        elapsed = time.perf_counter() - started
+        same = a.to_tree().root.subtree_hash() == b.to_tree().root.subtree_hash()
+        size = len(json.dumps(to_b, ensure_ascii=False)) + len(json.dumps(to_a, ensure_ascii=False))
+        print(f"  各 {k:>4} 个修改: 增量 {size / 1024:.1f}KB，合并 {elapsed * 1000:.1f}ms "
+              f"（撤销重做 {result_a['redone'] + result_b['redone']} 条），{'一致' if same else '不一致'}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CRDT 随机收敛测试和合并开销测试")
+    parser.add_argument("--rounds", type=int, default=100, help="随机测试的轮数")
+    parser.add_argument("--seed", type=int, help="只运行指定种子的一轮")
+    parser.add_argument("--replicas", type=int, default=3, help="副本数")
+    parser.add_argument("--steps", type=int, default=300, help="每轮的步数")
+    parser.add_argument("--gc-rate", type=float, default=0.05, help="每步垃圾回收的概率")
+    parser.add_argument("--bench", action="store_true", help="测试合并开销而不是收敛")
+    parser.add_argument("--depth", type=int, default=5, help="合并开销测试中树的深度")
+    parser.add_argument("--fanout", type=int, default=6, help="合并开销测试中每个节点的子节点数")
+    args = parser.parse_args(argv)
+    return bench(args) if args.bench else fuzz(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
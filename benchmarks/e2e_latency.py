@@ -0,0 +1,161 @@
+"""
+端到端发送延迟测试
+
+在进程内启动模拟 Ollama 服务（benchmarks/mock_ollama.py），用 ChatService 重复执行与界面
+send_message 相同的流程：写入用户消息 -> 经调度器流式生成 -> 写回回复 -> 保存记录文件，
+报告排队时间、首字延迟、总耗时和保存耗时的分位数。服务端延迟固定，客户端测得的数值减去
+服务端设定值即为本程序自身的开销，可在不同版本之间直接比较。
+
+用法:
+    python benchmarks/e2e_latency.py
+    python benchmarks/e2e_latency.py --requests 50 --concurrency 8 --ttft 0.1 --tokens-per-sec 100
+    python benchmarks/e2e_latency.py --max-overhead 0.05   # 首字延迟 p95 开销超过 50ms 时退出码为 1
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_ollama import MockOllamaServer
+from core import tracing
+from core.ai_model import AIModel
+from core.scheduler import percentile
+from core.service import ChatService
+from core.settings import Settings
+
+
+def summarize(values):
+    """返回 {'p50', 'p95', 'max', 'mean'}，单位秒"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {'p50': None, 'p95': None, 'max': None, 'mean': None}
+    return {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95),
+            'max': values[-1], 'mean': statistics.fmean(values)}
+
+
+def run(server, requests, concurrency, model=None):
+    """
+    对 server 执行 requests 次发送，最多 concurrency 个同时进行
+
+    返回:
+        每次发送的结果列表 [{'queue_time', 'ttft', 'total', 'save', 'error'}]
+    """
+    ai_model = AIModel()
+    ai_model.set_base_url(server.url)
+    if model:
+        ai_model.model = model
+    settings = Settings(os.devnull)
+    settings.max_concurrent_generations = concurrency
+    settings.reserved_interactive_slots = 0
+    service = ChatService(settings, ai_model)
+    service.new_tree()
+    results = []
+    lock = threading.Lock()
+    pending = iter(range(requests))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "e2e.json")
+
+        def worker():
+            while True:
+                with lock:
+                    index = next(pending, None)
+                    if index is None:
+                        return
+                    node = service.add_child(service.tree.root, f"请求 {index}")
+                    service.append_user_message(f"第 {index} 个问题：请解释需求弹性。", node)
+                started = time.monotonic()
+                handle = service.start_reply(node)
+                handle.wait()
+                finished = time.monotonic()
+                with lock:
+                    save_started = time.perf_counter()
+                    service.save(file_path)
+                    save_time = time.perf_counter() - save_started
+                    results.append({
+                        'queue_time': handle.queue_time,
+                        'ttft': handle.ttft,
+                        'total': finished - started,
+                        'save': save_time,
+                        'error': None if handle.error is None else str(handle.error),
+                    })
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TreeChat 端到端发送延迟测试")
+    parser.add_argument("--requests", type=int, default=20, help="发送次数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的发送数")
+    parser.add_argument("--ttft", type=float, default=0.05, help="模拟服务的首字延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="模拟服务的生成速度")
+    parser.add_argument("--reply-tokens", type=int, default=32, help="每次回复的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务的失败概率")
+    parser.add_argument("--server-concurrency", type=int, help="模拟服务的并发上限，默认等于 --concurrency")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--max-overhead", type=float,
+                        help="首字延迟 p95 减去服务端设定值的上限（秒），超出时退出码为 1")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    parser.add_argument("--trace", help="统计各阶段耗时并导出到该文件（.jsonl 或 Prometheus 文本格式）")
+    args = parser.parse_args(argv)
+    if args.trace:
+        tracing.enable()
+
+    server = MockOllamaServer(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, reply_tokens=args.reply_tokens,
+                              error_rate=args.error_rate,
+                              max_concurrency=args.server_concurrency or args.concurrency, seed=args.seed)
+    with server:
+        started = time.monotonic()
+        results = run(server, args.requests, args.concurrency)
+        elapsed = time.monotonic() - started
+
+    ok = [r for r in results if r['error'] is None]
+    report = {
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'elapsed': elapsed,
+        'server': server.stats,
+        'expected_ttft': args.ttft,
+        'expected_generation': max(0, args.reply_tokens - 1) / args.tokens_per_sec,
+    }
+    for key in ('queue_time', 'ttft', 'total', 'save'):
+        report[key] = summarize(r[key] for r in ok)
+
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:8.1f}ms"
+
+    print(f"{report['requests']} 次发送，失败 {report['errors']} 次，总耗时 {elapsed:.2f}s，"
+          f"服务端峰值并发 {server.stats['peak_active']}")
+    print(f"服务端设定：首字 {ms(args.ttft)}  生成 {ms(report['expected_generation'])}")
+    for key, label in (('queue_time', "排队"), ('ttft', "首字"), ('total', "总耗时"), ('save', "保存")):
+        summary = report[key]
+        print(f"  {label:<4} p50 {ms(summary['p50'])}  p95 {ms(summary['p95'])}  最大 {ms(summary['max'])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    if args.trace:
+        tracing.export(args.trace)
+        print(tracing.tracer.format_summary())
+
+    if args.max_overhead is not None and report['ttft']['p95'] is not None:
+        overhead = report['ttft']['p95'] - args.ttft
+        if overhead > args.max_overhead:
+            print(f"首字延迟开销 {overhead * 1000:.1f}ms 超过上限 {args.max_overhead * 1000:.1f}ms")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
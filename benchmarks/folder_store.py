@@ -0,0 +1,95 @@
+"""
+文件夹存储（core.folder_store）与单个 JSON 记录文件的对比
+
+对同一棵合成树分别报告:
+    - 完整加载和完整保存的耗时；
+    - 只打开最深的一个节点（open_node）读取的文件数和耗时，与整棵树的加载对比；
+    - 在一个深层节点追加一条消息、修改一个节点的主题、移动一个子树后保存，写入的文件数和耗时
+      （JSON 记录文件每次都重写整个文件）。
+不同深度的树上 open_node 读取的文件数应随深度线性增长，与节点总数无关。最后检查重新加载的树与内存中的树哈希相同。
+
+用法:
+    python benchmarks/folder_store.py
+    python benchmarks/folder_store.py --depth 6 --fanout 4 --msgs 6
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generate_tree
+from core.folder_store import FolderStore
+from core.records import load_tree, save_tree
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def deepest(tree):
+    node = tree.root
+    while node.children:
+        node = node.children[-1]
+    return node
+
+
+def edits(tree):
+    """依次返回 (说明, 修改函数)，每个修改后各保存一次"""
+    node = deepest(tree)
+    yield "深层节点追加一条消息", lambda: node.chats.append("你: 再解释一下这个结论的前提条件。\n")
+    yield "修改一个节点的主题", lambda: setattr(tree.root.children[0], 'topic', "重新命名的主题")
+    yield "移动一个子树", lambda: tree.root.children[-1].children[0].move_to(tree.root.children[0])
+
+
+def compare(folder, depth, fanout, msgs, seed):
+    tree = generate_tree(depth, fanout, msgs, seed=seed)
+    nodes = sum(1 for _ in tree.root.walk())
+    json_path = os.path.join(folder, f"tree-{depth}.json")
+    store_path = os.path.join(folder, f"tree-{depth}")
+    _, json_save = timed(lambda: save_tree(tree, json_path))
+    store = FolderStore(store_path)
+    first, store_save = timed(lambda: store.save(tree))
+    _, json_load = timed(lambda: load_tree(json_path))
+    reader = FolderStore(store_path)
+    _, store_load = timed(reader.load)
+    print(f"深度 {depth}，{nodes} 个节点，JSON {os.path.getsize(json_path) / 1024:.0f}KB")
+    print(f"  完整保存: JSON {json_save * 1000:.1f}ms，文件夹 {store_save * 1000:.1f}ms（{first['files']} 个文件）")
+    print(f"  完整加载: JSON {json_load * 1000:.1f}ms，文件夹 {store_load * 1000:.1f}ms（{reader.reads} 个文件）")
+
+    relpath = reader.node_path(deepest(tree).id)
+    reader = FolderStore(store_path)
+    result, elapsed = timed(lambda: reader.open_node(relpath))
+    print(f"  打开最深的节点: 读取 {reader.reads} 个文件，{elapsed * 1000:.2f}ms"
+          f"（路径上 {len(result['path']) + 1} 个节点，{len(result['node'].chats)} 条消息）")
+
+    for label, edit in edits(tree):
+        edit()
+        _, json_save = timed(lambda: save_tree(tree, json_path))
+        stats, store_save = timed(lambda: store.save(tree))
+        print(f"  {label}后保存: JSON {json_save * 1000:.1f}ms，"
+              f"文件夹 {store_save * 1000:.2f}ms（{stats['files']} 个文件）")
+    if FolderStore(store_path).load().root.subtree_hash() != tree.root.subtree_hash():
+        raise AssertionError(f"深度 {depth}: 重新加载的树与内存中的树不同")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="文件夹存储与 JSON 记录文件的读写开销对比")
+    parser.add_argument("--depth", type=int, default=5, help="最大的树深度，从 2 开始逐级测试")
+    parser.add_argument("--fanout", type=int, default=4, help="每个节点的子节点数")
+    parser.add_argument("--msgs", type=int, default=4, help="每个节点的消息数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as folder:
+        for depth in range(2, args.depth + 1):
+            compare(folder, depth, args.fanout, args.msgs, args.seed)
+    print("重新加载的树与内存中的树相同")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""
+模拟 Ollama 服务，用于离线、可复现的延迟和负载测试
+
+用法:
+    python benchmarks/mock_ollama.py --port 11435 --ttft 0.2 --tokens-per-sec 50
+    python benchmarks/mock_ollama.py --error-rate 0.05 --max-concurrency 2 --max-queue 8
+
+然后在设置中把 Ollama 服务地址改为 http://127.0.0.1:11435，或在代码中:
+
+    with MockOllamaServer(ttft=0.1, tokens_per_sec=100) as server:
+        ai_model.set_base_url(server.url)
+
+实现的接口: GET /, GET /api/version, GET /api/tags, POST /api/show,
+POST /api/chat 和 POST /api/generate（流式和非流式），POST /api/embed 和 POST /api/embeddings。
+回复内容由请求和随机种子决定，最后一条响应带有与 Ollama 相同的计时字段
+（total_duration、prompt_eval_count、eval_count、eval_duration 等，单位纳秒）。
+向量由文本的字和相邻两字的哈希得到（见 embed_text()），字面相近的文本余弦相似度高，
+可以离线测试语义检索的流程，但不代表真实模型的效果。
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODELS = ["gemma3n:e4b", "gemma3:12b-it-qat", "deepseek-r1:8b"]
+
+# 生成回复时使用的词表，中英文混合以接近真实输出
+REPLY_WORDS = ["这是", "一个", "模拟", "的", "回复", "，", "用于", "测试", "延迟", "和", "吞吐", "。",
+               " model", " token", " latency", "经济", "增长", "需求", "供给", "价格", "\n"]
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端中止请求（如取消生成）时连接被重置，属于正常情况
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def estimate_tokens(text):
+    """粗略估计文本的 token 数"""
+    return max(1, len(text) // 3)
+
+
+def embed_text(text, dim):
+    """把文本的字和相邻两字哈希到 dim 维并归一化，返回浮点数列表"""
+    vector = [0.0] * dim
+    grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+    for gram in grams:
+        if gram.isspace():
+            continue
+        digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+class MockOllamaServer:
+    """
+    在后台线程中运行的模拟 Ollama 服务
+
+    - ttft：从收到请求（获得并发槽位后）到第一个 token 的秒数，jitter 为其随机波动比例；
+    - tokens_per_sec：生成速度，每个流式片段为一个 token；
+    - error_rate：请求以 HTTP 500 失败的概率，mid_stream_error_rate 为生成中途断流的概率；
+    - max_concurrency：同时生成的请求数上限，超出的请求排队，像 OLLAMA_NUM_PARALLEL；
+    - max_queue：排队请求数上限，超出时返回 503，像 OLLAMA_MAX_QUEUE（None 表示不限）。
+    """
+    def __init__(self, host="127.0.0.1", port=0, ttft=0.05, tokens_per_sec=200.0, reply_tokens=64,
+                 error_rate=0.0, mid_stream_error_rate=0.0, max_concurrency=4, max_queue=None,
+                 jitter=0.0, seed=0, models=None, embedding_dim=256, embed_latency=0.0):
+        """
+        参数:
+            host, port            - 监听地址，port 为 0 时自动选择空闲端口
+            ttft                  - 首个 token 的延迟（秒）
+            tokens_per_sec        - 每秒生成的 token 数
+            reply_tokens          - 每次回复的 token 数，可被请求的 options.num_predict 覆盖
+            error_rate            - 请求直接失败的概率
+            mid_stream_error_rate - 流式生成中途返回错误的概率
+            max_concurrency       - 同时生成的请求数上限
+            max_queue             - 排队请求数上限
+            jitter                - ttft 和 token 间隔的随机波动比例，如 0.1 表示 ±10%
+            seed                  - 随机种子，相同的种子和请求序列得到相同的错误和延迟
+            models                - /api/tags 返回的模型名称列表
+            embedding_dim         - /api/embed 返回的向量维数（不检查模型名称）
+            embed_latency         - 每次向量请求的延迟（秒）
+        """
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.mid_stream_error_rate = mid_stream_error_rate
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.jitter = jitter
+        self.models = list(models or DEFAULT_MODELS)
+        self.embedding_dim = embedding_dim
+        self.embed_latency = embed_latency
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(self.max_concurrency)
+        self.stats = {'requests': 0, 'completed': 0, 'errors': 0, 'rejected': 0, 'disconnected': 0,
+                      'active': 0, 'queued': 0, 'peak_active': 0, 'peak_queued': 0, 'tokens': 0,
+                      'embed_requests': 0, 'embedded': 0}
+        self._httpd = _HTTPServer((host, port), _make_handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中开始服务，返回自身"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"模拟 Ollama 服务已启动: {self.url}")
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def serve_forever(self):
+        """在当前线程中服务，直到 KeyboardInterrupt"""
+        logger.info(f"模拟 Ollama 服务已启动: {self.url}")
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self.stats[key] += delta
+
+    def _roll(self, probability):
+        with self._lock:
+            return self._rng.random() < probability
+
+    def _vary(self, value):
+        if not self.jitter:
+            return value
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.jitter, self.jitter)
+        return value * factor
+
+    def reply_tokens_for(self, prompt, model, count):
+        """根据提示和模型确定性地生成回复的 token 列表"""
+        digest = hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        return [rng.choice(REPLY_WORDS) for _ in range(count)]
+
+    def acquire_slot(self):
+        """获取生成槽位，排队已满时返回 False"""
+        with self._lock:
+            if self._slots.acquire(blocking=False):
+                self.stats['active'] += 1
+                self.stats['peak_active'] = max(self.stats['peak_active'], self.stats['active'])
+                return True
+            if self.max_queue is not None and self.stats['queued'] >= self.max_queue:
+                return False
+            self.stats['queued'] += 1
+            self.stats['peak_queued'] = max(self.stats['peak_queued'], self.stats['queued'])
+        self._slots.acquire()
+        with self._lock:
+            self.stats['queued'] -= 1
+            self.stats['active'] += 1
+            self.stats['peak_active'] = max(self.stats['peak_active'], self.stats['active'])
+        return True
+
+    def release_slot(self):
+        self._count('active', -1)
+        self._slots.release()
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _send_json(self, status, data):
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+
+        def do_GET(self):
+            if self.path == "/":
+                body = b"Ollama is running"
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif self.path == "/api/version":
+                self._send_json(200, {'version': "0.0.0-mock"})
+            elif self.path == "/api/tags":
+                self._send_json(200, {'models': [_model_info(name) for name in server.models]})
+            else:
+                self._send_json(404, {'error': "not found"})
+
+        def do_POST(self):
+            try:
+                request = self._read_json()
+            except ValueError as e:
+                self._send_json(400, {'error': f"invalid JSON: {e}"})
+                return
+            if self.path == "/api/show":
+                name = request.get('model') or request.get('name')
+                if name not in server.models:
+                    self._send_json(404, {'error': f"model '{name}' not found"})
+                else:
+                    self._send_json(200, {'details': _model_info(name)['details'], 'model_info': {}})
+            elif self.path in ("/api/chat", "/api/generate"):
+                self._generate(request, chat=self.path == "/api/chat")
+            elif self.path in ("/api/embed", "/api/embeddings"):
+                self._embed(request, legacy=self.path == "/api/embeddings")
+            else:
+                self._send_json(404, {'error': "not found"})
+
+        def _embed(self, request, legacy):
+            started = time.perf_counter()
+            server._count('embed_requests')
+            if server._roll(server.error_rate):
+                server._count('errors')
+                self._send_json(500, {'error': "mock: simulated server error"})
+                return
+            if legacy:
+                # 旧接口每次只接受一段文本
+                texts = [request.get('prompt', "")]
+            else:
+                texts = request.get('input', [])
+                if isinstance(texts, str):
+                    texts = [texts]
+            if server.embed_latency:
+                time.sleep(server._vary(server.embed_latency))
+            vectors = [embed_text(text, server.embedding_dim) for text in texts]
+            server._count('embedded', len(texts))
+            if legacy:
+                self._send_json(200, {'embedding': vectors[0]})
+                return
+            self._send_json(200, {'model': request.get('model', ""), 'embeddings': vectors,
+                                  'total_duration': int((time.perf_counter() - started) * 1e9),
+                                  'prompt_eval_count': sum(estimate_tokens(text) for text in texts)})
+
+        def _generate(self, request, chat):
+            received = time.perf_counter()
+            server._count('requests')
+            model = request.get('model') or ""
+            if model not in server.models:
+                server._count('errors')
+                self._send_json(404, {'error': f"model \"{model}\" not found, try pulling it first"})
+                return
+            if server._roll(server.error_rate):
+                server._count('errors')
+                self._send_json(500, {'error': "mock: simulated server error"})
+                return
+            if not server.acquire_slot():
+                server._count('rejected')
+                self._send_json(503, {'error': "server busy, please try again.  maximum pending requests exceeded"})
+                return
+            try:
+                self._respond(request, chat, model, received)
+            except (BrokenPipeError, ConnectionResetError):
+                server._count('disconnected')
+            finally:
+                server.release_slot()
+
+        def _respond(self, request, chat, model, received):
+            if chat:
+                prompt = "\n".join(m.get('content', "") for m in request.get('messages', []))
+            else:
+                prompt = request.get('prompt', "")
+            options = request.get('options') or {}
+            count = int(options.get('num_predict') or server.reply_tokens)
+            if count < 0:
+                count = server.reply_tokens
+            tokens = server.reply_tokens_for(prompt, model, count)
+            stream = request.get('stream', True)
+            fail_at = None
+            if stream and tokens and server._roll(server.mid_stream_error_rate):
+                fail_at = len(tokens) // 2
+
+            started = time.perf_counter()
+            time.sleep(server._vary(server.ttft))
+            first_token = time.perf_counter()
+            interval = 1.0 / server.tokens_per_sec if server.tokens_per_sec > 0 else 0
+
+            if stream:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+            for index, token in enumerate(tokens):
+                if index:
+                    time.sleep(server._vary(interval))
+                if index == fail_at:
+                    server._count('errors')
+                    self._write_chunk({'error': "mock: simulated error during generation"})
+                    self._end_chunks()
+                    return
+                if stream:
+                    self._write_chunk(_partial(model, chat, token))
+                server._count('tokens')
+            finished = time.perf_counter()
+
+            final = _partial(model, chat, "".join(tokens) if not stream else "")
+            final.update({
+                'done': True,
+                'done_reason': "stop",
+                'total_duration': int((finished - received) * 1e9),
+                'load_duration': int((started - received) * 1e9),
+                'prompt_eval_count': estimate_tokens(prompt),
+                'prompt_eval_duration': int((first_token - started) * 1e9),
+                'eval_count': len(tokens),
+                'eval_duration': int((finished - first_token) * 1e9),
+            })
+            server._count('completed')
+            if stream:
+                self._write_chunk(final)
+                self._end_chunks()
+            else:
+                self._send_json(200, final)
+
+        def _write_chunk(self, data):
+            body = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n")
+            self.wfile.flush()
+
+        def _end_chunks(self):
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _model_info(name):
+    return {
+        'name': name,
+        'model': name,
+        'modified_at': _now(),
+        'size': 0,
+        'digest': hashlib.sha256(name.encode("utf-8")).hexdigest(),
+        'details': {'format': "gguf", 'family': name.split(":")[0], 'parameter_size': "mock",
+                    'quantization_level': "mock"},
+    }
+
+
+def _partial(model, chat, text):
+    data = {'model': model, 'created_at': _now(), 'done': False}
+    if chat:
+        data['message'] = {'role': "assistant", 'content': text}
+    else:
+        data['response'] = text
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模拟 Ollama 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=0.05, help="首个 token 的延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="每秒生成的 token 数")
+    parser.add_argument("--reply-tokens", type=int, default=64, help="每次回复的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="请求失败的概率")
+    parser.add_argument("--mid-stream-error-rate", type=float, default=0.0, help="生成中途出错的概率")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="同时生成的请求数上限")
+    parser.add_argument("--max-queue", type=int, help="排队请求数上限，超出时返回 503")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机波动比例")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--model", action="append", help="提供的模型名称，可重复指定")
+    parser.add_argument("--embedding-dim", type=int, default=256, help="向量接口返回的维数")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="每次向量请求的延迟（秒）")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = MockOllamaServer(args.host, args.port, args.ttft, args.tokens_per_sec, args.reply_tokens,
+                              args.error_rate, args.mid_stream_error_rate, args.max_concurrency,
+                              args.max_queue, args.jitter, args.seed, args.model, args.embedding_dim,
+                              args.embed_latency)
+    server.serve_forever()
+    print(json.dumps(server.stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+回放真实记录中的提问，测量生成延迟
+
+从记录文件中取出每条 "你:" 消息，以该消息及其之前的对话作为上下文重新发送给模型（不写回记录），
+按设定的并发数和发送速率回放，报告排队时间、首字延迟、生成时间、总耗时和生成速度的分布；
+指定 --baseline 时与上一次的结果对比，p95 变慢超过阈值时退出码为 1。
+
+用法:
+    python benchmarks/replay.py records/*.json --mock                      # 对模拟服务回放
+    python benchmarks/replay.py records/经济学.json --concurrency 2 --rate 0.5 --output run1.json
+    python benchmarks/replay.py records/*.json --baseline run1.json --output run2.json
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.e2e_latency import summarize
+from benchmarks.mock_ollama import MockOllamaServer
+from core.generation import PRIORITY_NORMAL
+from core.records import load_tree
+from core.service import ChatService, chats_to_messages, message_kind
+from core.settings import Settings
+
+METRICS = ('queue_time', 'ttft', 'generation', 'total', 'tokens_per_sec')
+# 数值越大越好的指标，对比时方向相反
+HIGHER_IS_BETTER = ('tokens_per_sec',)
+# 耗时类指标变化不足该秒数时不视为退化，避免几毫秒的排队时间抖动被当成退化
+MIN_SIGNIFICANT = 0.005
+
+
+def extract_turns(tree, source, max_context=None):
+    """
+    取出树中所有用户提问
+
+    参数:
+        tree        - Tree 对象
+        source      - 来源名称（记录文件名），用于报告和公平排队
+        max_context - 最多保留的上下文消息数（含提问本身），为空时保留全部
+
+    返回:
+        [{'source', 'node_id', 'index', 'messages'}]，index 为提问在节点 chats 中的位置
+    """
+    turns = []
+    for node in tree.root.walk():
+        for index, chat in enumerate(node.chats):
+            if message_kind(chat) != 'user':
+                continue
+            messages = chats_to_messages(node.chats[:index + 1])
+            if max_context:
+                messages = messages[-max_context:]
+            turns.append({'source': source, 'node_id': node.id, 'index': index, 'messages': messages})
+    return turns
+
+
+def replay(service, turns, concurrency=1, rate=0.0, model=None, num_predict=None, on_done=None):
+    """
+    回放提问并收集每次生成的耗时
+
+    参数:
+        service     - ChatService 对象，请求经其调度器发送
+        turns       - extract_turns() 的结果
+        concurrency - 同时进行的请求数上限
+        rate        - 每秒发起的请求数，0 表示不限（只受 concurrency 限制）
+        model       - 使用的模型，为空时使用当前模型
+        num_predict - 每次最多生成的 token 数
+        on_done     - 回调 (结果字典)，每次请求结束时在工作线程中调用，可能被多个线程同时调用
+
+    返回:
+        每次请求的结果列表，顺序与 turns 一致
+    """
+    slots = threading.Semaphore(concurrency)
+    results = [None] * len(turns)
+    handles = []
+    options = {'num_predict': num_predict} if num_predict else None
+    interval = 1.0 / rate if rate > 0 else 0
+    started = time.monotonic()
+
+    def finished(handle, position):
+        final = handle.final or {}
+        eval_duration = final.get('eval_duration')
+        result = {
+            'source': turns[position]['source'],
+            'node_id': turns[position]['node_id'],
+            'index': turns[position]['index'],
+            'error': None if handle.error is None else str(handle.error),
+            'queue_time': handle.queue_time,
+            'ttft': handle.ttft,
+            'generation': handle.generation_time,
+            'total': handle.finished_at - handle.submitted_at,
+            'tokens_per_sec': final['eval_count'] / (eval_duration / 1e9) if eval_duration else None,
+        }
+        results[position] = result
+        slots.release()
+        if on_done:
+            on_done(result)
+
+    try:
+        for position, turn in enumerate(turns):
+            if interval:
+                # 开环发送：按计划时间发起，不因前面的请求变慢而推迟
+                delay = started + position * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            slots.acquire()
+            handles.append(service.scheduler.submit(
+                service.ai_model, turn['messages'], None, PRIORITY_NORMAL, model, options,
+                on_done=lambda handle, position=position: finished(handle, position),
+                fair_key=turn['source']))
+        for handle in handles:
+            handle.wait()
+    except KeyboardInterrupt:
+        for handle in handles:
+            handle.cancel()
+        for handle in handles:
+            handle.wait()
+    return [result for result in results if result is not None]
+
+
+def build_report(results, elapsed):
+    """汇总回放结果"""
+    ok = [r for r in results if r['error'] is None]
+    report = {'requests': len(results), 'errors': len(results) - len(ok), 'elapsed': elapsed,
+              'throughput': len(ok) / elapsed if elapsed else None}
+    for key in METRICS:
+        report[key] = summarize(r[key] for r in ok)
+    return report
+
+
+def compare(report, baseline, threshold):
+    """
+    对比两次回放的 p95
+
+    返回:
+        退化的指标列表 [(指标, 本次 p95, 上次 p95)]
+    """
+    regressions = []
+    for key in METRICS:
+        current = report.get(key, {}).get('p95')
+        previous = baseline.get(key, {}).get('p95')
+        if current is None or not previous:
+            continue
+        if key in HIGHER_IS_BETTER:
+            worse = current < previous * (1 - threshold)
+        else:
+            worse = current > previous * (1 + threshold) and current - previous > MIN_SIGNIFICANT
+        if worse:
+            regressions.append((key, current, previous))
+    error_rate = report['errors'] / report['requests'] if report['requests'] else 0
+    previous_rate = baseline['errors'] / baseline['requests'] if baseline.get('requests') else 0
+    if error_rate > previous_rate + threshold / 10:
+        regressions.append(('error_rate', error_rate, previous_rate))
+    return regressions
+
+
+def format_report(report, baseline=None):
+    def fmt(key, value):
+        if value is None:
+            return "-"
+        if key == 'tokens_per_sec':
+            return f"{value:.1f}"
+        return f"{value * 1000:.0f}ms"
+
+    lines = [f"{report['requests']} 次请求，失败 {report['errors']} 次，耗时 {report['elapsed']:.1f}s，"
+             f"吞吐 {report['throughput'] or 0:.2f} 次/秒"]
+    labels = {'queue_time': "排队", 'ttft': "首字", 'generation': "生成", 'total': "总耗时",
+              'tokens_per_sec': "tok/s"}
+    for key in METRICS:
+        summary = report[key]
+        line = (f"  {labels[key]:<6} p50 {fmt(key, summary['p50']):>8}  p95 {fmt(key, summary['p95']):>8}  "
+                f"最大 {fmt(key, summary['max']):>8}")
+        previous = (baseline or {}).get(key, {}).get('p95')
+        if previous and summary['p95'] is not None:
+            line += f"  上次 p95 {fmt(key, previous):>8} ({(summary['p95'] / previous - 1) * 100:+.0f}%)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回放记录文件中的提问并测量延迟")
+    parser.add_argument("files", nargs="+", help="记录文件，可使用通配符")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时进行的请求数")
+    parser.add_argument("--rate", type=float, default=0.0, help="每秒发起的请求数，0 表示不限")
+    parser.add_argument("--limit", type=int, help="最多回放的提问数")
+    parser.add_argument("--shuffle", action="store_true", help="打乱提问顺序")
+    parser.add_argument("--seed", type=int, default=0, help="打乱顺序和模拟服务使用的随机种子")
+    parser.add_argument("--max-context", type=int, help="每次请求最多保留的上下文消息数")
+    parser.add_argument("--model", help="使用的模型")
+    parser.add_argument("--num-predict", type=int, help="每次最多生成的 token 数")
+    parser.add_argument("--mock", action="store_true", help="在进程内启动模拟 Ollama 服务并对其回放")
+    parser.add_argument("--mock-ttft", type=float, default=0.05, help="模拟服务的首字延迟（秒）")
+    parser.add_argument("--mock-tokens-per-sec", type=float, default=200.0, help="模拟服务的生成速度")
+    parser.add_argument("--output", help="将本次结果写入 JSON 文件，可作为下次的 --baseline")
+    parser.add_argument("--baseline", help="上一次回放的结果文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 允许的变化比例")
+    args = parser.parse_args(argv)
+
+    turns = []
+    for pattern in args.files:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            turns.extend(extract_turns(load_tree(path), os.path.basename(path), args.max_context))
+    if args.shuffle:
+        random.Random(args.seed).shuffle(turns)
+    if args.limit:
+        turns = turns[:args.limit]
+    if not turns:
+        print("记录文件中没有用户提问")
+        return 1
+
+    server = None
+    if args.mock:
+        server = MockOllamaServer(ttft=args.mock_ttft, tokens_per_sec=args.mock_tokens_per_sec,
+                                  max_concurrency=args.concurrency, seed=args.seed).start()
+    try:
+        settings = Settings()
+        settings.max_concurrent_generations = args.concurrency
+        settings.reserved_interactive_slots = 0
+        service = ChatService(settings)
+        if server is not None:
+            service.ai_model.set_base_url(server.url)
+        done = [0]
+        # on_done 在多个工作线程中调用，计数和输出放在锁内，避免进度行交错、序号重复
+        progress_lock = threading.Lock()
+
+        def on_done(result):
+            status = "失败" if result['error'] else "完成"
+            with progress_lock:
+                done[0] += 1
+                print(f"[{done[0]}/{len(turns)}] {result['source']} {result['node_id'][:8]}#{result['index']} {status}",
+                      file=sys.stderr)
+
+        print(f"回放 {len(turns)} 条提问，并发 {args.concurrency}，"
+              f"速率 {args.rate or '不限'}，服务地址 {service.ai_model.base_url}", file=sys.stderr)
+        started = time.monotonic()
+        results = replay(service, turns, args.concurrency, args.rate, args.model, args.num_predict, on_done)
+        report = build_report(results, time.monotonic() - started)
+    finally:
+        if server is not None:
+            server.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)['report']
+    print(format_report(report, baseline))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({'report': report, 'results': results}, f, ensure_ascii=False, indent=4)
+
+    if baseline:
+        regressions = compare(report, baseline, args.threshold)
+        for key, current, previous in regressions:
+            print(f"退化: {key} {previous:.4g} -> {current:.4g}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+核心与持久化路径的基准测试
+
+用法:
+    python benchmarks/run_benchmarks.py                        # 运行并与 benchmarks/baseline.json 对比
+    python benchmarks/run_benchmarks.py --profile large --records
+    python benchmarks/run_benchmarks.py --save-baseline        # 用本次结果覆盖基线
+
+每个用例报告多次运行的最短和中位耗时，以及单独一次运行在 tracemalloc 下的峰值内存。
+中位耗时超过基线 (1 + threshold) 倍的用例视为退化，此时退出码为 1。
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generate_tree
+from core.records import load_tree, save_tree, serialize_node
+from core.service import ChatService
+from core.settings import Settings
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+RECORDS_DIR = os.path.join(os.path.dirname(BENCH_DIR), "records")
+# 耗时增加不足该秒数时不视为退化，避免极短用例的计时抖动
+MIN_SIGNIFICANT = 0.001
+
+# 合成树规模：(层数, 分叉数, 每节点平均消息数)
+PROFILES = {
+    'small': (3, 4, 6),
+    'medium': (4, 6, 6),
+    'large': (5, 6, 8),
+}
+
+
+def make_treeview():
+    """创建隐藏窗口中的 Treeview，没有图形环境时返回 None"""
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        root = tk.Tk()
+    except Exception:
+        return None, None
+    root.withdraw()
+    return root, ttk.Treeview(root)
+
+
+def render_case(tree):
+    """使用 MainWindow 的插入逻辑把整棵树渲染进 Treeview"""
+    root, treeview = make_treeview()
+    if treeview is None:
+        return None
+    from ui.main_window import MainWindow
+
+    class Display:
+        tree_display = treeview
+
+        def insert_node(self, node, parent=""):
+            MainWindow.insert_node(self, node, parent)
+
+    display = Display()
+
+    def run():
+        for item in treeview.get_children():
+            treeview.delete(item)
+        display.insert_node(tree.root)
+        root.update_idletasks()
+    return run
+
+
+def build_cases(tree, tmp_dir):
+    """返回 {用例名: 无参函数}"""
+    rng = random.Random(1)
+    ids = [node.id for node in tree.root.walk()]
+    lookup_ids = [rng.choice(ids) for _ in range(200)]
+    file_path = os.path.join(tmp_dir, "bench.json")
+    save_tree(tree, file_path)
+    service = ChatService(Settings(os.devnull))
+    service.tree = tree
+
+    cases = {
+        'lookup': lambda: [tree.find_node(node_id) for node_id in lookup_ids],
+        'serialize': lambda: serialize_node(tree.root),
+        'save': lambda: save_tree(tree, file_path),
+        'load': lambda: load_tree(file_path),
+        'search': lambda: service.search("经济"),
+    }
+    render = render_case(tree)
+    if render is not None:
+        cases['render'] = render
+    return cases
+
+
+def measure(func, repeat):
+    """返回 (最短耗时, 中位耗时, 峰值内存字节数)"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), statistics.median(times), peak
+
+
+def load_fixtures(profiles, use_records, seed):
+    """返回 [(名称, Tree)]"""
+    fixtures = []
+    for name in profiles:
+        depth, fanout, messages = PROFILES[name]
+        fixtures.append((f"synthetic-{name}", generate_tree(depth, fanout, messages, seed=seed)))
+    if use_records:
+        for path in sorted(glob.glob(os.path.join(RECORDS_DIR, "*.json"))):
+            fixtures.append((f"records/{os.path.basename(path)}", load_tree(path)))
+    return fixtures
+
+
+def compare(results, baseline, threshold):
+    """返回退化的用例列表 [(夹具, 用例, 本次中位耗时, 基线中位耗时)]"""
+    regressions = []
+    for fixture, cases in results.items():
+        for case, result in cases.items():
+            base = baseline.get(fixture, {}).get(case)
+            if (base and result['median'] > base['median'] * (1 + threshold)
+                    and result['median'] - base['median'] > MIN_SIGNIFICANT):
+                regressions.append((fixture, case, result['median'], base['median']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TreeChat 基准测试")
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES),
+                        help="合成树规模，可重复指定，默认 small 和 medium")
+    parser.add_argument("--records", action="store_true", help="同时使用 records/ 中的真实记录文件")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例的运行次数")
+    parser.add_argument("--seed", type=int, default=0, help="合成树的随机种子")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的中位耗时增幅")
+    parser.add_argument("--save-baseline", action="store_true", help="用本次结果覆盖基线文件")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for fixture, tree in load_fixtures(args.profile or ['small', 'medium'], args.records, args.seed):
+            nodes = sum(1 for _ in tree.root.walk())
+            messages = sum(len(node.chats) for node in tree.root.walk())
+            print(f"== {fixture}: {nodes} 个节点, {messages} 条消息")
+            results[fixture] = {}
+            for case, func in build_cases(tree, tmp_dir).items():
+                best, median, peak = measure(func, args.repeat)
+                results[fixture][case] = {'min': round(best, 6), 'median': round(median, 6), 'peak_bytes': peak}
+                base = baseline.get(fixture, {}).get(case)
+                delta = f"{(median / base['median'] - 1) * 100:+.0f}%" if base and base['median'] else "-"
+                print(f"  {case:<10} 最短 {best * 1000:9.2f}ms  中位 {median * 1000:9.2f}ms  "
+                      f"峰值内存 {peak / 1024:10.1f}KB  对比基线 {delta}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        print(f"基线已保存至 {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for fixture, case, median, base in regressions:
+        print(f"退化: {fixture} {case} {base * 1000:.2f}ms -> {median * 1000:.2f}ms")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
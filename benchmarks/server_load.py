@@ -0,0 +1,269 @@
+"""
+服务端负载测试：大量 WebSocket 客户端同时订阅一棵树，部分客户端持续修改
+
+服务端（core.server.TreeServer）和模拟 Ollama 服务在子进程中运行，本进程用 asyncio 模拟客户端：
+所有客户端都订阅树的事件，其中 --writers 个客户端按 --rate 的速率发送请求（追加消息、创建和重命名节点、
+读取节点，每 --generate-every 次追加请求一次生成）。报告请求往返时间、事件从发出请求到被其他客户端
+收到的延迟（扇出延迟）、吞吐量和服务端占用的 CPU 时间。
+
+用法:
+    python benchmarks/server_load.py --clients 300 --writers 30 --duration 20
+    python benchmarks/server_load.py --clients 500 --writers 50 --rate 1 --output load.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.e2e_latency import summarize
+from core.server import MAX_BODY_BYTES, OP_CLOSE, OP_PING, OP_PONG, encode_frame, read_message
+
+TREE = "load-test"
+# 追加的消息中带有发送时间，用于计算扇出延迟
+MARK = "load@"
+
+
+def run_server(port_queue, records_folder, mock_options):
+    """子进程：启动模拟 Ollama 服务和 TreeServer，把端口放入 port_queue"""
+    from benchmarks.mock_ollama import MockOllamaServer
+    from core.server import TreeServer
+    from core.settings import Settings
+
+    mock = MockOllamaServer(**mock_options).start()
+    settings = Settings(os.devnull)
+    settings.records_folder = records_folder
+    settings.max_concurrent_generations = mock_options.get('max_concurrency', 4)
+    settings.reserved_interactive_slots = 0
+    from core.ai_model import AIModel
+    ai_model = AIModel()
+    ai_model.set_base_url(mock.url)
+    server = TreeServer(settings, port=0, ai_model=ai_model)
+
+    async def main():
+        port_queue.put(await server.start())
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(main())
+    finally:
+        mock.stop()
+
+
+class LoadClient:
+    """最小的 WebSocket 客户端"""
+    def __init__(self, number, on_event):
+        self.number = number
+        self.on_event = on_event
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.counter = 0
+        self.events = 0
+        self.task = None
+
+    async def connect(self, host, port, tree):
+        self.reader, self.writer = await asyncio.open_connection(host, port, limit=MAX_BODY_BYTES)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        self.writer.write((f"GET /api/trees/{quote(tree)}/ws HTTP/1.1\r\nHost: {host}:{port}\r\n"
+                           "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                           f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("latin-1"))
+        status = await self.reader.readline()
+        if b" 101 " not in status:
+            raise ConnectionError(f"握手失败: {status!r}")
+        while (await self.reader.readline()) not in (b"\r\n", b""):
+            pass
+        self.task = asyncio.create_task(self._read_loop())
+
+    async def request(self, op, **params):
+        self.counter += 1
+        params.update(id=self.counter, op=op)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.counter] = future
+        self.writer.write(encode_frame(json.dumps(params, ensure_ascii=False), mask=True))
+        reply = await future
+        if not reply['ok']:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    async def _read_loop(self):
+        try:
+            while True:
+                opcode, data = await read_message(self.reader)
+                if opcode == OP_CLOSE:
+                    break
+                if opcode == OP_PING:
+                    self.writer.write(encode_frame(data, OP_PONG, mask=True))
+                    continue
+                message = json.loads(data)
+                if message['type'] == 'result':
+                    future = self.pending.pop(message['id'], None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                else:
+                    self.events += 1
+                    self.on_event(self, message)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("连接已断开"))
+
+    async def close(self):
+        try:
+            self.writer.write(encode_frame(b"\x03\xe8", OP_CLOSE, mask=True))
+            await asyncio.wait_for(self.task, 5)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        self.writer.close()
+
+
+async def fetch_json(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+    data = await reader.read()
+    writer.close()
+    return json.loads(data.split(b"\r\n\r\n", 1)[1])
+
+
+async def run_load(host, port, clients, writers, duration, rate, generate_every, seed):
+    """
+    运行负载
+
+    返回:
+        报告字典
+    """
+    rng = random.Random(seed)
+    op_latency = {}
+    fanout = []
+    errors = []
+
+    def on_event(client, event):
+        message = event.get('message') or ""
+        if event['event'] == 'message' and MARK in message:
+            sent = float(message.rsplit(MARK, 1)[1])
+            fanout.append(time.monotonic() - sent)
+
+    connect_started = time.monotonic()
+    pool = [LoadClient(i, on_event) for i in range(clients)]
+    # 分批建立连接，避免瞬间占满监听队列
+    for start in range(0, clients, 50):
+        await asyncio.gather(*(client.connect(host, port, TREE) for client in pool[start:start + 50]))
+    subscribed = await asyncio.gather(*(client.request('subscribe') for client in pool))
+    connect_time = time.monotonic() - connect_started
+    root_id = subscribed[0]['root']
+
+    async def writer_loop(client):
+        # 每个写入者在根节点下有自己的节点，操作互不冲突
+        own = await client.request('create', parent=root_id, topic=f"客户端 {client.number}")
+        appends = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            await asyncio.sleep(rng.expovariate(rate))
+            choice = rng.random()
+            started = time.monotonic()
+            try:
+                if choice < 0.6:
+                    appends += 1
+                    generate = bool(generate_every) and appends % generate_every == 0
+                    op = 'append'
+                    await client.request('append', node=own['id'], text=f"第 {appends} 条 {MARK}{started}",
+                                         generate=generate)
+                elif choice < 0.75:
+                    op = 'create'
+                    await client.request('create', parent=own['id'], topic=f"子节点 {appends}")
+                elif choice < 0.85:
+                    op = 'rename'
+                    await client.request('rename', node=own['id'], topic=f"客户端 {client.number} #{appends}")
+                else:
+                    op = 'get'
+                    await client.request('get', node=own['id'], since=max(0, appends - 5))
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            op_latency.setdefault(op, []).append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(writer_loop(client) for client in pool[:writers]))
+    # 等待最后的事件送达
+    await asyncio.sleep(0.5)
+    elapsed = time.monotonic() - started
+    stats = await fetch_json(host, port, "/api/stats")
+    events = sum(client.events for client in pool)
+    await asyncio.gather(*(client.close() for client in pool))
+
+    all_ops = [value for values in op_latency.values() for value in values]
+    report = {'clients': clients, 'writers': writers, 'duration': elapsed, 'connect_time': connect_time,
+              'requests': len(all_ops), 'errors': len(errors), 'throughput': len(all_ops) / elapsed,
+              'events_received': events, 'events_per_sec': events / elapsed,
+              'latency': summarize(all_ops), 'fanout': summarize(fanout),
+              'by_op': {op: summarize(values) for op, values in op_latency.items()},
+              'server': stats}
+    if errors:
+        report['first_error'] = errors[0]
+    return report
+
+
+def format_report(report):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.1f}ms"
+
+    server = report['server']
+    lines = [f"{report['clients']} 个客户端（{report['writers']} 个写入），连接和订阅耗时 {report['connect_time']:.2f}s",
+             f"{report['requests']} 次请求，失败 {report['errors']} 次，{report['throughput']:.0f} 次/秒；"
+             f"收到 {report['events_received']} 个事件，{report['events_per_sec']:.0f} 个/秒",
+             f"  请求往返  p50 {ms(report['latency']['p50'])}  p95 {ms(report['latency']['p95'])}  "
+             f"最大 {ms(report['latency']['max'])}",
+             f"  扇出延迟  p50 {ms(report['fanout']['p50'])}  p95 {ms(report['fanout']['p95'])}  "
+             f"最大 {ms(report['fanout']['max'])}"]
+    for op, summary in sorted(report['by_op'].items()):
+        lines.append(f"  {op:<8}  p50 {ms(summary['p50'])}  p95 {ms(summary['p95'])}")
+    lines.append(f"服务端: 生成 {server['generations']} 次，推送帧 {server['frames']} 个，"
+                 f"CPU {server.get('cpu_time', 0):.1f}s / {report['duration']:.1f}s")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对 TreeServer 进行多客户端负载测试")
+    parser.add_argument("--clients", type=int, default=200, help="订阅的客户端数")
+    parser.add_argument("--writers", type=int, default=20, help="其中持续发送请求的客户端数")
+    parser.add_argument("--rate", type=float, default=2.0, help="每个写入客户端每秒的请求数")
+    parser.add_argument("--duration", type=float, default=10.0, help="持续时间（秒）")
+    parser.add_argument("--generate-every", type=int, default=5, help="每隔多少次追加请求一次生成，0 表示不生成")
+    parser.add_argument("--mock-ttft", type=float, default=0.05, help="模拟服务的首字延迟（秒）")
+    parser.add_argument("--mock-tokens-per-sec", type=float, default=200.0, help="模拟服务的生成速度")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    records_folder = tempfile.mkdtemp(prefix="treechat-load-")
+    port_queue = multiprocessing.Queue()
+    mock_options = {'ttft': args.mock_ttft, 'tokens_per_sec': args.mock_tokens_per_sec, 'reply_tokens': 32,
+                    'max_concurrency': 4, 'seed': args.seed}
+    process = multiprocessing.Process(target=run_server, args=(port_queue, records_folder, mock_options), daemon=True)
+    process.start()
+    try:
+        port = port_queue.get(timeout=30)
+        report = asyncio.run(run_load("127.0.0.1", port, args.clients, args.writers, args.duration, args.rate,
+                                      args.generate_every, args.seed))
+    finally:
+        process.terminate()
+        process.join()
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
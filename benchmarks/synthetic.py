@@ -0,0 +1,80 @@
+"""
+合成聊天树生成器，用于基准测试
+
+同一组参数和随机种子总是生成相同的树（包括节点 ID），便于不同版本之间对比。
+"""
+import random
+import uuid
+
+from core.tree import Tree, TreeNode
+
+# 常用汉字，生成的中文文本接近真实记录的字符分布
+CJK_CHARS = ("的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说"
+             "产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从"
+             "业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么"
+             "利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常"
+             "文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被"
+             "干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六"
+             "共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科"
+             "张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非"
+             "验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标")
+ASCII_WORDS = ["model", "GDP", "Nash", "Cournot", "API", "JSON", "elasticity", "Q = a - bP", "x^2", "\\frac{a}{b}"]
+PUNCTUATION = "，。；：？！、"
+
+
+def random_text(rng, length, cjk=True):
+    """生成指定长度左右的随机文本，cjk 为 False 时只使用 ASCII 单词"""
+    parts = []
+    size = 0
+    while size < length:
+        if cjk and rng.random() < 0.85:
+            word = "".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(2, 12)))
+            word += rng.choice(PUNCTUATION)
+        else:
+            word = rng.choice(ASCII_WORDS) + " "
+        parts.append(word)
+        size += len(word)
+    return "".join(parts)
+
+
+def random_message(rng, cjk=True):
+    """按真实记录的比例生成一条 "你:" / "AI:" / "系统:" 消息"""
+    roll = rng.random()
+    if roll < 0.4:
+        return f"你: {random_text(rng, rng.randint(10, 200), cjk)}\n"
+    if roll < 0.85:
+        return f"AI: {random_text(rng, rng.randint(200, 2000), cjk)}\n"
+    return f"系统: 在 '{random_text(rng, 6, cjk)}' 下添加了子节点 '新主题'。\n"
+
+
+def generate_tree(depth=4, fanout=4, messages_per_node=6, seed=0, cjk=True):
+    """
+    生成一棵完全 fanout 叉的合成聊天树
+
+    参数:
+        depth             - 树的层数（根节点为第 0 层）
+        fanout            - 每个非叶子节点的子节点数
+        messages_per_node - 每个节点的平均消息数（实际数量在 0 到 2 倍之间随机）
+        seed              - 随机种子
+        cjk               - 是否生成中文文本
+
+    返回:
+        Tree 对象
+    """
+    rng = random.Random(seed)
+    tree = Tree()
+    # 节点在出栈时才创建，直接使用由种子决定的 ID；随机数的使用顺序与生成的树保持不变
+    stack = [(None, tree.root.topic, 0)]
+    while stack:
+        parent, topic, level = stack.pop()
+        node = TreeNode(topic, str(uuid.UUID(int=rng.getrandbits(128), version=4)))
+        if parent is None:
+            tree.root = tree.current_node = node
+        else:
+            # 同一父节点的子节点按倒序出栈，插到最前面以保持原来的顺序
+            parent.insert_child(0, node)
+        node.chats = [random_message(rng, cjk) for _ in range(rng.randint(0, 2 * messages_per_node))]
+        if level < depth:
+            for _ in range(fanout):
+                stack.append((node, random_text(rng, rng.randint(4, 30), cjk), level + 1))
+    return tree
@@ -0,0 +1,99 @@
+"""
+多工作区（core.workspace）的切换、卸载和重新加载耗时
+
+生成若干棵合成树写入临时文件夹，在 --limit-mb 的内存上限下依次打开，然后按随机顺序切换工作区，
+每次切换前在当前工作区追加一条消息。报告切换到仍在内存中的工作区和已被卸载的工作区的耗时，
+以及卸载次数；最后检查所有修改都已写回或仍在内存中。
+
+用法:
+    python benchmarks/workspaces.py --workspaces 6 --limit-mb 20
+    python benchmarks/workspaces.py --depth 5 --fanout 6 --switches 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.e2e_latency import summarize
+from benchmarks.synthetic import generate_tree
+from core.memory import format_bytes
+from core.records import load_tree, save_tree
+from core.settings import Settings
+from core.workspace import WorkspaceManager
+
+
+def run(args, folder):
+    paths = []
+    for i in range(args.workspaces):
+        path = os.path.join(folder, f"workspace-{i}.json")
+        save_tree(generate_tree(args.depth, args.fanout, args.msgs, seed=i), path)
+        paths.append(path)
+    settings = Settings(os.devnull)
+    settings.records_folder = folder
+    manager = WorkspaceManager(settings, memory_limit=int(args.limit_mb * 1024 * 1024))
+
+    opened = []
+    for path in paths:
+        started = time.perf_counter()
+        manager.open(path)
+        opened.append(time.perf_counter() - started)
+
+    rng = random.Random(args.seed)
+    # 每个工作区最后追加的消息，用于检查修改没有丢失
+    expected = {}
+    warm, cold = [], []
+    for step in range(args.switches):
+        workspace = manager.active
+        message = f"你: 第 {step} 条\n"
+        workspace.service.append_chat(message, workspace.tree.root)
+        expected[workspace.path] = message
+        # 偏向最近使用的工作区，与实际使用习惯接近
+        recent = sorted(manager.workspaces, key=lambda w: w.last_used, reverse=True)
+        target = recent[min(int(rng.expovariate(0.7)), len(recent) - 1)]
+        loaded = target.loaded
+        started = time.perf_counter()
+        manager.activate(target)
+        (warm if loaded else cold).append(time.perf_counter() - started)
+
+    manager.save_all()
+    for path, message in expected.items():
+        if load_tree(path).root.chats[-1] != message:
+            raise AssertionError(f"{path} 的修改丢失")
+    return {'open': opened, 'warm': warm, 'cold': cold,
+            'evictions': sum(w.evictions for w in manager.workspaces),
+            'loaded': sum(w.loaded for w in manager.workspaces),
+            'bytes': max(w.bytes for w in manager.workspaces)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多工作区切换、卸载和重新加载耗时")
+    parser.add_argument("--workspaces", type=int, default=6, help="工作区数")
+    parser.add_argument("--depth", type=int, default=4, help="每棵树的深度")
+    parser.add_argument("--fanout", type=int, default=6, help="每个节点的子节点数")
+    parser.add_argument("--msgs", type=int, default=3, help="每个节点的消息数")
+    parser.add_argument("--limit-mb", type=float, default=20, help="内存上限（MB）")
+    parser.add_argument("--switches", type=int, default=100, help="切换次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        report = run(args, folder)
+
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.2f}ms"
+
+    print(f"{args.workspaces} 个工作区，单个约 {format_bytes(report['bytes'])}，上限 {args.limit_mb:g}MB，"
+          f"结束时 {report['loaded']} 个在内存中，共卸载 {report['evictions']} 次")
+    for key, label in (('open', "首次打开"), ('warm', "切换（在内存中）"), ('cold', "切换（重新加载）")):
+        summary = summarize(report[key])
+        print(f"  {label}: {len(report[key])} 次，p50 {ms(summary['p50'])}  p95 {ms(summary['p95'])}")
+    print("所有修改均已保留")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,564 @@
+"""
+TreeChat 命令行入口，不依赖 tkinter / customtkinter
+
+用法示例:
+    python cli.py stats
+    python cli.py search 弹性 --file records/经济学.json
+    python cli.py ask "你好" --node <节点ID>
+    python cli.py ask "弹性和税负的关系" --node <节点ID> --retrieve --budget 300
+    python cli.py import other.json --parent <节点ID>
+    python cli.py import exports/ more/*.json --workers 8 --verbose
+    python cli.py convert records/经济学.json records/经济学/     # 以 / 结尾时转换为一个节点一个文件夹的存储
+    python cli.py read records/经济学/1f0c2a9b/7d3e55c0
+    python cli.py dedup records/*.json                          # 统计重复的消息，报告去重格式节省的空间
+    python cli.py convert records/经济学.json 经济学.dedup.json --dedup
+    python cli.py export -o out.json --node <节点ID>
+    python cli.py export -o out.md          # 按扩展名导出为 Markdown 或 HTML
+    python cli.py batch "用一句话总结：{chats}" --select leaves --concurrency 4
+    python cli.py fanout "换个角度回答" --node <节点ID> -n 3 --variant "gemma3:12b-it-qat@0.2"
+    python cli.py memory --top 5 --tracemalloc
+    python cli.py hash records/a.json records/b.json
+    python cli.py diff old.json new.json
+    python cli.py archive --codec lzma -o archived.json
+    python cli.py semantic "通胀预期的讨论" --file records/经济学.json -k 5
+    python cli.py merge base.json ours.json theirs.json -o merged.json
+    python cli.py serve --port 8765
+    python cli.py perf --model gemma3n:e4b --model deepseek-r1:8b --repeat 3
+    python cli.py --trace metrics.prom stats
+
+向量索引（numpy）、服务端（asyncio）和批量导入（进程池）相关的模块只在对应的子命令中导入，其他命令启动时不加载。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from core import tracing
+from core.archive import CODECS, archive_stats, compress_cold_nodes
+from core.batch import BatchJob, select_nodes
+from core.dedup import dedup_report, format_dedup_report
+from core.diff import diff_trees, merge_trees
+from core.export import write_export
+from core.folder_store import find_store_root, is_folder_store, open_store
+from core.fanout import FanOut, Variant, default_variants
+from core.memory import format_bytes, format_report, memory_report, trace_allocations
+from core.records import load_tree, save_node, save_tree, serialize_node
+from core.service import ChatService
+from core.settings import Settings
+
+
+def open_service(args):
+    """按命令行参数创建服务并加载记录文件"""
+    service = ChatService()
+    if args.records_folder:
+        service.settings.records_folder = args.records_folder
+    args.file = args.file or service.records_path
+    try:
+        service.load(args.file)
+    except FileNotFoundError:
+        if not getattr(args, 'create', False):
+            raise
+    return service
+
+
+def resolve_node(service, node_id):
+    """根据 ID 查找节点，为空时返回根节点"""
+    if not node_id:
+        return service.tree.root
+    node = service.find_node(node_id)
+    if node is None:
+        raise SystemExit(f"找不到节点: {node_id}")
+    return node
+
+
+def cmd_stats(args):
+    service = open_service(args)
+    node = resolve_node(service, args.node)
+    for key, value in service.stats(node).items():
+        print(f"{key}: {value}")
+
+
+def cmd_search(args):
+    service = open_service(args)
+    node = resolve_node(service, args.node)
+    results = service.search(args.keyword, node)
+    for path, found, chat in results[:args.limit] if args.limit else results:
+        location = " / ".join(topic.replace("\n", " ")[:30] for topic in path)
+        if chat is None:
+            print(f"[{found.id}] {location}")
+        else:
+            text = chat.strip().replace("\n", " ")
+            print(f"[{found.id}] {location}: {text[:200]}")
+    print(f"共 {len(results)} 条结果", file=sys.stderr)
+
+
+def cmd_ask(args):
+    args.create = True
+    service = open_service(args)
+    service.tree.set_current_node(resolve_node(service, args.node))
+    if args.model:
+        service.ai_model.set_model(args.model)
+    if args.retrieve:
+        # 使用记录文件旁边的向量索引，检索时更新的部分随记录一起保存
+        service.settings.enable_retrieval = True
+        if args.scope:
+            service.settings.retrieval_scope = args.scope
+        if args.budget:
+            service.settings.retrieval_token_budget = args.budget
+        from core.embeddings import EmbeddingClient, EmbeddingIndex
+        from core.retrieval import Retriever
+        model = service.settings.embedding_model
+        service.retriever = Retriever(EmbeddingClient(service.ai_model.base_url, model),
+                                      EmbeddingIndex.load(args.file, model))
+    messages = service.send_message(args.text)
+    print(messages[-1], end="")
+    result = service.retriever.last_result if args.retrieve else None
+    if result is not None:
+        for score, node_id, index, text in result.snippets:
+            text = " ".join(text.split())
+            print(f"  {score:.3f} [{node_id}]#{index} {text[:80]}", file=sys.stderr)
+        print(result.summary(), file=sys.stderr)
+    if not args.no_save:
+        service.save(args.file)
+        if args.retrieve:
+            service.retriever.index.save(args.file)
+
+
+def cmd_import(args):
+    # 直接写入记录文件：解析、校验和序列化都在工作进程中进行，不把导入的子树加载到主进程
+    from core.bulk_import import find_record_files, format_import_report, import_records_to_file
+    service = ChatService()
+    if args.records_folder:
+        service.settings.records_folder = args.records_folder
+    args.file = args.file or service.records_path
+    files = find_record_files(args.source)
+
+    def progress(done, total, result):
+        print(f"\r{done}/{total}", end="", file=sys.stderr)
+
+    try:
+        if is_folder_store(args.file) or service.settings.dedup_records:
+            # 文件夹存储（只写入新的子树和挂载节点的清单）和去重格式：在内存中导入后保存
+            service.load(args.file)
+            parent = resolve_node(service, args.parent)
+            report = service.import_records(parent, files, workers=args.workers, progress=progress)
+            if report['imported']:
+                service.save(args.file)
+        else:
+            report = import_records_to_file(args.file, files, args.parent, workers=args.workers, progress=progress)
+    except KeyError:
+        raise SystemExit(f"找不到节点: {args.parent}")
+    finally:
+        print(file=sys.stderr)
+    print(format_import_report(report, args.verbose))
+    if report['imported']:
+        print(f"已写入 {args.file}")
+    if report['failed']:
+        raise SystemExit(1)
+
+
+def cmd_export(args):
+    service = open_service(args)
+    node = resolve_node(service, args.node)
+    fmt = args.format
+    if fmt is None:
+        extension = os.path.splitext(args.output)[1].lower()
+        fmt = {'.md': 'markdown', '.markdown': 'markdown', '.html': 'html', '.htm': 'html'}.get(extension, 'json')
+    if fmt == 'json':
+        save_node(node, args.output)
+    elif fmt == 'html':
+        write_export(node, args.output, fmt, katex_js=args.katex_js)
+    else:
+        write_export(node, args.output, fmt)
+    print(f"已导出到 {args.output}")
+
+
+def cmd_batch(args):
+    service = open_service(args)
+    if args.model:
+        service.ai_model.set_model(args.model)
+    nodes = select_nodes(resolve_node(service, args.node), args.select)
+    state_path = args.state or args.file + ".batch.json"
+    job = BatchJob(service, args.template, nodes, mode=args.mode, concurrency=args.concurrency,
+                   state_path=state_path)
+    print(f"共选中 {len(nodes)} 个节点，并发数 {job.concurrency}", file=sys.stderr)
+    try:
+        stats = job.run(progress=lambda p: print(f"\r{p}", end="", file=sys.stderr))
+    finally:
+        # 中断时也保存已写回的结果，下次以同一状态文件继续
+        service.save(args.file)
+        print(file=sys.stderr)
+    print(stats)
+    print(service.scheduler.format_stats(), file=sys.stderr)
+
+
+def cmd_fanout(args):
+    service = open_service(args)
+    parent = resolve_node(service, args.node)
+    variants = [Variant.parse(spec) for spec in args.variant] if args.variant else default_variants(args.n)
+    fan_out = FanOut(service, parent, args.text, variants)
+    started = time.monotonic()
+
+    def on_done(index, node, reply_msg, error):
+        status = "失败" if error else "完成"
+        print(f"[{time.monotonic() - started:.1f}s] 分支 {index + 1} {status}: {node.topic} ({node.id})",
+              file=sys.stderr)
+
+    fan_out.start(on_done=on_done)
+    try:
+        fan_out.join()
+    except KeyboardInterrupt:
+        # 中止所有分支，已生成的部分标记为已取消后保存
+        fan_out.cancel()
+        fan_out.join()
+    service.save(args.file)
+    for node, reply_msg in zip(fan_out.branches, fan_out.replies):
+        print(f"===== {node.topic} =====")
+        print(reply_msg, end="")
+
+
+def cmd_convert(args):
+    tree = load_tree(args.source)
+    save_tree(tree, args.output, args.dedup)
+    count = sum(1 for _ in tree.root.walk())
+    print(f"已将 {count} 个节点保存到 {args.output}")
+
+
+def cmd_read(args):
+    folder, relpath = find_store_root(args.path)
+    if folder is None:
+        raise SystemExit(f"{args.path} 不在文件夹存储中")
+    store = open_store(folder)
+    result = store.open_node(relpath)
+    node = result['node']
+    location = " / ".join(topic.replace("\n", " ")[:20] for _, topic in result['path'] + [(node.id, node.topic)])
+    print(f"{location} [{node.id}]")
+    for chat in node.chats[-args.last:] if args.last else node.chats:
+        print(chat.rstrip("\n"))
+    for child in result['children']:
+        print(f"  子节点 {os.path.join(args.path, child['dir'])} [{child['id']}]")
+    print(f"读取 {store.reads} 个文件", file=sys.stderr)
+
+
+def cmd_dedup(args):
+    files = args.files or [args.file or ChatService().records_path]
+    totals = None
+    for path in files:
+        report = dedup_report(serialize_node(load_tree(path).root))
+        print(format_dedup_report(report, path))
+        totals = report if totals is None else {key: totals[key] + value for key, value in report.items()}
+    if len(files) > 1:
+        print(format_dedup_report(totals))
+
+
+def cmd_hash(args):
+    files = args.files or [args.file or ChatService().records_path]
+    hashes = []
+    for path in files:
+        tree = load_tree(path)
+        root_hash = tree.root.subtree_hash()
+        hashes.append(root_hash)
+        print(f"{root_hash}  {path}")
+        if args.depth:
+            stack = [(tree.root, 0)]
+            while stack:
+                node, depth = stack.pop()
+                if depth:
+                    topic = node.topic.replace("\n", " ")[:40]
+                    print(f"  {'  ' * (depth - 1)}{node.subtree_hash()[:16]}  {topic} [{node.id}]")
+                if depth < args.depth:
+                    stack.extend((child, depth + 1) for child in reversed(node.children))
+    if len(hashes) > 1:
+        identical = len(set(hashes)) == 1
+        print("内容完全相同" if identical else "内容不同")
+        if not identical:
+            sys.exit(1)
+
+
+def cmd_diff(args):
+    changes = diff_trees(load_tree(args.old).root, load_tree(args.new).root)
+    for change in changes:
+        print(change)
+    if not changes:
+        print("内容完全相同")
+        return
+    print(f"共 {len(changes)} 处差异")
+    sys.exit(1)
+
+
+def cmd_merge(args):
+    merged, applied, conflicts = merge_trees(load_tree(args.base).root, load_tree(args.ours).root,
+                                             load_tree(args.theirs).root)
+    save_tree(merged, args.output)
+    for change in applied:
+        print(change)
+    for conflict in conflicts:
+        print(conflict)
+    print(f"已应用 {len(applied)} 处修改，{len(conflicts)} 处冲突，已保存到 {args.output}")
+    if conflicts:
+        sys.exit(1)
+
+
+def cmd_serve(args):
+    import asyncio
+    from core.server import DEFAULT_PORT, TreeServer
+    settings = Settings()
+    if args.records_folder:
+        settings.records_folder = args.records_folder
+    settings.ensure_records_folder()
+    port = args.port or DEFAULT_PORT
+    server = TreeServer(settings, args.host, port)
+    print(f"在 http://{args.host}:{port} 提供 {settings.records_folder} 中的树，按 Ctrl+C 退出", file=sys.stderr)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_perf(args):
+    service = ChatService()
+    started = time.monotonic()
+
+    def on_done(handle):
+        status = "失败" if handle.error else "完成"
+        print(f"[{time.monotonic() - started:.1f}s] {handle.model_name} {status}", file=sys.stderr)
+
+    try:
+        service.probe_models(args.model, args.repeat, num_predict=args.num_predict, on_done=on_done)
+    except KeyboardInterrupt:
+        pass
+    print(service.scheduler.format_model_stats())
+
+
+def cmd_memory(args):
+    if not args.tracemalloc:
+        service = open_service(args)
+        print(format_report(memory_report(resolve_node(service, args.node), args.top)))
+        return
+    # 在 tracemalloc 下加载和保存，报告两次操作各自的内存分配
+    service = ChatService()
+    if args.records_folder:
+        service.settings.records_folder = args.records_folder
+    args.file = args.file or service.records_path
+    tree, grown, peak, diff = trace_allocations(lambda: load_tree(args.file), args.top)
+    service.tree = tree
+    print(format_report(memory_report(resolve_node(service, args.node), args.top)))
+    print(f"\n加载: 净增加 {format_bytes(grown)}，峰值 {format_bytes(peak)}")
+    for stat in diff:
+        print(f"  {stat}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, os.path.basename(args.file))
+        _, grown, peak, diff = trace_allocations(lambda: save_tree(tree, path), args.top)
+    print(f"\n保存: 净增加 {format_bytes(grown)}，峰值 {format_bytes(peak)}")
+    for stat in diff:
+        print(f"  {stat}")
+
+
+def cmd_archive(args):
+    service = open_service(args)
+    path = args.output or args.file
+    if args.decompress:
+        for node in service.tree.root.walk():
+            node.decompress()
+        service.save(path, force=True)
+        print(f"已解压全部节点，保存到 {path}")
+        return
+    before = os.path.getsize(args.file)
+    result = compress_cold_nodes(service.tree.root, 0, args.codec)
+    service.save(path, force=True)
+    stats = archive_stats(service.tree.root)
+    print(f"本次压缩 {result['nodes']} 个节点，聊天记录内存 {format_bytes(result['memory_before'])} -> "
+          f"{format_bytes(result['memory_after'])}")
+    print(f"已压缩 {stats['compressed']}/{stats['nodes']} 个节点（{stats['messages']} 条消息），"
+          f"{format_bytes(stats['size'])} -> {format_bytes(stats['packed'])}")
+    print(f"记录文件 {format_bytes(before)} -> {format_bytes(os.path.getsize(path))}，保存到 {path}")
+
+
+def open_index(args, service):
+    """加载记录文件旁边的向量索引并更新到最新"""
+    from core.embeddings import EmbeddingClient, EmbeddingIndex
+    model = args.model or service.settings.embedding_model
+    client = EmbeddingClient(args.base_url or service.ai_model.base_url, model)
+    index = EmbeddingIndex.load(args.file, model)
+    result = index.update(service.tree.root, client)
+    if result['embedded'] or result['removed'] or result['changed_nodes']:
+        index.save(args.file)
+    print(f"索引 {result['rows']} 行（{result['nodes']} 个节点），复用 {result['reused']} 行，"
+          f"新计算 {result['embedded']} 行（{result['embed_time']:.2f}s），删除 {result['removed']} 行",
+          file=sys.stderr)
+    return index, client
+
+
+def cmd_index(args):
+    service = open_service(args)
+    open_index(args, service)
+
+
+def cmd_semantic(args):
+    from core.embeddings import TOPIC_INDEX
+    service = open_service(args)
+    index, client = open_index(args, service)
+    scope = None
+    if args.node:
+        scope = [node.id for node in resolve_node(service, args.node).walk()]
+    query_vector = client.embed([args.query])[0]
+    started = time.perf_counter()
+    results = index.search(query_vector, args.k, scope)
+    elapsed = time.perf_counter() - started
+    for score, node_id, message_index in results:
+        node = service.find_node(node_id)
+        if message_index == TOPIC_INDEX:
+            text = "[主题] " + node.topic
+        else:
+            text = node.chats[message_index]
+        text = text.replace("\n", " ")[:80]
+        topic = node.topic.replace("\n", " ")[:20]
+        print(f"{score:.3f}  {topic} [{node_id[:8]}#{message_index}]  {text}")
+    print(f"搜索 {len(index)} 行用时 {elapsed * 1000:.1f}ms", file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="treechat", description="TreeChat 命令行工具")
+    parser.add_argument("--file", help="记录文件或文件夹存储，默认为记录文件夹中的 chat_all_records.json")
+    parser.add_argument("--records-folder", help="覆盖配置文件中的记录文件夹")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="统计各阶段耗时，结束后导出到 FILE（.jsonl 为原始记录，其他为 Prometheus 文本格式）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("stats", help="统计节点和消息数量")
+    p.add_argument("--node", help="只统计该节点的子树")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("search", help="在主题和聊天记录中搜索关键字")
+    p.add_argument("keyword")
+    p.add_argument("--node", help="只搜索该节点的子树")
+    p.add_argument("--limit", type=int, default=0, help="最多显示的结果数")
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser("ask", help="向节点发送一条消息并保存 AI 回复")
+    p.add_argument("text")
+    p.add_argument("--node", help="目标节点，默认为根节点")
+    p.add_argument("--model", help="临时使用的模型")
+    p.add_argument("--no-save", action="store_true", help="不写回记录文件")
+    p.add_argument("--retrieve", action="store_true", help="先从其他分支检索相关片段附加到上下文")
+    # 与 core.retrieval.SCOPES 相同，解析参数时不导入检索模块
+    p.add_argument("--scope", choices=("subtree", "tree"), help="检索范围：subtree（同一子树，默认）或 tree（整棵树）")
+    p.add_argument("--budget", type=int, help="检索片段的 token 预算")
+    p.set_defaults(func=cmd_ask)
+
+    p = sub.add_parser("import", help="将记录文件作为子树导入，可一次导入多个文件或整个文件夹")
+    p.add_argument("source", nargs="+", help="记录文件或文件夹（导入其中所有 .json 文件）")
+    p.add_argument("--parent", help="挂载到的节点，默认为根节点")
+    p.add_argument("--workers", type=int, help="解析用的工作进程数，默认为 CPU 核数")
+    p.add_argument("--verbose", action="store_true", help="列出每个文件的节点数和耗时")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("convert", help="在 JSON 记录文件和一个节点一个文件夹的存储之间转换")
+    p.add_argument("source", help="记录文件或存储目录")
+    p.add_argument("output", help="输出的记录文件，以 / 结尾或为已有目录时保存为文件夹存储")
+    p.add_argument("--dedup", action="store_true", help="以去重格式写入记录文件")
+    p.set_defaults(func=cmd_convert)
+
+    p = sub.add_parser("read", help="只读取文件夹存储中的一个节点，不加载整棵树")
+    p.add_argument("path", help="节点的文件夹")
+    p.add_argument("--last", type=int, default=0, help="只显示最后几条消息")
+    p.set_defaults(func=cmd_read)
+
+    p = sub.add_parser("export", help="导出整棵树或子树为 JSON、Markdown 或 HTML（先读入整个记录文件，再边生成边写出）")
+    p.add_argument("-o", "--output", required=True)
+    p.add_argument("--node", help="导出的子树根节点")
+    p.add_argument("--format", choices=["json", "markdown", "html"], help="导出格式，默认按输出文件的扩展名判断")
+    p.add_argument("--katex-js", help="HTML 中引用的 KaTeX 目录 URL，指定时内联 KaTeX 样式并在浏览器中渲染公式")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("batch", help="将提示模板批量应用到一组节点")
+    p.add_argument("template", help="提示模板，可使用 {topic}、{chats}、{last_message}")
+    p.add_argument("--select", default="leaves", help="all、leaves 或 topic=<主题>，默认 leaves")
+    p.add_argument("--node", help="只处理该节点的子树")
+    p.add_argument("--mode", choices=["message", "rename"], default="message",
+                   help="message 追加为聊天记录，rename 用回复重命名节点")
+    p.add_argument("--concurrency", type=int, default=4, help="同时进行的请求数")
+    p.add_argument("--model", help="使用的模型")
+    p.add_argument("--state", help="状态文件，默认为记录文件名加 .batch.json")
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser("fanout", help="在节点下并发生成多个分支")
+    p.add_argument("text")
+    p.add_argument("--node", help="在其下创建分支的节点，默认为根节点")
+    p.add_argument("-n", type=int, default=3, help="分支数量（未指定 --variant 时使用）")
+    p.add_argument("--variant", action="append",
+                   help="分支的 模型@温度#种子，可重复指定，如 gemma3n:e4b@0.7#1")
+    p.set_defaults(func=cmd_fanout)
+
+    p = sub.add_parser("memory", help="统计已加载的树占用的内存")
+    p.add_argument("--node", help="只统计该节点的子树")
+    p.add_argument("--top", type=int, default=10, help="列出最大的子树和分配位置的数量")
+    p.add_argument("--tracemalloc", action="store_true", help="用 tracemalloc 对比加载和保存前后的内存分配")
+    p.set_defaults(func=cmd_memory)
+
+    p = sub.add_parser("dedup", help="统计记录文件中重复的消息和系统消息，报告驻留和去重格式节省的空间")
+    p.add_argument("files", nargs="*", help="记录文件，默认为 --file 指定的文件")
+    p.set_defaults(func=cmd_dedup)
+
+    p = sub.add_parser("hash", help="计算记录文件的 Merkle 哈希，多个文件时比较是否相同")
+    p.add_argument("files", nargs="*", help="记录文件，默认为 --file 指定的文件")
+    p.add_argument("--depth", type=int, default=0, help="同时列出该深度以内各子树的哈希")
+    p.set_defaults(func=cmd_hash)
+
+    p = sub.add_parser("diff", help="按节点 ID 比较两个记录文件")
+    p.add_argument("old", help="旧版本的记录文件")
+    p.add_argument("new", help="新版本的记录文件")
+    p.set_defaults(func=cmd_diff)
+
+    p = sub.add_parser("merge", help="以共同祖先为基准三方合并记录文件，冲突处保留我方内容")
+    p.add_argument("base", help="共同祖先版本")
+    p.add_argument("ours", help="我方版本")
+    p.add_argument("theirs", help="对方版本")
+    p.add_argument("-o", "--output", required=True, help="合并结果的输出文件")
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser("archive", help="压缩全部节点的聊天记录并报告节省的内存和磁盘空间")
+    p.add_argument("--codec", choices=sorted(CODECS), default="zlib", help="压缩格式")
+    p.add_argument("--decompress", action="store_true", help="解压全部节点，恢复为普通格式")
+    p.add_argument("-o", "--output", help="输出文件，默认覆盖原文件")
+    p.set_defaults(func=cmd_archive)
+
+    for name, func, help_text in (("index", cmd_index, "建立或更新记录文件旁边的向量索引"),
+                                  ("semantic", cmd_semantic, "按语义搜索节点主题和聊天记录")):
+        p = sub.add_parser(name, help=help_text)
+        if name == "semantic":
+            p.add_argument("query", help="查询文本")
+            p.add_argument("-k", type=int, default=10, help="返回的条数")
+            p.add_argument("--node", help="只在该节点的子树中搜索")
+        p.add_argument("--model", help="向量模型，默认使用设置中的 embedding_model")
+        p.add_argument("--base-url", help="Ollama 服务地址，默认使用设置中的地址")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("serve", help="以 HTTP / WebSocket 服务的形式提供记录文件夹中的树，供多人同时使用")
+    p.add_argument("--host", default="127.0.0.1", help="监听地址")
+    p.add_argument("--port", type=int, help="监听端口，默认为 8765")
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("perf", help="测试各模型的首字延迟和生成速度")
+    p.add_argument("--model", action="append", help="要测试的模型，可重复指定，默认测试所有可用模型")
+    p.add_argument("--repeat", type=int, default=3, help="每个模型的请求次数")
+    p.add_argument("--num-predict", type=int, default=64, help="每次最多生成的 token 数")
+    p.set_defaults(func=cmd_perf)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace:
+        tracing.enable()
+    try:
+        args.func(args)
+    finally:
+        if args.trace:
+            tracing.export(args.trace)
+            print(tracing.tracer.format_summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
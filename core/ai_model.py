@@ -2,11 +2,80 @@ import ollama
 import logging
 import configparser
 import os
+import json
+import socket
+import threading
+import http.client
+from urllib.parse import urlsplit
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class ChatStream:
+    """
+    一次流式 /api/chat 请求
+
+    直接持有底层连接，close() 可以在任意线程调用：关闭套接字会让正在读取的线程立即返回，
+    Ollama 检测到连接断开后停止生成并释放服务端的并发槽位。
+    """
+    def __init__(self, base_url, payload, timeout=None):
+        if "://" not in base_url:
+            base_url = "http://" + base_url
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._lock = threading.Lock()
+        self.closed = False
+        self.final = None  # 最后一条 done=true 的响应，包含 Ollama 返回的计时信息
+        self.conn = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.conn.request("POST", parts.path.rstrip("/") + "/api/chat",
+                          body=json.dumps(payload).encode("utf-8"),
+                          headers={"Content-Type": "application/json"})
+        self.response = self.conn.getresponse()
+        if self.response.status != 200:
+            body = self.response.read().decode("utf-8", errors="replace")
+            self.close()
+            try:
+                body = json.loads(body).get("error", body)
+            except ValueError:
+                pass
+            raise RuntimeError(f"{body} (status code: {self.response.status})")
+
+    def __iter__(self):
+        """逐段产出回复文本，连接被 close() 关闭后安静地结束"""
+        try:
+            for line in self.response:
+                if self.closed:
+                    return
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                content = data.get("message", {}).get("content", "")
+                if content:
+                    yield content
+                if data.get("done"):
+                    self.final = data
+                    return
+        except (OSError, ValueError, http.client.HTTPException):
+            if not self.closed:
+                raise
+
+    def close(self):
+        """中止请求并关闭连接，可重复调用"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            sock = self.conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.conn.close()
+
 class AIModel:
     def __init__(self):
         # 初始化 AI 模型
@@ -173,6 +242,38 @@ class AIModel:
             print(f"生成回复失败: {e}")
             return f"生成回复失败: {str(e)}"
 
+    def stream(self, messages, model=None, options=None):
+        """
+        以流式方式生成回复，不读写对话历史，可在多个线程中并发调用
+
+        参数:
+            messages - Ollama 格式的消息列表
+            model    - 使用的模型，为空时使用当前模型
+            options  - 传给 Ollama 的生成参数
+
+        返回:
+            逐段产出回复文本的生成器
+        """
+        chat_stream = self.open_stream(messages, model, options)
+        try:
+            yield from chat_stream
+        finally:
+            chat_stream.close()
+
+    def open_stream(self, messages, model=None, options=None):
+        """
+        发起一次可中止的流式请求
+
+        参数同 stream()
+
+        返回:
+            ChatStream 对象，迭代得到回复文本，调用 close() 可随时中止
+        """
+        payload = {'model': model or self.model, 'messages': messages, 'stream': True}
+        if options:
+            payload['options'] = options
+        return ChatStream(self.base_url, payload)
+
     def get_reply(self, input_text):
         """供外部调用的获取回复方法"""
         return self.generate_response(input_text)
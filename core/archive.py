@@ -0,0 +1,132 @@
+"""
+冷节点归档：压缩长时间未访问的节点的聊天记录
+
+较长时间没有打开过的节点（TreeNode.last_access 早于设定的时间窗口）的聊天记录会被压缩
+（zlib 或 lzma），内存中只保留压缩后的数据，保存时以 chats_z 字段原样写入记录文件；
+之后访问 node.chats 时自动解压，调用方不需要关心节点是否已被压缩。
+
+压缩前后的 Merkle 哈希相同：compress() 时先算好聊天记录的摘要并随压缩数据一起保存。
+"""
+import base64
+import json
+import lzma
+import sys
+import time
+import zlib
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 9), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+DEFAULT_CODEC = 'zlib'
+# 聊天记录 JSON 小于该字节数的节点不压缩，压缩后反而更大
+MIN_PACK_BYTES = 256
+
+
+class PackedChats:
+    """
+    压缩后的聊天记录
+
+    size 为压缩前 JSON 的字节数（即未压缩时写入记录文件的大小），count 为消息条数，
+    digest 为聊天记录的 sha256 摘要（与 TreeNode 计算 Merkle 哈希时相同），
+    加载后计算哈希不需要解压
+    """
+    __slots__ = ('codec', 'data', 'size', 'count', 'digest')
+
+    def __init__(self, codec, data, size, count, digest=None):
+        self.codec = codec
+        self.data = data
+        self.size = size
+        self.count = count
+        self.digest = digest
+
+    def to_dict(self):
+        """记录文件中 chats_z 字段的内容"""
+        data = {'codec': self.codec, 'size': self.size, 'count': self.count,
+                'data': base64.b64encode(self.data).decode("ascii")}
+        if self.digest is not None:
+            data['digest'] = self.digest.hex()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('codec') not in CODECS:
+            raise ValueError(f"不支持的压缩格式: {data.get('codec')}")
+        digest = data.get('digest')
+        return cls(data['codec'], base64.b64decode(data['data']), data.get('size', 0), data.get('count', 0),
+                   bytes.fromhex(digest) if digest else None)
+
+
+def pack_chats(chats, codec=DEFAULT_CODEC):
+    """
+    压缩聊天记录列表
+
+    返回:
+        PackedChats 对象
+    """
+    payload = json.dumps(list(chats), ensure_ascii=False).encode("utf-8")
+    compress, _ = CODECS[codec]
+    return PackedChats(codec, compress(payload), len(payload), len(chats))
+
+
+def unpack_chats(packed):
+    """解压 PackedChats，返回字符串列表"""
+    _, decompress = CODECS[packed.codec]
+    return json.loads(decompress(packed.data).decode("utf-8"))
+
+
+def chats_memory(chats):
+    """聊天记录列表及其中字符串占用的字节数"""
+    return sys.getsizeof(chats) + sum(sys.getsizeof(chat) for chat in chats)
+
+
+def compress_cold_nodes(root, idle_seconds, codec=DEFAULT_CODEC, now=None, skip=()):
+    """
+    压缩 idle_seconds 秒内没有访问过的节点
+
+    参数:
+        root         - 遍历范围的根节点
+        idle_seconds - 时间窗口，last_access 早于 now - idle_seconds 的节点视为冷节点
+        codec        - 'zlib' 或 'lzma'
+        now          - 当前时间（time.monotonic()），为空时取当前值
+        skip         - 不压缩的节点（如当前节点）
+
+    返回:
+        {'nodes': 本次压缩的节点数, 'memory_before', 'memory_after', 'disk_before', 'disk_after'}
+        disk_* 为这些节点的聊天记录写入记录文件时的字节数（压缩后按 base64 计算）
+    """
+    now = time.monotonic() if now is None else now
+    skip_ids = {id(node) for node in skip}
+    result = {'nodes': 0, 'memory_before': 0, 'memory_after': 0, 'disk_before': 0, 'disk_after': 0}
+    for node in root.walk():
+        if node.is_compressed or id(node) in skip_ids or now - node.last_access < idle_seconds:
+            continue
+        memory = chats_memory(node.chats)
+        packed = node.compress(codec)
+        if packed is None:
+            continue
+        result['nodes'] += 1
+        result['memory_before'] += memory
+        result['memory_after'] += sys.getsizeof(packed) + sys.getsizeof(packed.data)
+        result['disk_before'] += packed.size
+        result['disk_after'] += (len(packed.data) + 2) // 3 * 4
+    return result
+
+
+def archive_stats(root):
+    """
+    统计树中已压缩的节点
+
+    返回:
+        {'nodes', 'compressed', 'messages', 'size', 'packed'}，size / packed 为压缩前后的字节数
+    """
+    result = {'nodes': 0, 'compressed': 0, 'messages': 0, 'size': 0, 'packed': 0}
+    for node in root.walk():
+        result['nodes'] += 1
+        packed = node.packed_chats
+        if packed is not None:
+            result['compressed'] += 1
+            result['messages'] += packed.count
+            result['size'] += packed.size
+            result['packed'] += len(packed.data)
+    return result
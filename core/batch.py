@@ -0,0 +1,237 @@
+import json
+import os
+import queue
+import time
+import logging
+
+from core.generation import PRIORITY_BACKGROUND, STATE_DONE
+
+logger = logging.getLogger(__name__)
+
+# 写回方式：追加为聊天消息，或用回复重命名节点
+MODE_MESSAGE = "message"
+MODE_RENAME = "rename"
+# 消息模式下记录提问时 {chats} 的替代文本
+CHATS_PLACEHOLDER = "（本节点的聊天记录）"
+
+
+def select_nodes(root, selector):
+    """
+    从子树中选出批量任务要处理的节点
+
+    参数:
+        root     - 子树根节点
+        selector - "all"（全部节点）、"leaves"（叶子节点）或 "topic=<主题>"（主题完全相同的节点）
+
+    返回:
+        TreeNode 列表，按先序遍历顺序
+    """
+    if selector == "all":
+        return list(root.walk())
+    if selector == "leaves":
+        return [node for node in root.walk() if not node.children]
+    if selector.startswith("topic="):
+        topic = selector[len("topic="):]
+        return [node for node in root.walk() if node.topic == topic]
+    raise ValueError(f"未知的节点选择方式: {selector}")
+
+
+def render_prompt(template, node):
+    """
+    用节点内容填充提示模板
+
+    模板中可使用 {topic}、{chats}（全部聊天记录）和 {last_message}（最后一条记录），
+    字面量花括号需写成 {{ 和 }}。
+    """
+    return template.format_map({
+        'topic': node.topic,
+        'chats': "".join(node.chats),
+        'last_message': node.chats[-1] if node.chats else "",
+    })
+
+
+def render_question(template, node):
+    """
+    消息模式下写入节点的提问：除 {chats} 外与 render_prompt() 相同，{chats} 替换为 CHATS_PLACEHOLDER，
+    否则节点的聊天记录会随每次批量任务成倍增长
+    """
+    return template.format_map({
+        'topic': node.topic,
+        'chats': CHATS_PLACEHOLDER,
+        'last_message': node.chats[-1] if node.chats else "",
+    })
+
+
+class BatchProgress:
+    """批量任务的进度与吞吐量"""
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """每秒完成的请求数（不含恢复时跳过的节点）"""
+        finished = self.done + self.failed
+        return finished / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """按当前吞吐量估算的剩余秒数"""
+        remaining = self.total - self.done - self.failed - self.skipped
+        return remaining / self.rate if self.rate > 0 else None
+
+    def __str__(self):
+        eta = f"{self.eta:.0f}s" if self.eta is not None else "-"
+        finished = self.done + self.failed + self.skipped
+        return (f"{finished}/{self.total} 完成 {self.done} 失败 {self.failed} 跳过 {self.skipped} "
+                f"{self.rate:.2f} 请求/秒 剩余 {eta}")
+
+
+class BatchJob:
+    """
+    将一个提示模板映射到一组节点上并发执行
+
+    请求以后台优先级经服务层的调度器发给 AIModel，结果在调用 run() 的线程中写回树，
+    每完成一个节点就把结果写入状态文件，中断后用同一状态文件再次运行即可跳过已完成的节点。
+    消息模式下写入节点的提问见 render_question()。
+    """
+    def __init__(self, service, template, nodes, mode=MODE_MESSAGE, concurrency=4,
+                 state_path=None, model=None, options=None):
+        """
+        参数:
+            service     - ChatService 对象，用于调用模型和写回结果
+            template    - 提示模板，见 render_prompt
+            nodes       - 要处理的 TreeNode 列表
+            mode        - MODE_MESSAGE 或 MODE_RENAME
+            concurrency - 同时进行的请求数上限
+            state_path  - 状态文件路径，为空时不可恢复
+            model       - 使用的模型，为空时使用当前模型
+            options     - 传给 Ollama 的生成参数
+        """
+        if mode not in (MODE_MESSAGE, MODE_RENAME):
+            raise ValueError(f"未知的写回方式: {mode}")
+        self.service = service
+        self.template = template
+        self.nodes = nodes
+        self.mode = mode
+        self.concurrency = max(1, concurrency)
+        self.state_path = state_path
+        self.model = model
+        self.options = options
+        # 调度器按任务公平排队，多个批量任务同时运行时轮流出队
+        self.job_id = f"batch:{id(self)}"
+        self.state = self._load_state()
+
+    def _load_state(self):
+        state = {'template': self.template, 'mode': self.mode, 'done': {}, 'failed': {}}
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get('template') == self.template and saved.get('mode') == self.mode:
+                state['done'] = saved.get('done', {})
+                logger.info(f"从 {self.state_path} 恢复批量任务，已完成 {len(state['done'])} 个节点")
+            else:
+                logger.warning("状态文件与当前任务的模板或写回方式不同，忽略已有进度")
+        return state
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    def _apply(self, node, question, reply):
+        """
+        将回复写回节点；恢复时若结果已写入则不重复写
+
+        参数:
+            question - 消息模式下写入的提问（render_question() 的结果，在提交请求时生成）
+            reply    - 模型的回复
+        """
+        if self.mode == MODE_RENAME:
+            new_name = reply.strip().splitlines()[0].strip() if reply.strip() else ""
+            if new_name and node.topic != new_name:
+                self.service.rename_node(node, new_name)
+        else:
+            user_msg = f"你: {question}\n"
+            reply_msg = f"AI: {reply}\n"
+            chats = node.chats
+            if any(chats[i] == user_msg and chats[i + 1] == reply_msg for i in range(len(chats) - 1)):
+                return
+            self.service.append_user_message(question, node)
+            self.service.append_chat(reply_msg, node)
+
+    def run(self, progress=None):
+        """
+        执行任务
+
+        参数:
+            progress - 回调函数，每完成一个节点以 BatchProgress 调用一次
+
+        返回:
+            BatchProgress 对象
+        """
+        stats = BatchProgress(len(self.nodes))
+        pending = []
+        for node in self.nodes:
+            if node.id in self.state['done']:
+                # 树可能在上次中断前未保存，补写已完成的结果；提问使用当时记录的文本，
+                # 重新生成时 {last_message} 可能已变成上次写入的回复
+                done = self.state['done'][node.id]
+                if isinstance(done, str):
+                    # 只记录了回复的旧状态文件
+                    done = {'question': render_question(self.template, node), 'reply': done}
+                self._apply(node, done['question'], done['reply'])
+                stats.skipped += 1
+            else:
+                pending.append((node, render_prompt(self.template, node), render_question(self.template, node)))
+        # 通过调度器以后台优先级提交，交互请求可以插队或抢占；同时在途的请求不超过 concurrency
+        finished = queue.Queue()
+        pending = iter(pending)
+        in_flight = {}
+
+        def submit_next():
+            for node, prompt, question in pending:
+                handle = self.service.scheduler.submit(
+                    self.service.ai_model, [{'role': 'user', 'content': prompt}], priority=PRIORITY_BACKGROUND,
+                    model=self.model, options=self.options, fair_key=self.job_id,
+                    on_done=lambda h, node=node, question=question: finished.put((node, question, h)))
+                in_flight[handle] = node
+                return True
+            return False
+
+        while len(in_flight) < self.concurrency and submit_next():
+            pass
+        try:
+            while in_flight:
+                node, question, handle = finished.get()
+                del in_flight[handle]
+                if handle.state == STATE_DONE:
+                    self._apply(node, question, handle.text)
+                    self.state['done'][node.id] = {'question': question, 'reply': handle.text}
+                    self.state['failed'].pop(node.id, None)
+                    stats.done += 1
+                else:
+                    error = handle.error or handle.state
+                    logger.error(f"节点 '{node.topic[:30]}' 处理失败: {error}")
+                    self.state['failed'][node.id] = str(error)
+                    stats.failed += 1
+                self._save_state()
+                if progress:
+                    progress(stats)
+                submit_next()
+        except KeyboardInterrupt:
+            # 中止在途的请求，已完成的结果已写入状态文件
+            for handle in list(in_flight):
+                handle.cancel()
+            raise
+        return stats
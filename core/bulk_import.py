@@ -0,0 +1,370 @@
+"""
+批量导入记录文件
+
+把许多导出的记录文件（.json）各自作为一棵子树挂到同一棵树的某个节点下，按输入顺序排列。
+与树中已有节点（或先导入的文件、同一文件中其他节点）ID 相同的节点换成新的 ID，其余节点保留原 ID。
+每个文件单独报告耗时和失败原因，一个文件失败不影响其他文件。
+
+两种方式:
+    import_records()         - 导入到内存中的树（界面使用）。可以在进程池中解析和校验，但把解析结果传回主进程
+                               （反序列化）并创建 TreeNode 的开销与解析本身相当，多进程几乎没有加速，默认在当前进程中进行；
+    import_records_to_file() - 直接写入记录文件（命令行使用）。工作进程先解析、校验并收集节点 ID，
+                               主进程确定需要换掉的 ID 后，工作进程再各自把子树序列化为最终文件中的 JSON 片段，
+                               主进程只需按顺序拼接写出，吞吐量随 CPU 核数增加。写出的文件与先导入到内存再 save_tree() 相同（新生成的 ID 除外）。
+"""
+import functools
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from core.dedup import decode_record
+from core.records import build_tree_node_from_dict, load_tree, serialize_node, validate_record
+from core.tree import Tree
+
+# 记录文件的缩进，与 save_node() 相同
+INDENT = 4
+
+# 每次交给一个工作进程的文件数，文件多而小时减少进程间通信次数
+CHUNK_SIZE = 4
+
+
+def find_record_files(paths):
+    """
+    展开输入路径：文件原样保留，文件夹递归查找其中的 .json 文件（按路径排序）
+
+    返回:
+        文件路径列表，重复的路径只保留第一次出现
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for folder, _, names in os.walk(path):
+                found.extend(os.path.join(folder, name) for name in names if name.lower().endswith(".json"))
+            files.extend(sorted(found))
+        else:
+            files.append(path)
+    unique = []
+    seen = set()
+    for path in files:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+
+def _record_ids(data):
+    """按先序返回记录中所有带 id 字段的节点 ID"""
+    ids = []
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if 'id' in item:
+            if not isinstance(item['id'], str):
+                raise ValueError(f"节点 ID 必须是字符串: {item['id']!r}")
+            ids.append(item['id'])
+        stack.extend(reversed(item.get('children', [])))
+    return ids
+
+
+def parse_record_file(path, keep_data=True):
+    """
+    读取、解析并校验一个记录文件，在工作进程中执行
+
+    参数:
+        keep_data - 为 False 时不返回解析出的数据（只需要节点 ID 时，避免传回主进程的开销）
+
+    返回:
+        {'path', 'bytes', 'parse_time', 'data', 'ids', 'error'}，失败时 data 为空、error 为原因
+    """
+    started = time.perf_counter()
+    result = {'path': path, 'bytes': 0, 'data': None, 'ids': [], 'error': None}
+    try:
+        result['bytes'] = os.path.getsize(path)
+        with open(path, "r", encoding="utf-8") as f:
+            data = decode_record(json.load(f))
+        errors = validate_record(data)
+        if errors:
+            more = f"（共 {len(errors)} 处）" if len(errors) > 1 else ""
+            result['error'] = errors[0] + more
+        else:
+            result['ids'] = _record_ids(data)
+            if keep_data:
+                result['data'] = data
+    except (OSError, UnicodeDecodeError, ValueError, RecursionError) as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['parse_time'] = time.perf_counter() - started
+    return result
+
+
+def _parallel_map(func, items, workers):
+    """按输入顺序返回 func(item) 的迭代器，workers 为 1 或只有一项时在当前进程中执行"""
+    if min(workers, len(items)) <= 1:
+        yield from map(func, items)
+        return
+    with ProcessPoolExecutor(min(workers, len(items))) as pool:
+        yield from pool.map(func, items, chunksize=CHUNK_SIZE)
+
+
+def parse_record_files(paths, workers=None, keep_data=True):
+    """
+    并行解析多个记录文件
+
+    参数:
+        paths     - 文件路径列表
+        workers   - 工作进程数，为空时使用 CPU 核数；为 1 或只有一个文件时在当前进程中解析
+        keep_data - 传给 parse_record_file()
+
+    返回:
+        按输入顺序产生 parse_record_file() 结果的迭代器
+    """
+    func = functools.partial(parse_record_file, keep_data=keep_data)
+    return _parallel_map(func, paths, workers or os.cpu_count() or 1)
+
+
+def graft_record(parent, result, taken):
+    """
+    把解析好的记录作为子树挂到 parent 下，与 taken 中重复的节点 ID 换成新的 ID
+
+    参数:
+        parent - 挂载到的节点
+        result - parse_record_file() 的结果，挂载后补充 'node'（子树根节点 ID）、'nodes'、'remapped'、'graft_time'
+        taken  - 目标树中已使用的节点 ID 集合，挂载的节点 ID 会加入其中
+
+    返回:
+        子树根节点，解析失败的结果返回 None
+    """
+    data = result.pop('data', None)
+    ids = result.pop('ids', [])
+    result.update(node=None, nodes=0, remapped=0, graft_time=0.0)
+    if data is None:
+        return None
+    started = time.perf_counter()
+    # 同一文件中重复出现的 ID 也算作冲突，这些节点全部换成新 ID
+    collisions = set()
+    for node_id in ids:
+        if node_id in taken:
+            collisions.add(node_id)
+        taken.add(node_id)
+    node = build_tree_node_from_dict(data)
+    nodes = 0
+    for item in node.walk():
+        nodes += 1
+        if item.id in collisions:
+            item.id = str(uuid.uuid4())
+            taken.add(item.id)
+            result['remapped'] += 1
+    parent.add_child(node)
+    result.update(node=node.id, nodes=nodes, graft_time=time.perf_counter() - started)
+    return node
+
+
+def import_records(parent, paths, workers=None, progress=None):
+    """
+    批量导入记录文件，各自作为 parent 的子节点
+
+    参数:
+        parent   - 挂载到的节点，与其所在整棵树中已有的节点 ID 重复的会换成新 ID
+        paths    - 文件路径列表
+        workers  - 解析用的工作进程数，为空时为 1（在当前进程中解析）
+        progress - 可选的回调 progress(已完成的文件数, 总文件数, 该文件的结果)
+
+    返回:
+        {'files': [每个文件的结果], 'imported', 'failed', 'nodes', 'remapped', 'bytes', 'elapsed', 'workers'}
+    """
+    started = time.perf_counter()
+    root = parent
+    while root.parent is not None:
+        root = root.parent
+    taken = {node.id for node in root.walk()}
+    workers = min(workers or 1, max(len(paths), 1))
+    results = []
+    for result in parse_record_files(paths, workers):
+        graft_record(parent, result, taken)
+        results.append(result)
+        if progress is not None:
+            progress(len(results), len(paths), result)
+    return _summarize(results, time.perf_counter() - started, workers)
+
+
+def _collisions(ids, taken):
+    """返回 ids 中需要换掉的 ID（已在 taken 中或在 ids 中重复出现），并把 ids 加入 taken"""
+    collisions = set()
+    for node_id in ids:
+        if node_id in taken:
+            collisions.add(node_id)
+        taken.add(node_id)
+    return collisions
+
+
+def serialize_record_file(task):
+    """
+    在工作进程中把记录文件序列化为目标文件中的 JSON 片段
+
+    参数:
+        task - (文件路径, 需要换成新 ID 的节点 ID 集合, 片段第二行起的缩进空格数)
+
+    返回:
+        {'text', 'node', 'nodes', 'remapped', 'time'}
+    """
+    path, collisions, pad = task
+    started = time.perf_counter()
+    with open(path, "r", encoding="utf-8") as f:
+        data = decode_record(json.load(f))
+    errors = validate_record(data)
+    if errors:
+        # 第一遍校验之后文件被修改
+        raise ValueError(f"{path}: {errors[0]}")
+    nodes = 0
+    remapped = 0
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        nodes += 1
+        if item.get('id') in collisions:
+            item['id'] = str(uuid.uuid4())
+            remapped += 1
+        elif 'id' not in item:
+            # 与 build_tree_node_from_dict() 一样为没有 ID 的节点生成 ID
+            item['id'] = str(uuid.uuid4())
+        stack.extend(item.get('children', []))
+    # 按 serialize_node() 的字段和顺序重新组织，与先导入到内存再保存得到的文件相同
+    text = json.dumps(_normalize(data), ensure_ascii=False, indent=INDENT).replace("\n", "\n" + " " * pad)
+    return {'text': text, 'node': data['id'], 'nodes': nodes, 'remapped': remapped,
+            'time': time.perf_counter() - started}
+
+
+def _normalize(data):
+    """把记录文件中的字典整理为 serialize_node() 输出的字段顺序"""
+    fields = {'id': data['id'], 'topic': data['topic']}
+    if 'chats_z' in data:
+        fields['chats_z'] = data['chats_z']
+    else:
+        fields['chats'] = data.get('chats', [])
+    fields['children'] = [_normalize(child) for child in data.get('children', [])]
+    return fields
+
+
+def import_records_to_file(store_path, paths, parent_id=None, output=None, workers=None, progress=None):
+    """
+    批量导入记录文件，直接写入目标记录文件，不在主进程中创建导入的节点
+
+    参数:
+        store_path - 目标记录文件，不存在时从空树开始
+        paths      - 要导入的文件路径列表
+        parent_id  - 挂载到的节点 ID，为空时为根节点
+        output     - 写出的文件，为空时覆盖 store_path（先写临时文件再替换）；没有成功导入的文件时不写出
+        workers    - 工作进程数，为空时使用 CPU 核数
+        progress   - 可选的回调 progress(已完成的文件数, 总文件数, 该文件的结果)，解析和写出阶段各调用一次
+
+    返回:
+        与 import_records() 相同的结果
+    """
+    started = time.perf_counter()
+    tree = load_tree(store_path) if os.path.exists(store_path) else Tree()
+    parent = tree.find_node(parent_id) if parent_id else tree.root
+    if parent is None:
+        raise KeyError(f"找不到节点: {parent_id}")
+    depth = 0
+    node = parent
+    while node.parent is not None:
+        node = node.parent
+        depth += 1
+    taken = {node.id for node in tree.root.walk()}
+    workers = min(workers or os.cpu_count() or 1, max(len(paths), 1))
+
+    # 第一遍：并行解析、校验并收集节点 ID
+    results = []
+    tasks = []
+    # 父节点的 children 列表中的元素位于第 2 * depth + 2 层缩进
+    pad = INDENT * (2 * depth + 2)
+    for result in parse_record_files(paths, workers, keep_data=False):
+        ids = result.pop('ids')
+        result.pop('data')
+        result.update(node=None, nodes=0, remapped=0, graft_time=0.0)
+        if result['error'] is None:
+            tasks.append((result['path'], _collisions(ids, taken), pad))
+        results.append(result)
+        if progress is not None:
+            progress(len(results), len(paths), result)
+
+    if not tasks:
+        return _summarize(results, time.perf_counter() - started, workers)
+
+    # 在父节点的 children 末尾放入占位字符串，序列化后替换为各文件的片段
+    marker = f"bulk-import-{uuid.uuid4()}"
+    data = serialize_node(tree.root)
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if item['id'] == parent.id:
+            item['children'].extend(f"{marker}-{i}" for i in range(len(tasks)))
+            break
+        stack.extend(item['children'])
+    text = json.dumps(data, ensure_ascii=False, indent=INDENT)
+    del data, tree
+
+    # 第二遍：并行序列化，按顺序拼接写出
+    output = output or store_path
+    folder = os.path.dirname(output)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    succeeded = [result for result in results if result['error'] is None]
+    temp_path = output + ".importing"
+    position = 0
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for i, (result, fragment) in enumerate(zip(succeeded, _parallel_map(serialize_record_file, tasks, workers))):
+                placeholder = f'"{marker}-{i}"'
+                index = text.index(placeholder, position)
+                f.write(text[position:index])
+                f.write(fragment['text'])
+                position = index + len(placeholder)
+                result.update(node=fragment['node'], nodes=fragment['nodes'], remapped=fragment['remapped'],
+                              graft_time=fragment['time'])
+                if progress is not None:
+                    progress(i + 1, len(succeeded), result)
+            f.write(text[position:])
+        os.replace(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return _summarize(results, time.perf_counter() - started, workers)
+
+
+def _summarize(results, elapsed, workers):
+    imported = [result for result in results if result['error'] is None]
+    return {
+        'files': results,
+        'imported': len(imported),
+        'failed': len(results) - len(imported),
+        'nodes': sum(result['nodes'] for result in imported),
+        'remapped': sum(result['remapped'] for result in imported),
+        'bytes': sum(result['bytes'] for result in results),
+        'elapsed': elapsed,
+        'workers': workers,
+    }
+
+
+def format_import_report(report, verbose=False):
+    """
+    将 import_records() 的结果格式化为多行文本
+
+    参数:
+        verbose - 为 True 时列出每个文件的耗时，否则只列出失败的文件
+    """
+    elapsed = report['elapsed'] or 1e-9
+    lines = [f"导入 {report['imported']} 个文件，失败 {report['failed']} 个，共 {report['nodes']} 个节点"
+             f"（{report['remapped']} 个节点 ID 重复，已换成新 ID）",
+             f"耗时 {report['elapsed']:.2f}s，{len(report['files']) / elapsed:.1f} 个文件/秒，"
+             f"{report['bytes'] / 1024 / 1024 / elapsed:.1f} MB/s，{report['workers']} 个工作进程"]
+    for result in report['files']:
+        if result['error'] is not None:
+            lines.append(f"  失败 {result['path']}: {result['error']}")
+        elif verbose:
+            lines.append(f"  {result['path']}: {result['nodes']} 个节点，解析 {result['parse_time'] * 1000:.1f}ms，"
+                         f"挂载 / 写出 {result['graft_time'] * 1000:.1f}ms")
+    return "\n".join(lines)
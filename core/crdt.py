@@ -0,0 +1,645 @@
+"""
+多人同时编辑同一棵聊天树的 CRDT（无冲突复制数据类型）
+
+每个副本（replica，如一台电脑上的一个客户端）持有一个 CrdtTree，本地的修改记录为操作，
+副本之间交换增量（delta()/merge()），无论操作以什么顺序、重复多少次到达，所有副本最终得到相同的树。
+节点沿用 TreeNode 的 id，三类数据分别使用不同的 CRDT：
+    结构 - 可安全移动的树（Kleppmann 等人的 move 操作）：创建、移动、删除都是"把节点挂到某个父节点下"，
+           删除即移到回收站 TRASH。所有 move 按时间戳全序执行，迟到的操作先撤销时间戳更大的操作、
+           执行后再重做，会形成环的移动被忽略，因此并发的交叉移动不会产生环或丢失子树。
+           兄弟节点按挂上父节点的时间戳排序。
+    主题 - 最后写入者胜出的寄存器（LWW）。
+    消息 - 只追加的序列：每条消息带有时间戳，按时间戳排序，并发追加在所有副本上得到相同的交错顺序。
+           不支持修改或删除已有的消息。
+
+时间戳为 Lamport 时钟 (计数, 副本 ID)；从已有的树创建时，初始内容使用 (0, "", 序号) 形式的基线时间戳，
+小于任何真实操作，从同一个记录文件创建的副本初始状态完全相同。
+
+增量同步: 每个副本维护版本向量（每个副本已收到的最大计数），delta(对方的版本向量) 只包含对方缺少的操作，
+merge() 只处理新收到的操作，乱序到达时撤销 / 重做的也只有时间戳更大的操作，开销与交换的增量成正比。
+
+垃圾回收: collect_garbage() 丢弃不再需要的历史 —
+    move 日志：所有已知副本的时钟都已超过的操作不会再被撤销（之后的操作时间戳一定更大）；
+    操作存储：所有已知副本都已收到的操作不需要再发送，对方需要已丢弃的操作时 delta() 改为发送完整状态。
+回收依赖已知副本的列表（add_peer() 或收到过其增量）。新副本加入时先把自己的 delta() 交给一个已有副本合并（登记），
+再合并对方返回的增量（通常是完整状态）之后才开始修改；其他副本通过该副本报告的 horizon() 间接得知新副本，
+不会过早回收。新副本应登记在其他副本都会与之同步的副本上（如服务端）。
+
+与 Tree 配合: from_tree() 由已有的树创建副本；record(tree) 把本地对 Tree 的修改（按 Merkle 哈希只检查变化的子树）
+记录为操作；update_tree(tree) 把合并进来的修改应用到 Tree 上，只处理受影响的节点。
+"""
+import bisect
+import heapq
+import json
+import logging
+import os
+import uuid
+
+from core.tree import Tree, TreeNode
+
+logger = logging.getLogger(__name__)
+
+# 回收站：删除的节点移到这里，仍可被并发的操作移回
+TRASH = "<trash>"
+# 操作类型，操作为列表 [计数, 副本 ID, 类型, 节点 ID, 参数...]：
+#     MOVE   [c, r, "m", 节点, 父节点, 主题]   主题为空时只移动，非空时同时设置主题（创建）
+#     TOPIC  [c, r, "t", 节点, 主题]
+#     APPEND [c, r, "a", 节点, 消息]
+MOVE = "m"
+TOPIC = "t"
+APPEND = "a"
+# 比所有计数为 c 的时间戳都大的键，用于二分查找
+_MAX_REPLICA = "\U0010ffff"
+
+
+def _ts(op):
+    return (op[0], op[1])
+
+
+def _base_ts(index):
+    """从已有的树创建时使用的基线时间戳"""
+    return (0, "", index)
+
+
+class CrdtTree:
+    """
+    一个副本上的聊天树 CRDT
+
+    本地修改: create() / move() / delete() / rename() / append()，返回生成的操作；
+    同步: version() 为版本向量，delta(since) 生成增量，merge(message) 合并对方的增量；
+    读取: topic() / messages() / children() / is_visible() / to_tree()。
+    """
+    def __init__(self, replica, root_id, root_topic="会话根节点"):
+        """
+        参数:
+            replica    - 本副本的 ID，在所有副本中唯一
+            root_id    - 根节点 ID，所有副本相同
+            root_topic - 根节点的初始主题
+        """
+        self.replica = replica
+        self.root_id = root_id
+        self.clock = 0
+        # 已知的其他副本: ID -> {'clock': 其时钟的下界, 'horizon': 其报告的 horizon(), 'version': 其报告的版本向量}
+        self.peers = {}
+        self._parent = {root_id: None}  # 节点 -> (父节点, 挂上时的时间戳)
+        self._children = {}  # 父节点 -> {子节点: 时间戳}
+        self._topics = {root_id: (_base_ts(0), root_topic)}  # 节点 -> (时间戳, 主题)
+        self._messages = {}  # 节点 -> [(时间戳, 消息)]，按时间戳排序
+        self._log = []  # move 日志 [(时间戳, 节点, 原来的 (父节点, 时间戳), 新父节点)]，按时间戳排序
+        self._ops = {}  # 来源副本 -> 按计数排序的操作列表
+        self._counters = {}  # 来源副本 -> 与 _ops 对应的计数列表，用于二分查找
+        self._seen = {}  # 版本向量: 来源副本 -> 已收到的最大计数
+        self._floor = {}  # 来源副本 -> 已回收的最大计数
+        self._stable = None  # 已回收的 move 日志中最大的时间戳
+        self._dirty = set()  # 合并进来的操作影响到、尚未 update_tree() 的节点
+        self._marking = True
+        self._synced = {}  # 节点 ID -> 上次与 Tree 同步时的子树哈希
+
+    # ------------------------ 创建 ------------------------
+    @classmethod
+    def from_tree(cls, tree, replica):
+        """
+        由已有的树创建副本，从同一份记录创建的各个副本初始状态相同
+
+        参数:
+            tree    - Tree 对象
+            replica - 本副本的 ID
+
+        返回:
+            CrdtTree 对象
+        """
+        root = tree.root
+        crdt = cls(replica, root.id, root.topic)
+        for index, node in enumerate(root.walk()):
+            if node is not root:
+                crdt._place(node.id, (node.parent.id, _base_ts(index)))
+                crdt._topics[node.id] = (_base_ts(index), node.topic)
+            chats = node.peek_chats()
+            if chats:
+                crdt._messages[node.id] = [(_base_ts(i), chat) for i, chat in enumerate(chats)]
+            crdt._synced[node.id] = node.subtree_hash()
+        crdt._dirty.clear()
+        return crdt
+
+    # ------------------------ 读取 ------------------------
+    def topic(self, node_id):
+        entry = self._topics.get(node_id)
+        return entry[1] if entry else None
+
+    def messages(self, node_id):
+        return [text for _, text in self._messages.get(node_id, ())]
+
+    def parent(self, node_id):
+        entry = self._parent.get(node_id)
+        return entry[0] if entry else None
+
+    def children(self, node_id):
+        """子节点 ID，按挂上父节点的时间戳排序"""
+        children = self._children.get(node_id)
+        if not children:
+            return []
+        return sorted(children, key=children.get)
+
+    def is_visible(self, node_id):
+        """节点是否在树中（沿父节点能到达根节点，不在回收站中）"""
+        seen = 0
+        while node_id is not None and seen <= len(self._parent):
+            if node_id == self.root_id:
+                return True
+            node_id = self.parent(node_id)
+            seen += 1
+        return False
+
+    def is_ancestor(self, ancestor_id, node_id):
+        """ancestor_id 是否为 node_id 或其祖先"""
+        while node_id is not None:
+            if node_id == ancestor_id:
+                return True
+            node_id = self.parent(node_id)
+        return False
+
+    def version(self):
+        """版本向量: 来源副本 -> 已收到的最大计数"""
+        return dict(self._seen)
+
+    def to_tree(self):
+        """按当前状态创建新的 Tree（节点 ID 不变）"""
+        tree = Tree()
+        tree.root = self._build(self.root_id, {})
+        tree.current_node = tree.root
+        return tree
+
+    def _build(self, node_id, nodes):
+        """由状态创建子树，nodes 中已有的节点直接复用（只调整父子关系）"""
+        root = None
+        stack = [(node_id, None)]
+        while stack:
+            current_id, parent = stack.pop()
+            node = nodes.get(current_id)
+            if node is None:
+                node = TreeNode(self.topic(current_id) or "", current_id)
+                node.chats = self.messages(current_id)
+                nodes[current_id] = node
+                stack.extend((child_id, node) for child_id in reversed(self.children(current_id)))
+            if parent is None:
+                root = node
+            else:
+                if node.parent is not None and node.parent is not parent:
+                    node.parent.delete_child(node)
+                if node.parent is not parent:
+                    parent.add_child(node)
+        return root
+
+    # ------------------------ 本地修改 ------------------------
+    def _tick(self):
+        self.clock += 1
+        return self.clock
+
+    def _local(self, op):
+        self._store(op)
+        self._apply([op])
+        return op
+
+    def _check_visible(self, node_id):
+        if not self.is_visible(node_id):
+            raise ValueError(f"节点不在树中: {node_id}")
+
+    def create(self, parent_id, topic, node_id=None):
+        """
+        在 parent_id 下创建节点
+
+        参数:
+            parent_id - 父节点 ID
+            topic     - 主题
+            node_id   - 新节点的 ID，为空时生成新的 UUID
+
+        返回:
+            新节点的 ID
+        """
+        self._check_visible(parent_id)
+        node_id = node_id or str(uuid.uuid4())
+        if node_id in self._parent:
+            raise ValueError(f"节点已存在: {node_id}")
+        self._local([self._tick(), self.replica, MOVE, node_id, parent_id, topic])
+        return node_id
+
+    def move(self, node_id, parent_id):
+        """
+        把节点移到 parent_id 下（放在最后）
+
+        返回:
+            生成的操作
+        """
+        if node_id == self.root_id:
+            raise ValueError("不能移动根节点")
+        self._check_visible(node_id)
+        self._check_visible(parent_id)
+        if self.is_ancestor(node_id, parent_id):
+            raise ValueError("不能把节点移动到自身或其后代之下")
+        return self._local([self._tick(), self.replica, MOVE, node_id, parent_id, None])
+
+    def delete(self, node_id):
+        """删除节点及其子树（移到回收站）"""
+        if node_id == self.root_id:
+            raise ValueError("不能删除根节点")
+        self._check_visible(node_id)
+        return self._local([self._tick(), self.replica, MOVE, node_id, TRASH, None])
+
+    def rename(self, node_id, topic):
+        """修改主题"""
+        if node_id not in self._parent:
+            raise ValueError(f"找不到节点: {node_id}")
+        return self._local([self._tick(), self.replica, TOPIC, node_id, topic])
+
+    def append(self, node_id, text):
+        """在节点的聊天记录末尾追加一条消息"""
+        if node_id not in self._parent:
+            raise ValueError(f"找不到节点: {node_id}")
+        return self._local([self._tick(), self.replica, APPEND, node_id, text])
+
+    # ------------------------ 执行操作 ------------------------
+    def _store(self, op):
+        """保存新操作并推进时钟，已收到过的操作返回 False"""
+        counter, origin = op[0], op[1]
+        if counter <= self._seen.get(origin, 0):
+            return False
+        self._ops.setdefault(origin, []).append(op)
+        self._counters.setdefault(origin, []).append(counter)
+        self._seen[origin] = counter
+        if counter > self.clock:
+            self.clock = counter
+        peer = self.peers.get(origin)
+        if peer is not None and counter > peer['clock']:
+            peer['clock'] = counter
+        return True
+
+    def _apply(self, ops):
+        """
+        执行一批新操作
+
+        返回:
+            为插入迟到的 move 而撤销并重做的日志条数
+        """
+        moves = []
+        for op in ops:
+            kind, node_id = op[2], op[3]
+            if kind == MOVE:
+                moves.append((_ts(op), node_id, op[4]))
+                if op[5] is not None:
+                    self._set_topic(_ts(op), node_id, op[5])
+            elif kind == TOPIC:
+                self._set_topic(_ts(op), node_id, op[4])
+            elif kind == APPEND:
+                bisect.insort(self._messages.setdefault(node_id, []), (_ts(op), op[4]))
+                self._mark(node_id)
+        if not moves:
+            return 0
+        moves.sort()
+        first = moves[0][0]
+        if self._stable is not None and first <= self._stable:
+            logger.warning(f"收到早于已回收日志的操作 {first}，可能有副本未登记为 peer，结果可能不一致")
+        # 撤销时间戳更大的操作，与新操作按时间戳合并后依次执行
+        redo = []
+        while self._log and self._log[-1][0] > first:
+            ts, node_id, old, parent_id = self._log.pop()
+            self._restore(node_id, old)
+            redo.append((ts, node_id, parent_id))
+        for ts, node_id, parent_id in heapq.merge(moves, reversed(redo)):
+            self._do_move(ts, node_id, parent_id)
+        return len(redo)
+
+    def _do_move(self, ts, node_id, parent_id):
+        old = self._parent.get(node_id)
+        self._log.append((ts, node_id, old, parent_id))
+        if node_id == self.root_id or self.is_ancestor(node_id, parent_id):
+            # 会形成环的移动被忽略（各副本按相同的顺序判断，结果一致）
+            return
+        self._place(node_id, (parent_id, ts))
+
+    def _restore(self, node_id, old):
+        current = self._parent.get(node_id)
+        if current == old:
+            return
+        if old is None:
+            self._unlink(node_id, current)
+            del self._parent[node_id]
+        else:
+            self._place(node_id, old)
+
+    def _place(self, node_id, entry):
+        self._unlink(node_id, self._parent.get(node_id))
+        self._parent[node_id] = entry
+        self._children.setdefault(entry[0], {})[node_id] = entry[1]
+        self._mark(node_id)
+        self._mark(entry[0])
+
+    def _unlink(self, node_id, entry):
+        if entry is None:
+            return
+        siblings = self._children.get(entry[0])
+        if siblings is not None:
+            siblings.pop(node_id, None)
+            if not siblings:
+                del self._children[entry[0]]
+        self._mark(entry[0])
+
+    def _set_topic(self, ts, node_id, topic):
+        current = self._topics.get(node_id)
+        if current is None or ts > current[0]:
+            self._topics[node_id] = (ts, topic)
+            self._mark(node_id)
+
+    def _mark(self, node_id):
+        if self._marking:
+            self._dirty.add(node_id)
+
+    # ------------------------ 同步 ------------------------
+    def add_peer(self, replica):
+        """登记一个其他副本，之后的垃圾回收会等待它收到操作"""
+        if replica != self.replica:
+            self.peers.setdefault(replica, {'clock': 0, 'horizon': 0, 'version': {}})
+
+    def horizon(self):
+        """
+        本副本及直接联系过的副本之后的操作计数都会大于该值：本副本的时钟和已知副本时钟中的最小值
+
+        其他副本回收时同时参考各副本报告的 horizon，因此只登记在某个副本上的新副本也不会被过早回收。
+        """
+        return min([self.clock] + [peer['clock'] for peer in self.peers.values()])
+
+    def delta(self, since=None):
+        """
+        生成对方缺少的增量
+
+        参数:
+            since - 对方的版本向量（version()），为空时发送全部操作
+
+        返回:
+            可 JSON 序列化的消息 {'replica', 'clock', 'horizon', 'version', 'ops'}；
+            对方需要的操作已被回收时不含 ops，改为 'state'（完整状态）
+        """
+        since = since or {}
+        message = {'replica': self.replica, 'clock': self.clock, 'horizon': self.horizon(), 'version': self.version()}
+        if any(since.get(origin, 0) < floor for origin, floor in self._floor.items()):
+            message['state'] = self.state()
+            return message
+        ops = []
+        for origin, counters in self._counters.items():
+            start = bisect.bisect_right(counters, since.get(origin, 0))
+            ops.extend(self._ops[origin][start:])
+        ops.sort(key=_ts)
+        message['ops'] = ops
+        return message
+
+    def merge(self, message):
+        """
+        合并其他副本的增量，重复或乱序到达的消息也可以安全合并
+
+        参数:
+            message - 对方 delta() 的结果（可以经过 JSON 序列化）
+
+        返回:
+            {'applied': 新执行的操作数, 'redone': 撤销并重做的日志条数}
+        """
+        sender = message['replica']
+        if sender != self.replica:
+            self.add_peer(sender)
+            peer = self.peers[sender]
+            peer['clock'] = max(peer['clock'], message['clock'])
+            peer['horizon'] = max(peer['horizon'], message['horizon'])
+            for origin, counter in message['version'].items():
+                if counter > peer['version'].get(origin, 0):
+                    peer['version'][origin] = counter
+        if 'state' in message:
+            return self._merge_state(message['state'])
+        # 按时间戳排序后每个来源的操作依次到达，_store() 可以据版本向量去重
+        new = [op for op in sorted(message['ops'], key=_ts) if self._store(op)]
+        return {'applied': len(new), 'redone': self._apply(new)}
+
+    def _merge_state(self, state):
+        """以对方的完整状态为基础，重新执行本副本有而对方没有的操作"""
+        version = state['version']
+        missing = []
+        for origin, ops in self._ops.items():
+            start = bisect.bisect_right(self._counters[origin], version.get(origin, 0))
+            missing.extend(ops[start:])
+        missing.sort(key=_ts)
+        clock = self.clock
+        self._load_state(state)
+        self.clock = max(self.clock, clock)
+        # 结构整体替换，update_tree() 时所有节点都需要检查
+        self._dirty.update(self._parent)
+        new = [op for op in missing if self._store(op)]
+        return {'applied': len(new), 'redone': self._apply(new)}
+
+    def collect_garbage(self):
+        """
+        回收不再需要的 move 日志和已被所有已知副本收到的操作
+
+        返回:
+            {'log': 回收的日志条数, 'ops': 回收的操作数}
+        """
+        # 任何副本之后的操作计数都大于 stable，计数不超过 stable 的 move 不会再被撤销
+        stable = min([self.horizon()] + [peer['horizon'] for peer in self.peers.values()])
+        count = bisect.bisect_right(self._log, ((stable, _MAX_REPLICA),))
+        if count:
+            self._stable = self._log[count - 1][0]
+            del self._log[:count]
+        collected = 0
+        for origin, counters in self._counters.items():
+            acked = min([peer['version'].get(origin, 0) for peer in self.peers.values()],
+                        default=self._seen.get(origin, 0))
+            drop = bisect.bisect_right(counters, acked)
+            if drop:
+                del counters[:drop]
+                del self._ops[origin][:drop]
+                self._floor[origin] = max(self._floor.get(origin, 0), acked)
+                collected += drop
+        return {'log': count, 'ops': collected}
+
+    def stats(self):
+        """节点数、消息数、move 日志和操作存储的长度"""
+        return {'nodes': len(self._parent), 'visible': sum(1 for node_id in self._parent if self.is_visible(node_id)),
+                'messages': sum(len(messages) for messages in self._messages.values()),
+                'log': len(self._log), 'ops': sum(len(ops) for ops in self._ops.values()),
+                'peers': len(self.peers), 'clock': self.clock}
+
+    # ------------------------ 状态 ------------------------
+    def state(self):
+        """完整状态（可 JSON 序列化，不含副本 ID 和已知副本）"""
+        return {
+            'root': self.root_id,
+            'clock': self.clock,
+            'parent': {node_id: [entry[0], list(entry[1])] for node_id, entry in self._parent.items()
+                       if entry is not None},
+            'topics': {node_id: [list(ts), topic] for node_id, (ts, topic) in self._topics.items()},
+            'messages': {node_id: [[list(ts), text] for ts, text in messages]
+                         for node_id, messages in self._messages.items()},
+            'log': [[list(ts), node_id, [old[0], list(old[1])] if old else None, parent_id]
+                    for ts, node_id, old, parent_id in self._log],
+            'ops': self._ops,
+            'version': self._seen,
+            'floor': self._floor,
+            'stable': list(self._stable) if self._stable else None,
+        }
+
+    def _load_state(self, state):
+        self.root_id = state['root']
+        self.clock = state['clock']
+        self._parent = {self.root_id: None}
+        self._children = {}
+        for node_id, (parent_id, ts) in state['parent'].items():
+            self._parent[node_id] = (parent_id, tuple(ts))
+            self._children.setdefault(parent_id, {})[node_id] = tuple(ts)
+        self._topics = {node_id: (tuple(ts), topic) for node_id, (ts, topic) in state['topics'].items()}
+        self._messages = {node_id: [(tuple(ts), text) for ts, text in messages]
+                          for node_id, messages in state['messages'].items()}
+        self._log = [(tuple(ts), node_id, (old[0], tuple(old[1])) if old else None, parent_id)
+                     for ts, node_id, old, parent_id in state['log']]
+        self._ops = {origin: [list(op) for op in ops] for origin, ops in state['ops'].items()}
+        self._counters = {origin: [op[0] for op in ops] for origin, ops in self._ops.items()}
+        self._seen = dict(state['version'])
+        self._floor = dict(state['floor'])
+        self._stable = tuple(state['stable']) if state['stable'] else None
+
+    def save(self, path):
+        """把副本（含已知副本）保存为 JSON 文件"""
+        data = {'replica': self.replica, 'peers': self.peers, 'state': self.state()}
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """从 save() 保存的文件加载副本"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        crdt = cls(data['replica'], data['state']['root'])
+        crdt._load_state(data['state'])
+        crdt.peers = data['peers']
+        return crdt
+
+    # ------------------------ 与 Tree 同步 ------------------------
+    def record(self, tree):
+        """
+        把本地对 Tree 的修改记录为操作，只检查子树哈希与上次同步时不同的节点
+
+        支持新增、删除、移动节点，修改主题和追加消息；修改已有的消息无法用只追加的序列表示，记录警告后忽略。
+        子节点顺序的变化记录为把第一个位置不同的子节点及其后的子节点依次移到最后。
+
+        参数:
+            tree - 根节点 ID 与副本相同的 Tree 对象
+
+        返回:
+            生成的操作列表
+        """
+        if tree.root.id != self.root_id:
+            raise ValueError("树的根节点与副本不同")
+        # 这些修改已经在 Tree 上，不需要再由 update_tree() 应用
+        self._marking = False
+        try:
+            return self._record(tree)
+        finally:
+            self._marking = True
+
+    def _record(self, tree):
+        ops = []
+        visited = []
+        seen = set()
+        stack = [tree.root]
+        while stack:
+            node = stack.pop()
+            node_hash = node.subtree_hash()
+            if self._synced.get(node.id) == node_hash:
+                continue
+            visited.append(node)
+            if self.topic(node.id) != node.topic:
+                ops.append(self.rename(node.id, node.topic))
+            known = self._messages.get(node.id, ())
+            chats = node.peek_chats()
+            if len(chats) >= len(known) and all(chats[i] == known[i][1] for i in range(len(known))):
+                ops.extend(self.append(node.id, chat) for chat in chats[len(known):])
+            else:
+                logger.warning(f"节点 {node.id} 已有的聊天记录被修改，只追加的序列无法表示，已忽略")
+            for child in node.children:
+                seen.add(child.id)
+                if child.id not in self._parent:
+                    self.create(node.id, child.topic, child.id)
+                    ops.append(self._ops[self.replica][-1])
+                elif self.parent(child.id) != node.id:
+                    ops.append(self.move(child.id, node.id))
+            # 顺序不同时，从第一个不同的位置起依次重新挂到最后
+            order = [child.id for child in node.children]
+            known = [child_id for child_id in self.children(node.id) if child_id in seen]
+            if known != order:
+                start = next(i for i, (a, b) in enumerate(zip(known, order)) if a != b)
+                ops.extend(self.move(child_id, node.id) for child_id in order[start:])
+            stack.extend(reversed(node.children))
+        for node in visited:
+            for child_id in self.children(node.id):
+                if child_id not in seen:
+                    ops.append(self.delete(child_id))
+            self._synced[node.id] = node.subtree_hash()
+        return ops
+
+    def update_tree(self, tree):
+        """
+        把合并进来的修改应用到 Tree 上，只处理受影响的节点；当前节点被删除时切换到根节点
+
+        返回:
+            处理的节点数
+        """
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+        nodes = {node.id: node for node in tree.root.walk()}
+        changed = []
+        for node_id in dirty:
+            if node_id == TRASH or node_id not in self._parent or not self.is_visible(node_id):
+                continue
+            node = nodes.get(node_id)
+            if node is None:
+                # 新节点或从回收站移回的节点，整棵子树按状态创建
+                node = self._build(node_id, nodes)
+            topic = self.topic(node_id)
+            if topic is not None and node.topic != topic:
+                node.topic = topic
+            texts = self.messages(node_id)
+            chats = node.peek_chats()
+            if len(chats) != len(texts) or list(chats) != texts:
+                if len(texts) > len(chats) and texts[:len(chats)] == list(chats):
+                    node.chats.extend(texts[len(chats):])
+                else:
+                    node.chats = texts
+            changed.append(node)
+        # 先确定所有子节点列表再统一调整，调整过程中父子关系可能暂时成环，最后才清除哈希缓存
+        layout = []
+        for node in changed:
+            wanted = [nodes.get(child_id) or self._build(child_id, nodes) for child_id in self.children(node.id)]
+            if [child.id for child in node.children] != [child.id for child in wanted]:
+                layout.append((node, wanted))
+        relinked = []
+        for node, wanted in layout:
+            for child in node.children:
+                if child.parent is node:
+                    child.parent = None
+            for child in wanted:
+                if child.parent is not None and child.parent is not node:
+                    child.parent.children.remove(child)
+                    relinked.append(child.parent)
+                child.parent = node
+            node.children = wanted
+            relinked.append(node)
+        for node in relinked:
+            node.invalidate()
+        current = tree.current_node
+        while current.parent is not None:
+            current = current.parent
+        if current is not tree.root:
+            tree.current_node = tree.root
+        for node in changed:
+            while node is not None:
+                self._synced[node.id] = node.subtree_hash()
+                node = node.parent
+        return len(changed)
@@ -0,0 +1,211 @@
+"""
+聊天记录的内容去重
+
+内存中: 加载记录时 intern_chats() 把消息字符串驻留（sys.intern），复制出的子树、重复的系统消息、
+空白的输入等内容相同的消息在整个进程中只保留一个对象；core.events 生成的系统消息同样是驻留的。
+
+记录文件中: encode_record() 把 serialize_node() 得到的字典转换为按内容寻址的去重格式:
+    {"format": "treechat-dedup", "version": 1,
+     "strings": {键: 文本},   出现两次及以上的消息和系统消息参数，键为文本 sha256 的前 12 位十六进制（冲突时加长）
+     "root": 根节点}
+节点中有引用或系统消息时用 chats_d 字段代替 chats，每一项为:
+    "文本"                           只出现一次的消息，原样保存
+    {"r": 键}                        strings 中的文本
+    {"e": 类型, "a": [参数, ...]}    由 core.events 的模板生成的系统消息，参数同样可以是 {"r": 键}
+decode_record() 把它还原为普通格式的字典，普通格式的字典原样返回。已压缩的节点（chats_z）不做处理。
+"""
+import hashlib
+import json
+import sys
+
+from core.events import SYSTEM_EVENTS, parse_event, render_args
+
+DEDUP_FORMAT = "treechat-dedup"
+DEDUP_VERSION = 1
+KEY_LENGTH = 12
+# 短于该字节数（JSON 编码后）的文本直接内联，引用本身也要占用十几个字节
+MIN_REF_BYTES = 24
+
+
+def intern_chats(chats):
+    """驻留聊天记录中的字符串，返回新的列表"""
+    return [sys.intern(chat) for chat in chats]
+
+
+def is_dedup_record(data):
+    """data 是否为 encode_record() 生成的去重格式"""
+    return isinstance(data, dict) and data.get('format') == DEDUP_FORMAT
+
+
+def _walk(data):
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        yield item
+        stack.extend(reversed(item.get('children', [])))
+
+
+def _json_bytes(text):
+    return len(json.dumps(text, ensure_ascii=False).encode("utf-8"))
+
+
+def encode_record(data):
+    """
+    把普通格式的记录字典转换为去重格式
+
+    参数:
+        data - serialize_node() 的结果
+
+    返回:
+        可直接写入 JSON 的字典
+    """
+    # 1. 统计每段文本（普通消息和系统消息的参数）出现的次数
+    events = {}
+    counts = {}
+    for item in _walk(data):
+        for chat in item.get('chats', ()):
+            if chat not in events:
+                events[chat] = parse_event(chat)
+            parts = events[chat][1] if events[chat] is not None else (chat,)
+            for text in parts:
+                counts[text] = counts.get(text, 0) + 1
+
+    # 2. 出现多次且足够长的文本放入 strings
+    strings = {}
+    refs = {}
+    for text, count in counts.items():
+        if count < 2 or _json_bytes(text) < MIN_REF_BYTES:
+            continue
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        length = KEY_LENGTH
+        while digest[:length] in strings:
+            length += 4
+        strings[digest[:length]] = text
+        refs[text] = {'r': digest[:length]}
+
+    # 3. 按 serialize_node() 的字段顺序重新组织节点
+    def encode_node(item):
+        node = {'id': item['id'], 'topic': item['topic']}
+        if 'chats_z' in item:
+            node['chats_z'] = item['chats_z']
+        else:
+            chats = []
+            plain = True
+            for chat in item.get('chats', ()):
+                event = events[chat]
+                if event is not None:
+                    chats.append({'e': event[0], 'a': [refs.get(arg, arg) for arg in event[1]]})
+                    plain = False
+                elif chat in refs:
+                    chats.append(refs[chat])
+                    plain = False
+                else:
+                    chats.append(chat)
+            node['chats' if plain else 'chats_d'] = chats
+        node['children'] = [encode_node(child) for child in item.get('children', [])]
+        return node
+
+    return {'format': DEDUP_FORMAT, 'version': DEDUP_VERSION, 'strings': strings, 'root': encode_node(data)}
+
+
+def decode_record(data):
+    """
+    把去重格式还原为普通格式的记录字典，普通格式原样返回
+
+    返回:
+        与 serialize_node() 相同结构的字典
+
+    异常:
+        ValueError - 版本不支持、引用不存在或系统消息类型未知
+    """
+    if not is_dedup_record(data):
+        return data
+    if data.get('version') != DEDUP_VERSION:
+        raise ValueError(f"不支持的去重格式版本: {data.get('version')}")
+    strings = data.get('strings', {})
+    if not isinstance(strings, dict) or not isinstance(data.get('root'), dict):
+        raise ValueError("去重格式缺少 strings 或 root 字段")
+
+    def resolve(value):
+        if isinstance(value, dict):
+            try:
+                return strings[value['r']]
+            except (KeyError, TypeError):
+                raise ValueError(f"找不到引用的文本: {value!r}") from None
+        return value
+
+    def decode_chat(chat):
+        if isinstance(chat, dict) and 'e' in chat:
+            if chat['e'] not in SYSTEM_EVENTS:
+                raise ValueError(f"未知的系统消息类型: {chat['e']!r}")
+            return render_args(chat['e'], [resolve(arg) for arg in chat.get('a', [])])
+        return resolve(chat)
+
+    root = {}
+    stack = [(data['root'], root)]
+    while stack:
+        item, node = stack.pop()
+        node.update((key, value) for key, value in item.items() if key not in ('chats_d', 'children'))
+        if 'chats_d' in item:
+            if not isinstance(item['chats_d'], list):
+                raise ValueError("chats_d 必须是列表")
+            node['chats'] = [decode_chat(chat) for chat in item['chats_d']]
+        children = item.get('children', [])
+        if not isinstance(children, list):
+            # 留给 validate_record() 报告
+            node['children'] = children
+            continue
+        node['children'] = [{} for _ in children]
+        stack.extend(zip(children, node['children']))
+    return root
+
+
+def dedup_report(data):
+    """
+    统计记录中可以去重的内容
+
+    参数:
+        data - 普通格式的记录字典（serialize_node() 的结果）
+
+    返回:
+        {'nodes', 'messages', 'unique', 'events': 识别为系统消息模板的条数,
+         'memory_bytes': 每条消息各自一个字符串对象时占用的字节数, 'interned_bytes': 驻留后的字节数,
+         'plain_bytes': 普通格式记录文件的字节数（与 save_node() 相同的缩进）, 'compact_bytes': 普通格式不缩进时的字节数,
+         'dedup_bytes': 去重格式（不缩进）的字节数, 'strings': 去重格式中共享的文本数}
+    """
+    report = {'nodes': 0, 'messages': 0, 'unique': 0, 'events': 0, 'memory_bytes': 0, 'interned_bytes': 0}
+    seen = set()
+    for item in _walk(data):
+        report['nodes'] += 1
+        for chat in item.get('chats', ()):
+            size = sys.getsizeof(chat)
+            report['messages'] += 1
+            report['memory_bytes'] += size
+            if parse_event(chat) is not None:
+                report['events'] += 1
+            if chat not in seen:
+                seen.add(chat)
+                report['unique'] += 1
+                report['interned_bytes'] += size
+    encoded = encode_record(data)
+    report['plain_bytes'] = len(json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8"))
+    report['compact_bytes'] = len(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    report['dedup_bytes'] = len(json.dumps(encoded, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    report['strings'] = len(encoded['strings'])
+    return report
+
+
+def format_dedup_report(report, name=None):
+    """将 dedup_report() 的结果格式化为多行文本"""
+    messages = report['messages'] or 1
+    memory = report['memory_bytes'] or 1
+    compact = report['compact_bytes'] or 1
+    lines = [f"{name}:" if name else "合计:",
+             f"  {report['nodes']} 个节点，{report['messages']} 条消息，其中 {report['unique']} 条不重复"
+             f"（去重后为 {report['unique'] / messages:.0%}），{report['events']} 条由模板生成的系统消息",
+             f"  内存: {report['memory_bytes']} -> {report['interned_bytes']} 字节"
+             f"（驻留后为 {report['interned_bytes'] / memory:.0%}）",
+             f"  文件: 普通格式 {report['plain_bytes']} 字节，不缩进 {report['compact_bytes']} 字节，"
+             f"去重格式 {report['dedup_bytes']} 字节（为不缩进的 {report['dedup_bytes'] / compact:.0%}，"
+             f"共享 {report['strings']} 段文本）"]
+    return "\n".join(lines)
@@ -0,0 +1,303 @@
+"""
+按节点 ID 比较和三方合并聊天树
+
+diff_trees() 找出两棵树之间新增、删除、移动、重命名的节点，以及追加或修改了聊天记录的节点。
+两边 ID 相同且 Merkle 哈希（TreeNode.subtree_hash()）相同的子树整体跳过，
+只改动了少数节点的大文件比较时只需要检查改动路径上的节点。
+
+merge_trees() 以共同的祖先版本为基准，把对方（theirs）的修改应用到我方（ours）的副本上，
+双方修改了同一处且无法自动合并时记录冲突并保留我方的内容。
+两棵树的根节点总是视为同一个节点，不比较根节点的 ID。
+"""
+from core.records import build_tree_node_from_dict, serialize_node
+from core.tree import Tree
+
+# 根节点在索引中使用的键
+ROOT = "<root>"
+
+ADDED = "added"
+REMOVED = "removed"
+MOVED = "moved"
+RENAMED = "renamed"
+APPENDED = "appended"
+EDITED = "edited"
+
+KIND_NAMES = {
+    ADDED: "新增",
+    REMOVED: "删除",
+    MOVED: "移动",
+    RENAMED: "重命名",
+    APPENDED: "追加消息",
+    EDITED: "修改消息",
+}
+
+
+class Change:
+    """
+    一处差异
+
+    old / new 的含义随 kind 不同：
+        added    - old 为父节点 ID，new 为新增子树的根节点（TreeNode）
+        removed  - old 为原父节点 ID
+        moved    - old / new 为移动前后的父节点 ID
+        renamed  - old / new 为修改前后的主题
+        appended - new 为追加的聊天记录列表
+        edited   - old / new 为修改前后的聊天记录列表
+    """
+    def __init__(self, kind, node_id, topic, old=None, new=None):
+        self.kind = kind
+        self.node_id = node_id
+        self.topic = topic
+        self.old = old
+        self.new = new
+
+    def __str__(self):
+        topic = self.topic.replace("\n", " ")[:40]
+        text = f"{KIND_NAMES[self.kind]} [{self.node_id}] {topic}"
+        if self.kind == ADDED:
+            count = sum(1 for _ in self.new.walk())
+            text += f"（{count} 个节点，父节点 {self.old}）"
+        elif self.kind == MOVED:
+            text += f"（{self.old} -> {self.new}）"
+        elif self.kind == RENAMED:
+            old_topic = self.old.replace("\n", " ")[:40]
+            text += f"（原主题 {old_topic}）"
+        elif self.kind == APPENDED:
+            text += f"（{len(self.new)} 条）"
+        elif self.kind == EDITED:
+            text += f"（{len(self.old)} 条 -> {len(self.new)} 条）"
+        return text
+
+
+class Conflict:
+    """合并时无法自动处理的修改，合并结果保留我方内容"""
+    def __init__(self, change, reason):
+        self.change = change
+        self.reason = reason
+
+    def __str__(self):
+        return f"冲突: {self.change}: {self.reason}"
+
+
+def _key(node, root):
+    return ROOT if node is root else node.id
+
+
+def _parent_key(node, root):
+    parent = node.parent
+    if parent is None:
+        return None
+    return _key(parent, root)
+
+
+def index_tree(root):
+    """返回 {节点键: 节点}，根节点的键为 ROOT"""
+    return {_key(node, root): node for node in root.walk()}
+
+
+def diff_trees(old_root, new_root):
+    """
+    比较两棵树
+
+    参数:
+        old_root - 旧版本的根节点
+        new_root - 新版本的根节点
+
+    返回:
+        Change 列表：先按新树的先序排列新增、移动、重命名和消息变化，再列出删除。
+        新增和删除只报告最上层的节点，其子树作为整体。
+    """
+    old_nodes = index_tree(old_root)
+    new_nodes = {}
+    pruned = set()
+    stack = [new_root]
+    while stack:
+        node = stack.pop()
+        key = _key(node, new_root)
+        new_nodes[key] = node
+        old = old_nodes.get(key)
+        if old is not None and key != ROOT and old.subtree_hash() == node.subtree_hash():
+            # 整棵子树相同，后代不需要比较（整体移动仍会在下面报告）
+            pruned.add(key)
+            continue
+        stack.extend(reversed(node.children))
+
+    changes = []
+    stack = [new_root]
+    while stack:
+        node = stack.pop()
+        key = _key(node, new_root)
+        old = old_nodes.get(key)
+        parent_key = _parent_key(node, new_root)
+        if old is None:
+            # 新增的子树只报告最上层节点，但仍要展开，其中可能有从别处移入的旧节点
+            if parent_key in old_nodes:
+                changes.append(Change(ADDED, key, node.topic, parent_key, node))
+            stack.extend(reversed(node.children))
+            continue
+        old_parent_key = _parent_key(old, old_root)
+        if key != ROOT and old_parent_key != parent_key:
+            changes.append(Change(MOVED, key, node.topic, old_parent_key, parent_key))
+        if key in pruned:
+            continue
+        if old.topic != node.topic:
+            changes.append(Change(RENAMED, key, node.topic, old.topic, node.topic))
+        if old.chats != node.chats:
+            old_chats, new_chats = list(old.chats), list(node.chats)
+            if len(new_chats) > len(old_chats) and new_chats[:len(old_chats)] == old_chats:
+                changes.append(Change(APPENDED, key, node.topic, None, new_chats[len(old_chats):]))
+            else:
+                changes.append(Change(EDITED, key, node.topic, old_chats, new_chats))
+        stack.extend(reversed(node.children))
+
+    # 删除：旧树中（跳过相同的子树）找不到的节点，只报告最上层的
+    stack = [old_root]
+    while stack:
+        node = stack.pop()
+        key = _key(node, old_root)
+        if key in pruned:
+            continue
+        if key not in new_nodes:
+            parent_key = _parent_key(node, old_root)
+            if parent_key in new_nodes:
+                changes.append(Change(REMOVED, key, node.topic, parent_key))
+        stack.extend(reversed(node.children))
+    return changes
+
+
+def _copy_subtree(node):
+    """复制子树，节点 ID 不变，聊天记录字符串与原节点共享"""
+    return build_tree_node_from_dict(serialize_node(node))
+
+
+def _is_descendant(node, ancestor):
+    while node is not None:
+        if node is ancestor:
+            return True
+        node = node.parent
+    return False
+
+
+def merge_trees(base_root, ours_root, theirs_root):
+    """
+    三方合并
+
+    参数:
+        base_root   - 双方共同的祖先版本
+        ours_root   - 我方版本
+        theirs_root - 对方版本
+
+    返回:
+        (合并后的 Tree, 已应用的对方修改 [Change], 冲突 [Conflict])
+        合并结果是我方版本的副本，三个输入都不会被修改。
+    """
+    ours_changes = {}
+    for change in diff_trees(base_root, ours_root):
+        ours_changes.setdefault(change.node_id, {})[change.kind] = change
+    theirs_changes = diff_trees(base_root, theirs_root)
+    base_nodes = index_tree(base_root)
+    ours_nodes = index_tree(ours_root)
+
+    merged = Tree()
+    merged.root = _copy_subtree(ours_root)
+    merged.current_node = merged.root
+    nodes = index_tree(merged.root)
+    applied = []
+    conflicts = []
+
+    def ours_change(key, *kinds):
+        changes = ours_changes.get(key, {})
+        for kind in kinds:
+            if kind in changes:
+                return changes[kind]
+        return None
+
+    # 先新增（移动的目标可能是新增的节点），再改内容，再移动，最后删除（删除前子节点可能已被移走）
+    order = {ADDED: 0, RENAMED: 1, APPENDED: 1, EDITED: 1, MOVED: 2, REMOVED: 3}
+    for change in sorted(theirs_changes, key=lambda c: order[c.kind]):
+        key = change.node_id
+        node = nodes.get(key)
+
+        if change.kind == ADDED:
+            if key in nodes:
+                if nodes[key].subtree_hash() != change.new.subtree_hash():
+                    conflicts.append(Conflict(change, "双方新增了 ID 相同但内容不同的节点"))
+                continue
+            parent = nodes.get(change.old)
+            copy = _copy_subtree(change.new)
+            # 新增子树内可能包含我方已有（从别处移入）的节点，保留我方的那一份
+            for descendant in list(copy.walk()):
+                for child in list(descendant.children):
+                    if child.id in nodes:
+                        descendant.delete_child(child)
+            if parent is None:
+                conflicts.append(Conflict(change, "父节点已被我方删除，已挂到根节点下"))
+                parent = merged.root
+            parent.add_child(copy)
+            nodes.update((n.id, n) for n in copy.walk())
+            applied.append(change)
+            continue
+
+        if node is None:
+            if change.kind != REMOVED:
+                conflicts.append(Conflict(change, "该节点已被我方删除"))
+            continue
+
+        if change.kind == RENAMED:
+            ours = ours_change(key, RENAMED)
+            if ours is not None and ours.new != change.new:
+                conflicts.append(Conflict(change, f"我方也重命名为 {ours.new[:40]}"))
+                continue
+            node.topic = change.new
+            applied.append(change)
+
+        elif change.kind == APPENDED:
+            ours = ours_change(key, EDITED)
+            if ours is not None:
+                conflicts.append(Conflict(change, "我方修改了该节点已有的聊天记录"))
+                continue
+            base_length = len(base_nodes[key].chats)
+            if list(node.chats[base_length:]) == change.new:
+                continue
+            # 双方都追加时保留我方的消息，对方的消息接在后面
+            node.chats.extend(change.new)
+            applied.append(change)
+
+        elif change.kind == EDITED:
+            if list(node.chats) == change.new:
+                continue
+            if ours_change(key, APPENDED, EDITED) is not None:
+                conflicts.append(Conflict(change, "双方都修改了该节点的聊天记录"))
+                continue
+            node.chats = change.new
+            applied.append(change)
+
+        elif change.kind == MOVED:
+            ours = ours_change(key, MOVED)
+            if ours is not None and ours.new != change.new:
+                conflicts.append(Conflict(change, f"我方已将其移动到 {ours.new}"))
+                continue
+            parent = nodes.get(change.new)
+            if parent is None:
+                conflicts.append(Conflict(change, "目标父节点已被我方删除"))
+                continue
+            if _is_descendant(parent, node):
+                conflicts.append(Conflict(change, "目标父节点位于该节点的子树中"))
+                continue
+            if node.parent is not parent:
+                node.parent.delete_child(node)
+                parent.add_child(node)
+            applied.append(change)
+
+        elif change.kind == REMOVED:
+            ours_node = ours_nodes.get(key)
+            if ours_node is not None and ours_node.subtree_hash() != base_nodes[key].subtree_hash():
+                conflicts.append(Conflict(change, "我方修改了该子树，保留未删除"))
+                continue
+            if node.parent is not None:
+                node.parent.delete_child(node)
+                for removed in node.walk():
+                    nodes.pop(removed.id, None)
+            applied.append(change)
+
+    return merged, applied, conflicts
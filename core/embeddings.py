@@ -0,0 +1,327 @@
+"""
+节点主题和聊天记录的向量索引，用于语义搜索
+
+每个节点的主题和每条聊天记录各对应矩阵中的一行，向量通过 Ollama 的 /api/embed 接口计算
+（旧版本 Ollama 退回到 /api/embeddings），按行归一化后保存在记录文件旁边：
+
+    records/经济学.json  ->  records/经济学.emb.npy（向量矩阵）+ records/经济学.emb.json（行对应的节点和消息）
+
+update() 按节点的 content_hash() 判断是否变化，未变化的节点直接复用原有的行，
+变化的节点中文本未变的消息也复用原向量，只有新增或修改的文本需要请求模型。
+search() 用一次矩阵乘法计算余弦相似度，再用 argpartition 取前 k 个。
+
+需要 numpy，未安装时导入本模块不会出错，但创建索引时会提示安装。
+"""
+import hashlib
+import http.client
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+try:
+    import numpy as np
+    USE_NUMPY = True
+except ImportError:
+    USE_NUMPY = False
+
+from core.service import message_kind
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "nomic-embed-text"
+# 每次请求的文本条数
+BATCH_SIZE = 64
+# 超过该字符数的文本截断后再计算向量，避免超出模型的上下文长度
+MAX_TEXT_CHARS = 2000
+# 节点主题在索引中的消息序号
+TOPIC_INDEX = -1
+PREFIXES = {'user': "你: ", 'ai': "AI: ", 'system': "系统: "}
+
+
+def _require_numpy():
+    if not USE_NUMPY:
+        raise RuntimeError("语义搜索需要 numpy，请先执行 pip install numpy")
+
+
+class EmbeddingClient:
+    """调用 Ollama 向量接口的客户端"""
+    def __init__(self, base_url, model=DEFAULT_EMBEDDING_MODEL, timeout=120, batch_size=BATCH_SIZE):
+        if "://" not in base_url:
+            base_url = "http://" + base_url
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self._legacy = False  # 服务端没有 /api/embed 时改用逐条请求的 /api/embeddings
+
+    def _post(self, path, payload):
+        parts = urlsplit(self.base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        conn = connection_class(parts.hostname, parts.port, timeout=self.timeout)
+        try:
+            conn.request("POST", parts.path.rstrip("/") + path, body=json.dumps(payload).encode("utf-8"),
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            body = response.read().decode("utf-8", errors="replace")
+        finally:
+            conn.close()
+        return response.status, body
+
+    @staticmethod
+    def _error(status, body):
+        try:
+            body = json.loads(body).get("error", body)
+        except (ValueError, AttributeError):
+            pass
+        return RuntimeError(f"{body} (status code: {status})")
+
+    def _embed_batch(self, texts):
+        if not self._legacy:
+            status, body = self._post("/api/embed", {'model': self.model, 'input': texts})
+            if status == 200:
+                return json.loads(body)["embeddings"]
+            if status != 404 or "model" in body:
+                raise self._error(status, body)
+            logger.info("服务端不支持 /api/embed，改用 /api/embeddings")
+            self._legacy = True
+        vectors = []
+        for text in texts:
+            status, body = self._post("/api/embeddings", {'model': self.model, 'prompt': text})
+            if status != 200:
+                raise self._error(status, body)
+            vectors.append(json.loads(body)["embedding"])
+        return vectors
+
+    def embed(self, texts):
+        """
+        计算一组文本的向量
+
+        返回:
+            float32 矩阵，每行对应一条文本（未归一化）
+        """
+        _require_numpy()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch([text[:MAX_TEXT_CHARS] for text in texts[start:start + self.batch_size]]))
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def index_paths(records_path):
+    """返回记录文件对应的 (向量矩阵文件, 元数据文件)"""
+    base = os.path.splitext(records_path)[0]
+    return base + ".emb.npy", base + ".emb.json"
+
+
+def node_documents(node):
+    """
+    返回节点中需要建立索引的文本
+
+    返回:
+        [(消息序号, 文本)]，主题的序号为 TOPIC_INDEX；聊天记录去掉 "你: " 等前缀，跳过空白文本
+    """
+    documents = []
+    if node.topic.strip():
+        documents.append((TOPIC_INDEX, node.topic))
+    # 已压缩的节点临时解压，不改变压缩状态
+    for index, chat in enumerate(node.peek_chats()):
+        prefix = PREFIXES.get(message_kind(chat), "")
+        text = chat[len(prefix):].strip()
+        if text:
+            documents.append((index, text))
+    return documents
+
+
+def _digest(text):
+    return hashlib.sha1(text[:MAX_TEXT_CHARS].encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EmbeddingIndex:
+    """
+    向量索引
+
+    matrix 的第 i 行对应 node_ids[row_node[i]] 节点的第 row_index[i] 条消息（TOPIC_INDEX 为主题），
+    digests[i] 为该行文本的摘要；node_hashes 记录建立索引时各节点的 content_hash()。
+    """
+    def __init__(self, model=DEFAULT_EMBEDDING_MODEL):
+        _require_numpy()
+        self.model = model
+        self.node_ids = []
+        self.node_hashes = {}
+        self.digests = []
+        self.row_node = np.zeros(0, dtype=np.int32)
+        self.row_index = np.zeros(0, dtype=np.int32)
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.digests)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    @classmethod
+    def load(cls, records_path, model=DEFAULT_EMBEDDING_MODEL):
+        """
+        加载记录文件旁边的索引，文件不存在或模型不同时返回空索引
+
+        参数:
+            records_path - 记录文件路径
+            model        - 向量模型，与已保存的索引不同时需要全部重新计算
+        """
+        index = cls(model)
+        matrix_path, meta_path = index_paths(records_path)
+        if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+            return index
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get('model') != model:
+            logger.info(f"索引使用的模型 {meta.get('model')} 与 {model} 不同，将重新建立")
+            return index
+        index.node_ids = meta['node_ids']
+        index.node_hashes = meta['node_hashes']
+        index.digests = meta['digests']
+        index.row_node = np.asarray(meta['row_node'], dtype=np.int32)
+        index.row_index = np.asarray(meta['row_index'], dtype=np.int32)
+        index.matrix = np.load(matrix_path)
+        index._positions = {node_id: i for i, node_id in enumerate(index.node_ids)}
+        return index
+
+    def save(self, records_path):
+        """把索引写到记录文件旁边，先写临时文件再替换"""
+        matrix_path, meta_path = index_paths(records_path)
+        meta = {'model': self.model, 'dim': self.dim, 'node_ids': self.node_ids, 'node_hashes': self.node_hashes,
+                'digests': self.digests, 'row_node': self.row_node.tolist(), 'row_index': self.row_index.tolist()}
+        with open(matrix_path + ".tmp", "wb") as f:
+            np.save(f, self.matrix)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(matrix_path + ".tmp", matrix_path)
+        os.replace(meta_path + ".tmp", meta_path)
+        return matrix_path
+
+    def _rows_by_node(self):
+        """返回 {节点位置: 行号数组}"""
+        if not len(self):
+            return {}
+        order = np.argsort(self.row_node, kind="stable")
+        nodes, starts = np.unique(self.row_node[order], return_index=True)
+        bounds = list(starts[1:]) + [len(order)]
+        return {int(node): order[start:end] for node, start, end in zip(nodes, starts, bounds)}
+
+    def update(self, root, client):
+        """
+        使索引与树的当前内容一致
+
+        参数:
+            root   - 建立索引的根节点
+            client - EmbeddingClient 对象，模型须与索引相同
+
+        返回:
+            {'nodes', 'changed_nodes', 'rows', 'reused', 'embedded', 'removed', 'embed_time', 'elapsed'}
+        """
+        started = time.perf_counter()
+        old_rows = self._rows_by_node()
+        node_ids, node_hashes, digests = [], {}, []
+        sources, row_node, row_index = [], [], []  # sources 为复用的旧行号，-1 表示需要计算
+        pending = []  # (新行号, 文本)
+        changed = 0
+        for node in root.walk():
+            position = len(node_ids)
+            node_ids.append(node.id)
+            content_hash = node.content_hash()
+            node_hashes[node.id] = content_hash
+            old_position = self._positions.get(node.id)
+            rows = old_rows.get(old_position) if old_position is not None else None
+            if rows is not None and self.node_hashes.get(node.id) == content_hash:
+                # 节点内容未变，整块复用
+                sources.extend(rows.tolist())
+                row_node.extend([position] * len(rows))
+                row_index.extend(self.row_index[rows].tolist())
+                digests.extend(self.digests[row] for row in rows)
+                continue
+            changed += 1
+            reusable = {self.digests[row]: row for row in rows.tolist()} if rows is not None else {}
+            for index, text in node_documents(node):
+                digest = _digest(text)
+                row = reusable.get(digest, -1)
+                if row < 0:
+                    pending.append((len(digests), text))
+                sources.append(row)
+                row_node.append(position)
+                row_index.append(index)
+                digests.append(digest)
+
+        embed_started = time.perf_counter()
+        vectors = client.embed([text for _, text in pending]) if pending else None
+        embed_time = time.perf_counter() - embed_started
+        dim = self.dim if len(self) else (vectors.shape[1] if vectors is not None else 0)
+        if vectors is not None and vectors.shape[1] != dim:
+            raise RuntimeError(f"向量维数 {vectors.shape[1]} 与索引的 {dim} 不同，请删除索引文件后重建")
+        sources = np.asarray(sources, dtype=np.int64)
+        matrix = np.empty((len(sources), dim), dtype=np.float32)
+        kept = sources >= 0
+        if kept.any():
+            matrix[kept] = self.matrix[sources[kept]]
+        if vectors is not None:
+            matrix[[row for row, _ in pending]] = _normalize(vectors)
+
+        removed = len(self) - int(kept.sum())
+        self.node_ids = node_ids
+        self.node_hashes = node_hashes
+        self.digests = digests
+        self.row_node = np.asarray(row_node, dtype=np.int32)
+        self.row_index = np.asarray(row_index, dtype=np.int32)
+        self.matrix = matrix
+        self._positions = {node_id: i for i, node_id in enumerate(node_ids)}
+        return {'nodes': len(node_ids), 'changed_nodes': changed, 'rows': len(digests), 'reused': int(kept.sum()),
+                'embedded': len(pending), 'removed': removed, 'embed_time': embed_time,
+                'elapsed': time.perf_counter() - started}
+
+    def search(self, query, k=10, node_ids=None):
+        """
+        余弦相似度最高的 k 行
+
+        参数:
+            query    - 查询向量
+            k        - 返回的条数
+            node_ids - 只在这些节点中搜索，为空时搜索全部
+
+        返回:
+            [(相似度, 节点 ID, 消息序号)]，按相似度降序，消息序号为 TOPIC_INDEX 时表示命中主题
+        """
+        if not len(self) or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if node_ids is None:
+            rows = None
+            scores = self.matrix @ query
+        else:
+            positions = [self._positions[node_id] for node_id in node_ids if node_id in self._positions]
+            rows = np.flatnonzero(np.isin(self.row_node, positions))
+            scores = self.matrix[rows] @ query
+        k = min(k, len(scores))
+        if not k:
+            return []
+        top = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        results = []
+        for i in top:
+            row = int(i) if rows is None else int(rows[i])
+            results.append((float(scores[i]), self.node_ids[self.row_node[row]], int(self.row_index[row])))
+        return results
+
+    def search_text(self, client, text, k=10, node_ids=None):
+        """计算查询文本的向量后搜索，参数和返回值同 search()"""
+        return self.search(client.embed([text])[0], k, node_ids)
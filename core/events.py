@@ -0,0 +1,80 @@
+"""
+系统消息的模板
+
+节点操作写入聊天记录的系统消息（如 "系统: 在 '新主题' 下添加了子节点 '新主题'。"）都由这里的模板生成。
+记录文件按去重格式保存时（见 core.dedup），这些消息只保存为 (类型, 参数)，加载时再用模板还原为原来的文本；
+旧的记录文件中与模板完全一致的系统消息同样可以识别（parse_event）。
+"""
+import re
+import string
+import sys
+
+# 类型 -> 模板，已有记录中的文本与这里完全一致，修改措辞时应新增类型而不是改动已有的模板
+SYSTEM_EVENTS = {
+    'new_topic': "系统: 已创建新主题 '{topic}'，并切换当前聊天上下文。\n",
+    'add_child': "系统: 在 '{parent}' 下添加了子节点 '{topic}'。\n",
+    'from_text': "系统: 从聊天文本创建了新节点 '{text}' 在 '{parent}' 下。\n",
+    'delete': "系统: 已删除节点 '{topic}'。\n",
+    'rename': "系统: 节点名称已修改为 '{topic}'。\n",
+    'move': "系统: 已将节点 '{topic}' 从 '{parent}' 移到此处。\n",
+    'copy': "系统: 已将节点 '{topic}' 复制到此处。\n",
+    'merge': "系统: 已将节点 '{topic}' 合并到此节点。\n",
+    'import': "系统: 已导入 {files} 个记录文件，共 {nodes} 个节点。\n",
+}
+EVENT_PREFIX = "系统: "
+
+
+def _compile(template):
+    """返回 (按出现顺序的参数名, 匹配整条消息的正则表达式)"""
+    fields = []
+    pattern = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        pattern.append(re.escape(literal))
+        if field is not None:
+            fields.append(field)
+            pattern.append("(.*?)")
+    return fields, re.compile("".join(pattern), re.DOTALL)
+
+
+_COMPILED = {kind: _compile(template) for kind, template in SYSTEM_EVENTS.items()}
+
+
+def event_fields(kind):
+    """事件的参数名，按在模板中出现的顺序"""
+    return _COMPILED[kind][0]
+
+
+def render_event(kind, **fields):
+    """
+    用模板生成系统消息
+
+    参数:
+        kind   - SYSTEM_EVENTS 中的类型
+        fields - 模板中的各参数
+
+    返回:
+        消息文本（已驻留，相同的消息在内存中只有一份）
+    """
+    return sys.intern(SYSTEM_EVENTS[kind].format(**fields))
+
+
+def render_args(kind, args):
+    """按 event_fields() 的顺序给出参数生成系统消息"""
+    return render_event(kind, **dict(zip(event_fields(kind), args)))
+
+
+def parse_event(chat):
+    """
+    识别由模板生成的系统消息
+
+    返回:
+        (类型, [参数, ...])，参数按 event_fields() 的顺序；不是模板生成的消息返回 None。
+        render_args() 对结果总能还原出完全相同的文本
+    """
+    if not chat.startswith(EVENT_PREFIX):
+        return None
+    for kind, (_, pattern) in _COMPILED.items():
+        match = pattern.fullmatch(chat)
+        if match is not None:
+            return kind, list(match.groups())
+    return None
@@ -0,0 +1,155 @@
+"""
+把聊天树导出为 Markdown 或独立的 HTML 文件
+
+iter_markdown() / iter_html() 是逐段产出文本的生成器：按先序遍历节点，每次只产出一个标题或一条消息，
+write_export() 边生成边写入文件，整个文档不会在内存中拼接成一个字符串，
+导出占用的额外内存只与树的深度和单条消息的长度有关，与树的大小无关。
+已压缩的节点（见 core.archive）只在导出时临时解压，不会改变其压缩状态。
+
+Markdown 中节点主题按深度生成 # ~ ###### 标题，超过 6 层的节点都使用六级标题；
+HTML 默认只包含自带的样式，公式保留为 TeX 源码；指定 katex_js 时引用该目录下的 KaTeX 脚本，
+并内联程序目录下的 KaTeX 样式（config/README_files/katex.min.css，其中的字体改为从同一目录加载）。
+
+导出本身边生成边写入，但调用者需要先加载整棵树：命令行的 export 会先读入整个记录文件。
+"""
+import html
+import os
+
+from core.service import message_kind
+
+KATEX_CSS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "config", "README_files", "katex.min.css")
+
+LABELS = {'user': "你", 'ai': "AI", 'system': "系统", 'other': ""}
+PREFIXES = {'user': "你: ", 'ai': "AI: ", 'system': "系统: ", 'other': ""}
+
+HTML_STYLE = """
+body { font-family: "Microsoft YaHei UI", sans-serif; max-width: 960px; margin: 2em auto; padding: 0 1em;
+       line-height: 1.6; color: #333; }
+section { margin-left: 1.2em; border-left: 2px solid #e0e0e0; padding-left: 0.8em; }
+body > section { margin-left: 0; border-left: none; padding-left: 0; }
+.message { white-space: pre-wrap; word-wrap: break-word; margin: 0.6em 0; padding: 0.5em 0.8em; border-radius: 6px; }
+.message .label { font-weight: 700; display: block; margin-bottom: 0.2em; }
+.user { background: #eaf3fb; }
+.ai { background: #f5f5f5; }
+.system, .other { color: #888; font-size: 0.9em; }
+"""
+
+
+def _strip_prefix(chat, kind):
+    prefix = PREFIXES[kind]
+    text = chat[len(prefix):] if prefix and chat.startswith(prefix) else chat
+    return text.rstrip("\n")
+
+
+def _walk_with_depth(root):
+    """先序遍历，返回 (节点, 深度)"""
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        stack.extend((child, depth + 1) for child in reversed(node.children))
+
+
+def iter_markdown(root):
+    """
+    逐段产出 Markdown 文本
+
+    参数:
+        root - 导出范围的根节点
+
+    返回:
+        字符串生成器，依次写入文件即得到完整的文档
+    """
+    for node, depth in _walk_with_depth(root):
+        topic = " ".join(node.topic.split())
+        yield f"{'#' * min(depth + 1, 6)} {topic}\n\n<!-- node: {node.id} -->\n\n"
+        for chat in node.peek_chats():
+            kind = message_kind(chat)
+            text = _strip_prefix(chat, kind)
+            if kind == 'ai':
+                # AI 回复本身就是 Markdown，原样输出
+                yield f"**{LABELS[kind]}：**\n\n{text}\n\n"
+            elif kind == 'other':
+                yield f"{text}\n\n"
+            else:
+                quoted = "\n".join("> " + line if line else ">" for line in text.split("\n"))
+                yield f"**{LABELS[kind]}：**\n\n{quoted}\n\n"
+
+
+def iter_html(root, title=None, css_path=KATEX_CSS_PATH, katex_js=None):
+    """
+    逐段产出独立的 HTML 文档
+
+    参数:
+        root     - 导出范围的根节点
+        title    - 页面标题，为空时使用根节点主题
+        css_path - 指定 katex_js 时内联到页面中的 KaTeX 样式文件，为空或不存在时不内联
+        katex_js - KaTeX 所在的目录 URL（含 katex.min.js、contrib/auto-render.min.js 和 fonts/），
+                   指定时在浏览器中把 $...$ / $$...$$ 渲染为公式，为空时公式保留为 TeX 源码
+
+    返回:
+        字符串生成器
+    """
+    title = html.escape(" ".join((title or root.topic).split()))
+    yield f'<!DOCTYPE html>\n<html><head><meta charset="UTF-8">\n<title>{title}</title>\n'
+    yield '<meta name="viewport" content="width=device-width, initial-scale=1.0">\n'
+    yield f"<style>{HTML_STYLE}</style>\n"
+    if katex_js:
+        base = html.escape(katex_js.rstrip("/"), quote=True)
+        if css_path and os.path.exists(css_path):
+            # 样式中的字体是相对路径 fonts/...，改为从脚本所在的目录加载
+            with open(css_path, "r", encoding="utf-8") as f:
+                css = f.read().replace("url(fonts/", f"url({katex_js.rstrip('/')}/fonts/")
+            yield f"<style>\n{css}\n</style>\n"
+        yield (f'<script defer src="{base}/katex.min.js"></script>\n'
+               f'<script defer src="{base}/contrib/auto-render.min.js" onload="renderMathInElement(document.body, '
+               "{delimiters: [{left: '$$', right: '$$', display: true}, {left: '$', right: '$', display: false}]})"
+               '"></script>\n')
+    yield "</head><body>\n"
+
+    # 每个节点是一个 <section>，离开子树时补齐结束标签，栈中只保存当前路径
+    open_depth = -1
+    for node, depth in _walk_with_depth(root):
+        while open_depth >= depth:
+            yield "</section>\n"
+            open_depth -= 1
+        topic = html.escape(" ".join(node.topic.split()))
+        level = min(depth + 1, 6)
+        yield f'<section id="{html.escape(node.id, quote=True)}">\n<h{level}>{topic}</h{level}>\n'
+        open_depth = depth
+        for chat in node.peek_chats():
+            kind = message_kind(chat)
+            label = f'<span class="label">{LABELS[kind]}</span>' if LABELS[kind] else ""
+            yield f'<div class="message {kind}">{label}{html.escape(_strip_prefix(chat, kind))}</div>\n'
+    while open_depth >= 0:
+        yield "</section>\n"
+        open_depth -= 1
+    yield "</body></html>\n"
+
+
+def write_export(root, file_path, fmt=None, **options):
+    """
+    把节点及其子树导出到文件
+
+    参数:
+        root      - 导出范围的根节点
+        file_path - 目标文件
+        fmt       - 'markdown' 或 'html'，为空时按扩展名判断（.html / .htm 为 HTML，其他为 Markdown）
+        options   - 传给 iter_html() 的其他参数
+
+    返回:
+        写入的字符数
+    """
+    if fmt is None:
+        fmt = 'html' if file_path.lower().endswith((".html", ".htm")) else 'markdown'
+    chunks = iter_html(root, **options) if fmt == 'html' else iter_markdown(root)
+    folder = os.path.dirname(file_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    written = 0
+    with open(file_path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    return written
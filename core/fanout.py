@@ -0,0 +1,124 @@
+import time
+
+from core.generation import PRIORITY_NORMAL
+from core.service import chats_to_messages
+
+
+class Variant:
+    """一个分支使用的模型和生成参数"""
+    def __init__(self, model=None, temperature=None, seed=None):
+        self.model = model
+        self.temperature = temperature
+        self.seed = seed
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        解析 "模型@温度#种子" 形式的描述，各部分均可省略，如 "gemma3:12b-it-qat@0.9#7"、"@1.2"、"#3"
+        """
+        spec, _, seed = spec.partition("#")
+        model, _, temperature = spec.partition("@")
+        return cls(model or None,
+                   float(temperature) if temperature else None,
+                   int(seed) if seed else None)
+
+    @property
+    def options(self):
+        options = {}
+        if self.temperature is not None:
+            options['temperature'] = self.temperature
+        if self.seed is not None:
+            options['seed'] = self.seed
+        return options or None
+
+    def label(self, default_model):
+        parts = [self.model or default_model]
+        if self.temperature is not None:
+            parts.append(f"t={self.temperature}")
+        if self.seed is not None:
+            parts.append(f"seed={self.seed}")
+        return " ".join(parts)
+
+
+def default_variants(count, base_temperature=0.8):
+    """同一模型、不同种子的 count 个分支"""
+    return [Variant(temperature=base_temperature, seed=i + 1) for i in range(count)]
+
+
+class FanOut:
+    """
+    在一个节点下创建多个子节点，并发生成各自的回复
+
+    每个分支使用父节点的对话作为上下文，加上同一个提示，回复以流式方式写入各自的子节点，
+    总耗时接近一次生成而不是 N 次（Ollama 端需设置 OLLAMA_NUM_PARALLEL 以并行处理）。
+    各分支都是可取消的 GenerationHandle，经服务层的调度器调度。
+    """
+    def __init__(self, service, parent_node, prompt, variants, priority=PRIORITY_NORMAL):
+        """
+        参数:
+            service     - ChatService 对象
+            parent_node - 在其下创建分支的 TreeNode
+            prompt      - 所有分支共用的提示
+            variants    - Variant 列表，每个元素对应一个分支
+            priority    - 生成优先级，见 core.generation
+        """
+        self.service = service
+        self.parent_node = parent_node
+        self.prompt = prompt
+        self.variants = variants
+        self.priority = priority
+        self.branches = []
+        self.handles = []
+
+    @property
+    def replies(self):
+        """各分支的回复消息，未结束的分支为 None"""
+        return [handle.reply_msg for handle in self.handles]
+
+    def start(self, on_chunk=None, on_done=None):
+        """
+        创建子节点并提交每个分支的生成（立即返回）
+
+        参数:
+            on_chunk - 回调 (分支序号, 节点, 文本片段)，在工作线程中调用
+            on_done  - 回调 (分支序号, 节点, 完整回复消息, 异常或 None)，在工作线程中调用
+
+        返回:
+            新建的子节点列表
+        """
+        default_model = self.service.ai_model.model
+        context = chats_to_messages(self.parent_node.chats)
+        context.append({'role': 'user', 'content': self.prompt})
+        for index, variant in enumerate(self.variants):
+            topic = f"{self.prompt[:20]} [{variant.label(default_model)}]"
+            node = self.service.add_child(self.parent_node, topic)
+            self.service.append_user_message(self.prompt, node)
+            self.branches.append(node)
+            chunk_callback = None
+            if on_chunk:
+                chunk_callback = lambda handle, chunk, i=index, n=node: on_chunk(i, n, chunk)
+            done_callback = None
+            if on_done:
+                done_callback = lambda handle, i=index, n=node: on_done(i, n, handle.reply_msg, handle.error)
+            self.handles.append(self.service.scheduler.submit(
+                self.service.ai_model, context, node, self.priority, variant.model, variant.options,
+                chunk_callback, done_callback, fair_key=f"fanout:{self.parent_node.id}"))
+        return self.branches
+
+    def cancel(self):
+        """取消所有未结束的分支，已生成的部分会保留并标记为已取消"""
+        for handle in self.handles:
+            handle.cancel()
+
+    def join(self, timeout=None):
+        """等待所有分支完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for handle in self.handles:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            handle.wait(remaining)
+
+    def run(self, on_chunk=None, on_done=None):
+        """启动并等待所有分支完成，返回各分支的回复消息"""
+        self.start(on_chunk, on_done)
+        self.join()
+        return self.replies
@@ -0,0 +1,417 @@
+"""
+按“一个节点一个文件夹”保存聊天树
+
+存储的目录结构与树相同，每个节点一个文件夹，子节点的文件夹在父节点的文件夹中:
+    <存储目录>/
+        store.json              标记文件，记录根节点的文件夹名
+        <根节点>/
+            node.json           节点清单：ID、主题、消息条数、子节点的 ID 和文件夹名（按顺序）
+            chats.jsonl         聊天记录，每行一条 JSON 字符串，只在末尾追加
+            <子节点>/...
+
+读写一个节点只涉及它自己的文件：追加消息时在 chats.jsonl 末尾追加后改写 node.json 中的条数；
+node.json 总是先写临时文件再替换，只读取其中记录的条数，写入中断时多出的半行会被忽略。
+打开某个节点（open_node）只需沿路径读取各祖先的 node.json，文件读取次数与深度成正比，与树的大小无关。
+
+save() 与上次加载或保存时的状态比较，跳过子树哈希未变化的子树：移动的节点整体重命名文件夹，
+删除的节点删除文件夹，只追加了消息的节点只追加新的行，其他修改重写该节点的文件。
+同一存储目录在一个进程中共用一个 FolderStore（open_store()），不支持多个进程同时写入同一存储。
+已压缩的冷节点（core.archive）以解压后的聊天记录保存。
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from core.dedup import intern_chats
+from core.tree import Tree, TreeNode
+
+STORE_FILE = "store.json"
+MANIFEST_FILE = "node.json"
+CHATS_FILE = "chats.jsonl"
+# 保存时暂存被移动的节点文件夹
+STAGING_DIR = ".moving"
+STORE_FORMAT = "treechat-folders"
+STORE_VERSION = 1
+# 文件夹名的长度，较短的名字让深层节点的路径不至于过长（Windows 默认路径上限为 260 个字符）
+DIR_NAME_LENGTH = 8
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+
+_stores = {}
+
+
+def open_store(path):
+    """返回存储目录对应的 FolderStore，同一目录在进程内共用一个对象（保存时需要上次的状态）"""
+    key = os.path.abspath(path)
+    store = _stores.get(key)
+    if store is None:
+        store = _stores[key] = FolderStore(key)
+    return store
+
+
+def is_folder_store(path):
+    """path 是否为文件夹存储（已存在的目录，或以路径分隔符结尾、将要创建的目录）"""
+    return os.path.isdir(path) or path.endswith(("/", os.sep))
+
+
+def find_store_root(path):
+    """从存储中的某个节点文件夹向上查找存储目录，返回 (存储目录, 节点的相对路径)，找不到时返回 (None, None)"""
+    path = os.path.abspath(path)
+    folder = path
+    while True:
+        if os.path.isfile(os.path.join(folder, STORE_FILE)):
+            return folder, os.path.relpath(path, folder)
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None, None
+        folder = parent
+
+
+def _dir_name(node_id, used):
+    """为节点选择在兄弟节点中唯一的文件夹名"""
+    base = node_id if _SAFE_NAME.match(node_id) else hashlib.sha1(node_id.encode("utf-8")).hexdigest()
+    base = base.replace("-", "")[:DIR_NAME_LENGTH] or "node"
+    name = base
+    suffix = 1
+    while name in used:
+        suffix += 1
+        name = f"{base}-{suffix}"
+    return name
+
+
+def _write_atomic(path, text):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def _chat_lines(chats):
+    return "".join(json.dumps(chat, ensure_ascii=False) + "\n" for chat in chats)
+
+
+class FolderStore:
+    """
+    一个文件夹存储
+
+    _nodes 为上次加载或保存时各节点的状态:
+        {节点 ID: {'parent', 'dir', 'topic', 'children': [子节点 ID], 'chats': 聊天记录元组或 None,
+                   'content': 内容哈希, 'subtree': 子树哈希}}
+    为空表示尚未加载，第一次保存前先读取已有的内容。reads / writes 统计读取和写入的文件数。
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.root_id = None
+        self._nodes = None
+        self.reads = 0
+        self.writes = 0
+
+    # ------------------------ 读取 ------------------------
+    def exists(self):
+        return os.path.isfile(os.path.join(self.path, STORE_FILE))
+
+    def _read_json(self, path):
+        self.reads += 1
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _read_chats(self, folder, count):
+        """读取节点的前 count 条消息，之后不完整的行（写入中断）被忽略"""
+        chats = []
+        if not count:
+            return chats
+        self.reads += 1
+        with open(os.path.join(folder, CHATS_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                if len(chats) == count:
+                    break
+                chats.append(json.loads(line))
+        if len(chats) < count:
+            raise ValueError(f"{folder}: 聊天记录只有 {len(chats)} 条，清单中为 {count} 条")
+        return chats
+
+    def load(self):
+        """
+        读取整棵树
+
+        返回:
+            当前节点为根节点的 Tree 对象
+        """
+        marker = self._read_json(os.path.join(self.path, STORE_FILE))
+        if marker.get('format') != STORE_FORMAT:
+            raise ValueError(f"{self.path} 不是聊天树的文件夹存储")
+        nodes = {}
+        root = None
+        stack = [(marker['root'], None, None)]
+        while stack:
+            relpath, parent, parent_id = stack.pop()
+            folder = os.path.join(self.path, relpath)
+            manifest = self._read_json(os.path.join(folder, MANIFEST_FILE))
+            node = TreeNode(manifest['topic'], manifest['id'])
+            node.chats = intern_chats(self._read_chats(folder, manifest.get('count', 0)))
+            if parent is None:
+                root = node
+            else:
+                parent.add_child(node)
+            children = manifest.get('children', [])
+            nodes[node.id] = {'parent': parent_id, 'dir': os.path.basename(relpath), 'topic': node.topic,
+                              'children': [child['id'] for child in children], 'chats': tuple(node.chats),
+                              'node': node}
+            stack.extend((os.path.join(relpath, child['dir']), node, node.id) for child in reversed(children))
+        # 子节点按清单中的顺序加入，栈中逆序压入保证顺序
+        for entry in nodes.values():
+            node = entry.pop('node')
+            entry['content'] = node.content_hash()
+            entry['subtree'] = node.subtree_hash()
+        self._nodes = nodes
+        self.root_id = root.id
+        tree = Tree()
+        tree.root = root
+        tree.current_node = root
+        return tree
+
+    def open_node(self, relpath):
+        """
+        只读取一个节点：沿路径读取各祖先的清单和该节点的聊天记录，读取的文件数为深度 + 2
+
+        参数:
+            relpath - 节点文件夹相对存储目录的路径，如 "<根节点>/<子节点>"
+
+        返回:
+            {'path': [(祖先 ID, 主题), ...]（从根节点开始，不含该节点）, 'node': TreeNode（不含子节点），
+             'children': [{'id', 'dir'}]}
+        """
+        parts = [part for part in relpath.replace(os.sep, "/").split("/") if part and part != "."]
+        path = []
+        folder = self.path
+        manifest = None
+        for i, part in enumerate(parts):
+            folder = os.path.join(folder, part)
+            manifest = self._read_json(os.path.join(folder, MANIFEST_FILE))
+            if i < len(parts) - 1:
+                path.append((manifest['id'], manifest['topic']))
+        if manifest is None:
+            raise ValueError("路径为空")
+        node = TreeNode(manifest['topic'], manifest['id'])
+        node.chats = self._read_chats(folder, manifest.get('count', 0))
+        return {'path': path, 'node': node, 'children': manifest.get('children', [])}
+
+    def node_path(self, node_id):
+        """已加载或保存过的节点文件夹的相对路径，未知的节点返回 None"""
+        if self._nodes is None or node_id not in self._nodes:
+            return None
+        parts = []
+        while node_id is not None:
+            entry = self._nodes[node_id]
+            parts.append(entry['dir'])
+            node_id = entry['parent']
+        return os.path.join(*reversed(parts))
+
+    # ------------------------ 写入 ------------------------
+    def append(self, relpath, chat):
+        """
+        在节点末尾追加一条消息，只写入该节点的 chats.jsonl 和 node.json
+
+        已加载的树不会改变；之后保存内存中的树时，若其中没有这条消息会被重写回去。
+        """
+        folder = os.path.join(self.path, relpath)
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+        manifest = self._read_json(manifest_path)
+        count = manifest.get('count', 0)
+        self._append_chats(folder, count, [chat])
+        manifest['count'] = count + 1
+        self._write_manifest(folder, manifest)
+        node_id = manifest['id']
+        if self._nodes is not None and node_id in self._nodes:
+            # 与磁盘上的内容不再一致，下次保存时重写该节点，路径上的祖先不再跳过
+            self._nodes[node_id]['chats'] = None
+            self._nodes[node_id]['content'] = None
+            while node_id is not None:
+                self._nodes[node_id]['subtree'] = None
+                node_id = self._nodes[node_id]['parent']
+
+    def _append_chats(self, folder, count, chats):
+        path = os.path.join(folder, CHATS_FILE)
+        self.writes += 1
+        with open(path, "a+", encoding="utf-8") as f:
+            # 去掉上次写入中断留下的多余内容，保证前 count 行之后直接追加
+            f.seek(0)
+            offset = 0
+            for _ in range(count):
+                line = f.readline()
+                offset += len(line.encode("utf-8"))
+            f.truncate(offset)
+            f.write(_chat_lines(chats))
+
+    def _rewrite_chats(self, folder, chats):
+        self.writes += 1
+        if chats:
+            _write_atomic(os.path.join(folder, CHATS_FILE), _chat_lines(chats))
+        elif os.path.exists(os.path.join(folder, CHATS_FILE)):
+            os.remove(os.path.join(folder, CHATS_FILE))
+
+    def _write_manifest(self, folder, manifest):
+        self.writes += 1
+        _write_atomic(os.path.join(folder, MANIFEST_FILE), json.dumps(manifest, ensure_ascii=False, indent=1))
+
+    def save(self, tree):
+        """
+        保存整棵树，只写入有变化的节点
+
+        返回:
+            {'nodes': 写入的节点数, 'moved', 'deleted', 'appended': 只追加了消息的节点数, 'files': 写入的文件数}
+        """
+        try:
+            return self._save(tree)
+        except BaseException:
+            # 写入中断时内存中的状态与磁盘不再一致，下次保存前重新读取
+            self._nodes = None
+            raise
+
+    def _save(self, tree):
+        if self._nodes is None:
+            if self.exists():
+                self.load()
+            else:
+                os.makedirs(self.path, exist_ok=True)
+                self._nodes = {}
+        old = self._nodes
+        writes = self.writes
+        stats = {'nodes': 0, 'moved': 0, 'deleted': 0, 'appended': 0}
+        root = tree.root
+        old_root = self.root_id if self.root_id in old else None
+
+        # 找出需要处理的节点：子树哈希与父节点都未变化的子树整体跳过
+        visit = []
+        seen = set()
+        stack = [(root, None)]
+        while stack:
+            node, parent_id = stack.pop()
+            seen.add(node.id)
+            entry = old.get(node.id)
+            if entry is not None and entry['parent'] == parent_id and entry['subtree'] == node.subtree_hash():
+                continue
+            visit.append((node, parent_id))
+            stack.extend((child, node.id) for child in reversed(node.children))
+        if not visit:
+            return dict(stats, files=0)
+
+        moved = [node.id for node, parent_id in visit if node.id in old and old[node.id]['parent'] != parent_id]
+        deleted = []
+        for node, _ in visit:
+            entry = old.get(node.id)
+            if entry is not None:
+                deleted.extend(child_id for child_id in entry['children'] if child_id not in seen)
+        if old_root is not None and old_root not in seen:
+            deleted.append(old_root)
+
+        # 1. 移动的节点先移到暂存目录，从深到浅处理，较浅节点的旧路径在处理时仍然有效
+        staging = os.path.join(self.path, STAGING_DIR)
+        staged = {}
+
+        def depth(node_id):
+            count = 0
+            while old[node_id]['parent'] is not None:
+                node_id = old[node_id]['parent']
+                count += 1
+            return count
+
+        def current_path(node_id):
+            parts = []
+            while node_id not in staged and node_id is not None:
+                parts.append(old[node_id]['dir'])
+                node_id = old[node_id]['parent']
+            base = staged[node_id] if node_id is not None else self.path
+            return os.path.join(base, *reversed(parts))
+
+        for node_id in sorted(moved, key=depth, reverse=True):
+            os.makedirs(staging, exist_ok=True)
+            target = os.path.join(staging, str(len(staged)))
+            os.rename(current_path(node_id), target)
+            staged[node_id] = target
+            stats['moved'] += 1
+
+        # 2. 删除的子树（其中被移走的节点已在暂存目录中）
+        for node_id in deleted:
+            shutil.rmtree(current_path(node_id))
+            stats['deleted'] += 1
+            stack = [node_id]
+            while stack:
+                entry = old.pop(stack.pop())
+                stack.extend(child_id for child_id in entry['children'] if child_id not in seen)
+
+        # 3. 从上到下放置节点并写入有变化的文件
+        paths = {}
+        dirs = {}
+        for node, parent_id in visit:
+            entry = old.get(node.id)
+            if parent_id is None:
+                folder_dir = entry['dir'] if entry is not None else _dir_name(node.id, ())
+                folder = os.path.join(self.path, folder_dir)
+            else:
+                folder_dir = dirs[node.id]
+                folder = os.path.join(paths[parent_id], folder_dir)
+            paths[node.id] = folder
+            if node.id in staged:
+                os.rename(staged.pop(node.id), folder)
+            elif entry is None:
+                os.makedirs(folder, exist_ok=True)
+            # 子节点的文件夹名：沿用原来的名字，新加入的节点选择不与兄弟节点重复的名字
+            used = set()
+            children = []
+            pending = []
+            for child in node.children:
+                child_entry = old.get(child.id)
+                if child_entry is not None and child_entry['dir'] not in used and child_entry['parent'] == node.id:
+                    used.add(child_entry['dir'])
+                    children.append(child_entry['dir'])
+                else:
+                    children.append(None)
+                    pending.append(len(children) - 1)
+            for index in pending:
+                child = node.children[index]
+                child_entry = old.get(child.id)
+                # 移入的节点尽量保留原来的文件夹名
+                preferred = child_entry['dir'] if child_entry is not None and child_entry['dir'] not in used else None
+                children[index] = preferred or _dir_name(child.id, used)
+                used.add(children[index])
+            for child, child_dir in zip(node.children, children):
+                dirs[child.id] = child_dir
+
+            child_ids = [child.id for child in node.children]
+            content = node.content_hash()
+            chats = None
+            count = None
+            if entry is None or entry['content'] != content:
+                chats = node.peek_chats() if node.is_compressed else node.chats
+                count = len(chats)
+                previous = entry['chats'] if entry is not None else None
+                if previous is not None and len(previous) <= count and tuple(chats[:len(previous)]) == previous:
+                    if count > len(previous):
+                        self._append_chats(folder, len(previous), chats[len(previous):])
+                        stats['appended'] += 1
+                else:
+                    self._rewrite_chats(folder, chats)
+            manifest_changed = (entry is None or chats is not None or entry['children'] != child_ids
+                                or [old[c]['dir'] if c in old else None for c in entry['children']] != children)
+            if manifest_changed:
+                if count is None:
+                    count = len(entry['chats']) if entry['chats'] is not None else len(node.peek_chats())
+                self._write_manifest(folder, {'id': node.id, 'topic': node.topic, 'count': count,
+                                              'children': [{'id': c, 'dir': d} for c, d in zip(child_ids, children)]})
+                stats['nodes'] += 1
+            old[node.id] = {'parent': parent_id, 'dir': folder_dir, 'topic': node.topic, 'children': child_ids,
+                            'chats': tuple(chats) if chats is not None else entry['chats'],
+                            'content': content, 'subtree': node.subtree_hash()}
+
+        if self.root_id != root.id or not self.exists():
+            self.writes += 1
+            _write_atomic(os.path.join(self.path, STORE_FILE),
+                          json.dumps({'format': STORE_FORMAT, 'version': STORE_VERSION, 'root': old[root.id]['dir']},
+                                     ensure_ascii=False, indent=1))
+            self.root_id = root.id
+        if os.path.isdir(staging) and not os.listdir(staging):
+            os.rmdir(staging)
+        stats['files'] = self.writes - writes
+        return stats
@@ -0,0 +1,210 @@
+import threading
+import time
+import logging
+
+from core import tracing
+
+logger = logging.getLogger(__name__)
+
+# 优先级，数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BACKGROUND = 10
+
+# 优先级类别名称，用于统计
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_BACKGROUND: "background",
+}
+
+# 生成状态
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_CANCELLED = "cancelled"
+STATE_FAILED = "failed"
+
+# 被取消的回复末尾的标记
+CANCELLED_MARK = "［已取消］"
+
+
+class GenerationHandle:
+    """
+    一次可取消的流式生成
+
+    由 RequestScheduler.submit() 创建。结束后（完成、取消或失败）若指定了 node，
+    回复会以 "AI: ..." 的形式写入该节点，被取消时保留已生成的部分并加上 CANCELLED_MARK。
+    """
+    def __init__(self, scheduler, ai_model, messages, node=None, priority=PRIORITY_NORMAL, model=None,
+                 options=None, on_chunk=None, on_done=None, preemptible=None, fair_key=None, prepare=None):
+        self.scheduler = scheduler
+        self.ai_model = ai_model
+        self.endpoint = ai_model.base_url
+        # 同一优先级内按 fair_key（树或任务）轮流出队
+        self.fair_key = fair_key
+        self.messages = messages
+        self.node = node
+        self.priority = priority
+        self.model = model
+        self.options = options
+        self.on_chunk = on_chunk
+        self.on_done = on_done
+        # 开始生成前在工作线程中调用一次，返回实际发送的消息列表（如附加检索到的上下文）
+        self.prepare = prepare
+        self.prepare_time = None
+        # 跨分支检索的结果（core.retrieval.RetrievalResult），未检索时为 None
+        self.retrieval = None
+        # 默认只有后台任务可以被抢占
+        self.preemptible = priority > PRIORITY_INTERACTIVE if preemptible is None else preemptible
+        self.state = STATE_QUEUED
+        self.parts = []
+        self.error = None
+        # Ollama 最后一条响应（含 eval_count、eval_duration 等计时字段），未正常结束时为 None
+        self.final = None
+        self.reply_msg = None
+        self.preemptions = 0
+        self.seq = 0
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        self._stream = None
+        self._cancelled = False
+        self._preempted = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def text(self):
+        """目前已生成的回复文本"""
+        return "".join(self.parts)
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    @property
+    def queue_time(self):
+        """从提交到开始执行的秒数（被抢占后按最后一次开始计算）"""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    @property
+    def ttft(self):
+        """从提交到收到第一个片段的秒数"""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.submitted_at
+
+    @property
+    def model_name(self):
+        """实际使用的模型名称"""
+        return self.model or self.ai_model.model
+
+    @property
+    def generation_time(self):
+        """从收到第一个片段到结束的秒数"""
+        if self.first_token_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.first_token_at
+
+    def cancel(self):
+        """
+        取消生成：排队中的直接出队，运行中的立即关闭 HTTP 连接
+        """
+        with self._lock:
+            if self.finished or self._cancelled:
+                return
+            self._cancelled = True
+            stream = self._stream
+        if stream is not None:
+            stream.close()
+        self.scheduler._cancel_queued(self)
+
+    def wait(self, timeout=None):
+        """等待生成结束，返回是否已结束"""
+        return self._done.wait(timeout)
+
+    def _preempt(self):
+        """被更高优先级的请求抢占：中止当前连接，稍后从头重新执行"""
+        with self._lock:
+            if self.finished or self._cancelled:
+                return False
+            self._preempted = True
+            stream = self._stream
+        if stream is not None:
+            stream.close()
+        return True
+
+    def _run(self):
+        """在工作线程中执行生成"""
+        self.started_at = time.monotonic()
+        self.parts = []
+        self.final = None
+        stream = None
+        try:
+            if self.prepare is not None and not self._cancelled and not self._preempted:
+                # 只准备一次，被抢占后重新执行时沿用准备好的消息
+                prepare, self.prepare = self.prepare, None
+                prepare_started = time.perf_counter()
+                self.messages = prepare(self)
+                self.prepare_time = time.perf_counter() - prepare_started
+            if not self._cancelled and not self._preempted:
+                stream = self.ai_model.open_stream(self.messages, self.model, self.options)
+                with self._lock:
+                    self._stream = stream
+                    stop = self._cancelled or self._preempted
+                if stop:
+                    stream.close()
+                for chunk in stream:
+                    if self.first_token_at is None:
+                        self.first_token_at = time.monotonic()
+                    self.parts.append(chunk)
+                    if self.on_chunk:
+                        self.on_chunk(self, chunk)
+                self.final = stream.final
+        except Exception as e:
+            if not self._cancelled and not self._preempted:
+                logger.error(f"生成回复失败: {e}")
+                self.error = e
+        finally:
+            if stream is not None:
+                stream.close()
+            with self._lock:
+                self._stream = None
+        self.scheduler._finished(self)
+
+    def _requeue(self):
+        """抢占后重置状态，重新排队"""
+        self._preempted = False
+        self.preemptions += 1
+        self.parts = []
+        self.first_token_at = None
+        self.state = STATE_QUEUED
+
+    def _finish(self):
+        if self._cancelled:
+            self.state = STATE_CANCELLED
+            self.reply_msg = f"AI: {self.text}{CANCELLED_MARK}\n"
+        elif self.error is not None:
+            self.state = STATE_FAILED
+            self.reply_msg = f"AI: 生成回复失败: {str(self.error)}\n"
+        else:
+            self.state = STATE_DONE
+            self.reply_msg = f"AI: {self.text}\n"
+        self.finished_at = time.monotonic()
+        if tracing.tracer.enabled:
+            labels = {'priority': PRIORITY_NAMES.get(self.priority, self.priority),
+                      'model': self.model_name, 'state': self.state}
+            tracing.record("generation.queue_wait", self.queue_time, **labels)
+            tracing.record("generation.prepare", self.prepare_time, **labels)
+            tracing.record("generation.ttft", self.ttft, **labels)
+            tracing.record("generation.stream", self.generation_time, **labels)
+        if self.node is not None:
+            # list.append 是原子操作，各生成只写入自己的节点
+            self.node.chats.append(self.reply_msg)
+        self._done.set()
+        if self.on_done:
+            self.on_done(self)
@@ -0,0 +1,367 @@
+"""
+节点操作的撤销 / 重做和命名检查点
+
+每个版本是整棵树的一份不可变快照（Snapshot），快照之间共享没有变化的子树（持久化数据结构）：
+记录新版本时只为 Merkle 哈希（TreeNode.subtree_hash()）发生变化的节点创建新的快照节点，
+即修改位置到根节点路径上的节点，其余子树直接引用上一版本的快照；聊天记录字符串始终与树共享，
+内容未变的节点也共享同一个元组，已压缩的节点直接引用其 PackedChats，不需要解压。
+因此每个版本新增的内存与变化的节点数成正比，而不是一份完整的树；但内容有变化的节点会复制整个聊天记录元组
+（只复制字符串的引用，不复制字符串），在很长的节点中追加消息时每个版本仍要占用该节点消息数个引用。
+撤销栈丢弃的版本中不再被任何版本引用的快照（如已删除节点的快照）会被一并释放（见 _prune_latest）。
+
+撤销、重做时把树调整为目标版本：同样按哈希比较，只进入内容不同的子树，
+单个修改的撤销只需要处理修改位置到根节点的路径（O(深度)）；未变化的 TreeNode 对象保持不变，
+界面和生成任务持有的节点引用依然有效。
+
+聊天消息的追加（包括后台生成写入的回复）不单独记录版本，在下一次节点操作或撤销前一并记录。
+"""
+import threading
+import time
+
+from core.tree import TreeNode
+
+DEFAULT_LIMIT = 200
+# 节点操作之间追加的聊天消息记录为版本时使用的说明
+PENDING_LABEL = "新的聊天消息"
+
+
+class Snapshot:
+    """
+    某个版本中的一个节点，创建后不再修改
+
+    chats 为聊天记录元组，节点已压缩时为 None、packed 为 PackedChats；
+    content / hash 为记录时节点的 content_hash() / subtree_hash()
+    """
+    __slots__ = ('id', 'topic', 'chats', 'packed', 'children', 'content', 'hash')
+
+    def __init__(self, node_id, topic, chats, packed, children, content, subtree_hash):
+        self.id = node_id
+        self.topic = topic
+        self.chats = chats
+        self.packed = packed
+        self.children = children
+        self.content = content
+        self.hash = subtree_hash
+
+    def walk(self):
+        """先序遍历快照节点"""
+        stack = [self]
+        while stack:
+            snapshot = stack.pop()
+            yield snapshot
+            stack.extend(reversed(snapshot.children))
+
+
+class Version:
+    """
+    一个版本：根节点快照、产生该版本的操作说明、当时的当前节点 ID 和创建时间
+    """
+    __slots__ = ('root', 'label', 'current_id', 'created')
+
+    def __init__(self, root, label, current_id):
+        self.root = root
+        self.label = label
+        self.current_id = current_id
+        self.created = time.time()
+
+
+def build_node(snapshot):
+    """由快照创建新的 TreeNode 子树（节点 ID 与快照相同）"""
+    root = None
+    stack = [(snapshot, None)]
+    while stack:
+        snap, parent = stack.pop()
+        node = TreeNode(snap.topic, snap.id)
+        _set_content(node, snap)
+        if parent is None:
+            root = node
+        else:
+            parent.add_child(node)
+        stack.extend((child, node) for child in reversed(snap.children))
+    return root
+
+
+def _set_content(node, snapshot):
+    if snapshot.packed is not None:
+        node.set_packed_chats(snapshot.packed)
+    else:
+        node.chats = snapshot.chats
+
+
+class History:
+    """
+    一棵树的版本历史
+
+    record() 在树发生变化时记录一个新版本；undo() / redo() 在版本之间移动；
+    checkpoint() 给当前版本命名，restore() 回到命名的版本（本身也可以撤销）。
+    撤销栈最多保留 limit 个版本，更早的版本被丢弃（检查点引用的版本不受影响）。
+    """
+    def __init__(self, tree, limit=DEFAULT_LIMIT):
+        """
+        参数:
+            tree  - Tree 对象，初始内容作为第一个版本
+            limit - 撤销栈保留的版本数
+        """
+        self.tree = tree
+        self.limit = limit
+        self.checkpoints = {}
+        self._undo = []
+        self._redo = []
+        # 节点 ID -> 最近一次记录的快照，记录新版本时按哈希判断能否复用
+        self._latest = {}
+        # 上次清理 _latest 之后丢弃的版本数，累计到一定数量再清理，避免每次记录都遍历所有版本
+        self._dropped = 0
+        self._lock = threading.RLock()
+        self.current = Version(self._capture(tree.root), "打开", tree.current_node.id)
+
+    @property
+    def can_undo(self):
+        return bool(self._undo) or self._pending()
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def _pending(self):
+        """树是否有尚未记录的修改"""
+        return self.tree.root.subtree_hash() != self.current.root.hash
+
+    def _capture(self, root):
+        """为树创建快照，哈希未变的子树复用已有的快照节点"""
+        latest = self._latest
+        built = {}
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            previous = latest.get(node.id)
+            if not expanded:
+                if previous is not None and previous.hash == node.subtree_hash():
+                    built[id(node)] = previous
+                    continue
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children)
+                continue
+            content = node.content_hash()
+            if previous is not None and previous.content == content:
+                # 只有子节点变化（如修改位置的祖先），聊天记录沿用原来的元组
+                chats, packed = previous.chats, previous.packed
+            elif node.is_compressed:
+                chats, packed = None, node.packed_chats
+            else:
+                chats, packed = tuple(node.chats), None
+            snapshot = Snapshot(node.id, node.topic, chats, packed,
+                                tuple(built.pop(id(child)) for child in node.children),
+                                content, node.subtree_hash())
+            latest[node.id] = snapshot
+            built[id(node)] = snapshot
+        return built[id(root)]
+
+    def record(self, label="修改"):
+        """
+        树有变化时记录一个新版本
+
+        参数:
+            label - 操作说明，撤销 / 重做时显示
+
+        返回:
+            是否记录了新版本
+        """
+        with self._lock:
+            if not self._pending():
+                return False
+            self._push(Version(self._capture(self.tree.root), label, self.tree.current_node.id))
+            return True
+
+    def _push(self, version):
+        self._undo.append(self.current)
+        dropped = len(self._redo)
+        if len(self._undo) > self.limit:
+            dropped += len(self._undo) - self.limit
+            del self._undo[:len(self._undo) - self.limit]
+        self._redo.clear()
+        self.current = version
+        self._dropped += dropped
+        if self._dropped and self._dropped >= max(1, self.limit // 4):
+            self._prune_latest()
+
+    def _prune_latest(self):
+        """
+        从 _latest 中去掉只被已丢弃的版本引用的快照，
+        否则已删除节点的快照和它们的聊天记录元组会一直留在内存中
+        """
+        reachable = {}
+        seen = set()
+        for version in [self.current] + self.versions() + list(self.checkpoints.values()):
+            stack = [version.root]
+            while stack:
+                snapshot = stack.pop()
+                if id(snapshot) in seen:
+                    continue
+                seen.add(id(snapshot))
+                reachable.setdefault(snapshot.id, snapshot)
+                stack.extend(snapshot.children)
+        # 仍被引用的快照原样保留，其余换成保留的版本中该节点的快照（优先当前版本）
+        self._latest = {node_id: snapshot if id(snapshot) in seen else reachable[node_id]
+                        for node_id, snapshot in self._latest.items() if node_id in reachable}
+        self._dropped = 0
+
+    def change(self, label):
+        """
+        用于 with 语句：进入时先记录之前未记录的修改（如新的聊天消息），退出时把这次操作记录为一个版本
+
+        参数:
+            label - 操作说明
+        """
+        return _Change(self, label)
+
+    def undo(self):
+        """
+        撤销到上一个版本
+
+        返回:
+            被撤销的操作说明，没有可撤销的版本时返回 None
+        """
+        with self._lock:
+            self.record(PENDING_LABEL)
+            if not self._undo:
+                return None
+            undone = self.current
+            self._redo.append(undone)
+            self.current = self._undo.pop()
+            self._apply(self.current)
+            return undone.label
+
+    def redo(self):
+        """
+        重做上一个被撤销的版本
+
+        返回:
+            重做的操作说明，没有可重做的版本时返回 None
+        """
+        with self._lock:
+            if self._pending():
+                # 撤销后又修改了树，重做栈已失效
+                self.record(PENDING_LABEL)
+                return None
+            if not self._redo:
+                return None
+            self._undo.append(self.current)
+            self.current = self._redo.pop()
+            self._apply(self.current)
+            return self.current.label
+
+    def checkpoint(self, name):
+        """把当前内容记录为名为 name 的检查点，同名的检查点会被替换"""
+        with self._lock:
+            self.record(PENDING_LABEL)
+            self.checkpoints[name] = self.current
+            return self.current
+
+    def restore(self, name):
+        """
+        回到检查点，之后可以用 undo() 撤销这次恢复
+
+        返回:
+            是否找到检查点
+        """
+        with self._lock:
+            version = self.checkpoints.get(name)
+            if version is None:
+                return False
+            self.record(PENDING_LABEL)
+            if version.root.hash != self.current.root.hash:
+                self._push(Version(version.root, f"恢复检查点 '{name}'", version.current_id))
+                self._apply(self.current)
+            return True
+
+    def versions(self):
+        """撤销栈、当前版本和重做栈中的版本，按时间先后排列"""
+        return self._undo + [self.current] + self._redo[::-1]
+
+    def _apply(self, version):
+        """把树调整为版本的内容，只处理哈希不同的子树"""
+        tree = self.tree
+        stack = [(tree.root, version.root)]
+        while stack:
+            node, snapshot = stack.pop()
+            # 调整后节点的内容与快照相同，之后记录新版本时可以复用
+            self._latest[snapshot.id] = snapshot
+            if node.subtree_hash() == snapshot.hash:
+                continue
+            if node.topic != snapshot.topic:
+                node.topic = snapshot.topic
+            if node.content_hash() != snapshot.content:
+                _set_content(node, snapshot)
+            live = {child.id: child for child in node.children}
+            children = []
+            for child_snapshot in snapshot.children:
+                child = live.get(child_snapshot.id)
+                if child is None:
+                    # 已删除或被移到别处的节点，按快照重新创建
+                    child = build_node(child_snapshot)
+                else:
+                    stack.append((child, child_snapshot))
+                children.append(child)
+            if [child.id for child in node.children] != [child.id for child in children]:
+                for child in node.children:
+                    child.parent = None
+                node.children = children
+                for child in children:
+                    child.parent = node
+                node.invalidate()
+
+        # 当前节点已不在树中时，切换到版本记录的当前节点（找不到时为根节点）
+        current = tree.current_node
+        while current.parent is not None:
+            current = current.parent
+        if current is not tree.root:
+            tree.current_node = tree.find_node(version.current_id) or tree.root
+
+    def stats(self):
+        """
+        统计所有版本占用的快照节点
+
+        返回:
+            {'versions', 'checkpoints', 'snapshots', 'tree_nodes', 'chat_refs'}，
+            snapshots 为去重后的快照节点数，tree_nodes 为每个版本节点数之和（即不共享时需要的节点数），
+            chat_refs 为去重后的聊天记录元组中的引用总数
+        """
+        versions = self.versions() + list(self.checkpoints.values())
+        seen = set()
+        chats_seen = set()
+        result = {'versions': len(self.versions()), 'checkpoints': len(self.checkpoints),
+                  'snapshots': 0, 'tree_nodes': 0, 'chat_refs': 0}
+        for version in versions:
+            stack = [version.root]
+            while stack:
+                snapshot = stack.pop()
+                result['tree_nodes'] += 1
+                if id(snapshot) in seen:
+                    # 共享的子树只统计一次，但要计入 tree_nodes
+                    result['tree_nodes'] += sum(1 for _ in snapshot.walk()) - 1
+                    continue
+                seen.add(id(snapshot))
+                result['snapshots'] += 1
+                if snapshot.chats is not None and id(snapshot.chats) not in chats_seen:
+                    chats_seen.add(id(snapshot.chats))
+                    result['chat_refs'] += len(snapshot.chats)
+                stack.extend(snapshot.children)
+        return result
+
+
+class _Change:
+    def __init__(self, history, label):
+        self.history = history
+        self.label = label
+
+    def __enter__(self):
+        self.history._lock.acquire()
+        self.history.record(PENDING_LABEL)
+        return self.history
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.history.record(self.label)
+        finally:
+            self.history._lock.release()
+        return False
@@ -0,0 +1,208 @@
+"""
+已加载聊天树的内存统计
+
+node_bytes() 估算单个节点自身占用的字节数（节点对象、属性字典、ID、主题、聊天记录列表及其中的字符串、
+子节点列表，已压缩的节点计入压缩后的数据），不含子节点本身；同一个对象在整棵树中只计算一次，多个节点共享的字符串不会重复计入。
+memory_report() 在此基础上按子树、按消息类型汇总，trace_allocations() 用 tracemalloc
+对比某个操作（如加载、保存）前后的内存分配。
+"""
+import sys
+import tracemalloc
+
+from core.service import message_kind
+
+MESSAGE_KINDS = ('user', 'ai', 'system', 'other', 'compressed')
+
+
+def _size(obj, seen):
+    """返回对象的浅层大小，已计算过的对象返回 0"""
+    key = id(obj)
+    if key in seen:
+        return 0
+    seen.add(key)
+    return sys.getsizeof(obj)
+
+
+def node_bytes(node, seen, by_kind=None):
+    """
+    估算节点自身占用的字节数
+
+    参数:
+        node    - TreeNode 对象
+        seen    - 已计算过的对象 ID 集合，跨节点共享以避免重复计数
+        by_kind - 可选的 {消息类型: [条数, 字节数]}，聊天记录的字节数会累加进去
+
+    返回:
+        字节数（不含子节点）
+    """
+    total = _size(node, seen)
+    attrs = getattr(node, '__dict__', None)
+    if attrs is not None:
+        total += _size(attrs, seen)
+    total += _size(node.id, seen) + _size(node.topic, seen) + _size(node.children, seen)
+    packed = node.packed_chats
+    if packed is not None:
+        # 已压缩的节点不解压，按压缩后的数据计入
+        size = _size(packed, seen) + _size(packed.data, seen)
+        total += size
+        if by_kind is not None:
+            by_kind['compressed'][0] += packed.count
+            by_kind['compressed'][1] += size
+        return total
+    total += _size(node.chats, seen)
+    for chat in node.chats:
+        size = _size(chat, seen)
+        total += size
+        if by_kind is not None:
+            entry = by_kind[message_kind(chat)]
+            entry[0] += 1
+            entry[1] += size
+    return total
+
+
+def subtree_bytes(root):
+    """
+    计算每个节点所在子树的总字节数
+
+    返回:
+        ({节点 ID: 子树字节数}, {节点 ID: 节点自身字节数}, {消息类型: [条数, 字节数]})
+    """
+    seen = set()
+    by_kind = {kind: [0, 0] for kind in MESSAGE_KINDS}
+    own = {}
+    totals = {}
+    # 先序遍历得到的顺序反过来处理，保证子节点先于父节点完成汇总
+    order = list(root.walk())
+    for node in order:
+        own[node.id] = node_bytes(node, seen, by_kind)
+    for node in reversed(order):
+        totals[node.id] = own[node.id] + sum(totals[child.id] for child in node.children)
+    return totals, own, by_kind
+
+
+def cached_subtree_bytes(root, cache):
+    """
+    估计整棵树占用的字节数，按 Merkle 哈希复用上次的结果
+
+    子树哈希与缓存中相同的子树直接使用缓存的字节数，只重新计算修改位置到根节点路径上的节点，
+    适合频繁检查已加载的树的大小。跨子树共享的字符串可能被重复计入；压缩冷节点不改变哈希，
+    在内容变化前缓存的仍是压缩前的大小。
+
+    参数:
+        root  - 根节点
+        cache - {节点 ID: (子树哈希, 子树字节数)}，调用者保存，首次为空字典
+
+    返回:
+        字节数
+    """
+    seen = set()
+    totals = {}
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if not expanded:
+            entry = cache.get(node.id)
+            if entry is not None and entry[0] == node.subtree_hash():
+                totals[node.id] = entry[1]
+                continue
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+            continue
+        total = node_bytes(node, seen) + sum(totals.pop(child.id) for child in node.children)
+        cache[node.id] = (node.subtree_hash(), total)
+        totals[node.id] = total
+    return totals[root.id]
+
+
+def memory_report(root, top=10):
+    """
+    统计以 root 为根的子树占用的内存
+
+    参数:
+        root - 统计范围的根节点
+        top  - 列出最大的子树数量
+
+    返回:
+        {'total_bytes', 'nodes', 'node_bytes', 'by_kind': {类型: {'count', 'bytes'}},
+         'children': [(节点, 字节数)], 'largest': [(主题路径, 节点, 字节数)]}
+        其中 node_bytes 为除聊天记录字符串以外的结构开销，children 为 root 各子节点所在子树（按大小降序）
+    """
+    totals, own, by_kind = subtree_bytes(root)
+    message_bytes = sum(size for _, size in by_kind.values())
+    paths = {root.id: [root.topic]}
+    candidates = []
+    for node in root.walk():
+        for child in node.children:
+            paths[child.id] = paths[node.id] + [child.topic]
+        if node is not root:
+            candidates.append((totals[node.id], node))
+    candidates.sort(key=lambda item: item[0], reverse=True)
+    return {
+        'total_bytes': totals[root.id],
+        'nodes': len(own),
+        'node_bytes': totals[root.id] - message_bytes,
+        'by_kind': {kind: {'count': count, 'bytes': size} for kind, (count, size) in by_kind.items()},
+        'children': sorted(((child, totals[child.id]) for child in root.children),
+                           key=lambda item: item[1], reverse=True),
+        'largest': [(paths[node.id], node, size) for size, node in candidates[:top]],
+    }
+
+
+def format_bytes(size):
+    """将字节数格式化为 B / KB / MB"""
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / 1024 / 1024:.2f} MB"
+
+
+def format_report(report):
+    """将 memory_report() 的结果格式化为便于阅读的多行文本"""
+    total = report['total_bytes'] or 1
+    lines = [f"总计 {format_bytes(report['total_bytes'])}，{report['nodes']} 个节点，"
+             f"结构开销 {format_bytes(report['node_bytes'])} ({report['node_bytes'] / total:.0%})",
+             "按消息类型:"]
+    for kind, entry in report['by_kind'].items():
+        lines.append(f"  {kind:<8} {entry['count']:>7} 条  {format_bytes(entry['bytes']):>10}  "
+                     f"({entry['bytes'] / total:.0%})")
+    if report['children']:
+        lines.append("各子节点的子树:")
+        for child, size in report['children']:
+            topic = child.topic.replace("\n", " ")[:40]
+            lines.append(f"  {format_bytes(size):>10} ({size / total:5.1%})  {topic} [{child.id}]")
+    if report['largest']:
+        lines.append("最大的子树:")
+        for path, node, size in report['largest']:
+            location = " / ".join(topic.replace("\n", " ")[:20] for topic in path)
+            lines.append(f"  {format_bytes(size):>10} ({size / total:5.1%})  {location} [{node.id}]")
+    return "\n".join(lines)
+
+
+def trace_allocations(func, top=10):
+    """
+    在 tracemalloc 下执行 func，对比前后的内存快照
+
+    参数:
+        func - 无参函数，如 lambda: load_tree(path)
+        top  - 返回分配最多的代码位置数量
+
+    返回:
+        (func 的返回值, 净增加的字节数, 峰值字节数, 分配最多的位置 [StatisticDiff])
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    snapshot_filter = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    diff = after.filter_traces(snapshot_filter).compare_to(before.filter_traces(snapshot_filter), 'lineno')
+    return result, current - base, peak - base, diff[:top]
@@ -0,0 +1,162 @@
+import json
+import os
+
+from core.archive import CODECS, PackedChats
+from core.dedup import decode_record, encode_record, intern_chats
+from core.tree import Tree, TreeNode
+
+# 自动保存使用的默认记录文件名
+DEFAULT_RECORDS_FILE = "chat_all_records.json"
+
+
+def serialize_node(node):
+    """
+    序列化树节点为字典格式
+
+    参数:
+        node - 要序列化的 TreeNode 对象（包含其全部子树）
+
+    返回:
+        可直接写入 JSON 的字典；已压缩的节点写入 chats_z 字段而不是 chats，不会被解压
+    """
+    packed = node.packed_chats
+    if packed is not None:
+        return {
+            'id': node.id,
+            'topic': node.topic,
+            'chats_z': packed.to_dict(),
+            'children': [serialize_node(child) for child in node.children]
+        }
+    return {
+        'id': node.id,
+        'topic': node.topic,
+        # 复制列表：结果可以作为快照交给其他线程写出，之后追加的消息不会混进去
+        'chats': list(node.chats),
+        'children': [serialize_node(child) for child in node.children]
+    }
+
+
+def build_tree_node_from_dict(data):
+    """
+    递归从字典数据创建 TreeNode 对象，用于打开历史聊天记录时还原树状结构
+
+    参数:
+        data - serialize_node 生成的字典
+
+    返回:
+        还原后的 TreeNode 对象
+    """
+    node = TreeNode(data['topic'], data.get('id'))
+    if 'chats_z' in data:
+        node.set_packed_chats(PackedChats.from_dict(data['chats_z']))
+    else:
+        # 内容相同的消息（复制的子树、重复的系统消息）共用同一个字符串
+        node.chats = intern_chats(data.get('chats', []))
+    for child_data in data.get('children', []):
+        node.add_child(build_tree_node_from_dict(child_data))
+    return node
+
+
+def validate_record(data):
+    """
+    检查字典是否为合法的聊天记录结构
+
+    参数:
+        data - json.load 得到的对象
+
+    返回:
+        错误信息列表，为空表示合法
+    """
+    errors = []
+    stack = [(data, "根节点")]
+    while stack:
+        item, where = stack.pop()
+        if not isinstance(item, dict):
+            errors.append(f"{where}: 不是对象")
+            continue
+        if not isinstance(item.get('topic'), str):
+            errors.append(f"{where}: 缺少 topic 字段")
+        if 'chats_z' in item:
+            packed = item['chats_z']
+            if not (isinstance(packed, dict) and packed.get('codec') in CODECS
+                    and isinstance(packed.get('data'), str)):
+                errors.append(f"{where}: chats_z 必须包含 codec 和 data 字段")
+        else:
+            chats = item.get('chats', [])
+            if not isinstance(chats, list) or not all(isinstance(c, str) for c in chats):
+                errors.append(f"{where}: chats 必须是字符串列表")
+        children = item.get('children', [])
+        if not isinstance(children, list):
+            errors.append(f"{where}: children 必须是列表")
+            continue
+        for i, child in enumerate(children):
+            stack.append((child, f"{where}/{i}"))
+    return errors
+
+
+def load_tree(file_path):
+    """
+    从 JSON 文件原模原样还原树状结构和各节点聊天内容，普通格式和去重格式（见 core.dedup）都可以读取
+
+    参数:
+        file_path - 记录文件路径，为目录时按文件夹存储读取（见 core.folder_store）
+
+    返回:
+        当前节点为根节点的 Tree 对象
+    """
+    if os.path.isdir(file_path):
+        from core.folder_store import open_store
+        return open_store(file_path).load()
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = decode_record(json.load(f))
+    tree = Tree()
+    tree.root = build_tree_node_from_dict(data)
+    tree.current_node = tree.root
+    return tree
+
+
+def save_tree(tree, file_path, dedup=False):
+    """
+    将整个树状聊天记录序列化为 JSON 写入文件
+
+    参数:
+        tree      - Tree 对象
+        file_path - 目标文件路径，为已存在的目录或以路径分隔符结尾时保存为文件夹存储，只写入有变化的节点
+        dedup     - 为 True 时写入去重格式（文件夹存储不受影响）
+    """
+    from core.folder_store import is_folder_store, open_store
+    if is_folder_store(file_path):
+        open_store(file_path).save(tree)
+        return
+    save_node(tree.root, file_path, dedup)
+
+
+def save_node(node, file_path, dedup=False):
+    """
+    将某个节点及其子树序列化为 JSON 写入文件
+
+    参数:
+        node      - TreeNode 对象
+        file_path - 目标文件路径
+        dedup     - 为 True 时写入去重格式：重复的文本只保存一次，系统消息只保存类型和参数，不缩进
+    """
+    write_record(serialize_node(node), file_path, dedup)
+
+
+def write_record(data, file_path, dedup=False):
+    """
+    把 serialize_node() 的结果写入文件，不访问树，可以在其他线程中执行
+
+    参数:
+        data      - serialize_node() 的结果
+        file_path - 目标文件路径
+        dedup     - 为 True 时写入去重格式
+    """
+    folder = os.path.dirname(file_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        if dedup:
+            json.dump(encode_record(data), f, ensure_ascii=False, separators=(",", ":"))
+        else:
+            json.dump(data, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,220 @@
+"""
+跨分支检索：生成回复前从其他节点中找出与问题最相关的片段，作为系统消息放在上下文开头
+
+树中各分支的对话相互独立，在一个子节点中提问时，模型看不到兄弟节点中已经讨论过的内容。
+Retriever 用 core.embeddings 的向量索引找出与问题相似的主题和消息，按相似度从高到低放入上下文，
+总长度严格不超过 token 预算（放不下的片段截断，剩余预算太少时跳过），不会把整个相邻分支发送给模型。
+
+检索范围默认是当前节点的父节点所在的子树（兄弟节点及其后代），当前节点自身的对话已在上下文中，不参与检索。
+
+检索分为四个阶段，耗时记录在 RetrievalResult.timings 中，启用跟踪时以 retrieval.<阶段> 写入 core.tracing：
+    index    - 增量更新索引（整棵树的 Merkle 哈希与上次相同时跳过）
+    embed    - 计算问题的向量
+    search   - 在检索范围内做相似度搜索
+    assemble - 去重、按预算截断并拼成系统消息
+"""
+import re
+import threading
+import time
+
+from core import tracing
+from core.embeddings import PREFIXES, TOPIC_INDEX, EmbeddingIndex
+from core.service import message_kind
+
+SCOPE_SUBTREE = 'subtree'
+SCOPE_TREE = 'tree'
+SCOPES = (SCOPE_SUBTREE, SCOPE_TREE)
+DEFAULT_TOP_K = 4
+DEFAULT_TOKEN_BUDGET = 512
+# 相似度低于该值的片段不放入上下文
+MIN_SCORE = 0.3
+# 剩余预算少于该 token 数时不再截断放入片段
+MIN_SNIPPET_TOKENS = 32
+# 搜索的候选数为 k 的倍数，跳过重复和过长的片段后仍有足够的候选
+CANDIDATE_FACTOR = 4
+# 与 benchmarks/mock_ollama.py 的 estimate_tokens() 相同，按 3 个字符 1 个 token 估计
+CHARS_PER_TOKEN = 3
+STAGES = ('index', 'embed', 'search', 'assemble')
+HEADER = "以下是对话树其他分支中与当前问题相关的内容，仅供参考：\n"
+LABELS = {'user': "你", 'ai': "AI"}
+# 推理模型回复中的思考过程，不占用预算
+THINK_PATTERN = re.compile(r"<think>.*?</think>", re.S)
+
+
+def estimate_tokens(text):
+    """粗略估计文本的 token 数"""
+    return len(text) // CHARS_PER_TOKEN
+
+
+def query_text(chats):
+    """取最后一条用户消息（去掉前缀）作为检索的问题，没有时返回空字符串"""
+    for chat in reversed(chats):
+        if message_kind(chat) == 'user':
+            return chat[len(PREFIXES['user']):].strip()
+    return ""
+
+
+class RetrievalResult:
+    """
+    一次检索的结果
+
+    snippets 为放入上下文的片段 [(相似度, 节点 ID, 消息序号, 文本)]，message 为拼好的系统消息
+    （Ollama 格式，没有片段时为 None），tokens 为其估计的 token 数，timings 为各阶段的秒数，
+    indexed 为本次更新索引的统计（索引未变化时为 None）
+    """
+    def __init__(self):
+        self.snippets = []
+        self.message = None
+        self.tokens = 0
+        self.timings = {}
+        self.indexed = None
+
+    @property
+    def elapsed(self):
+        return sum(self.timings.values())
+
+    def summary(self):
+        stages = " ".join(f"{stage} {self.timings[stage] * 1000:.0f}ms" for stage in STAGES if stage in self.timings)
+        return f"检索到 {len(self.snippets)} 个片段，约 {self.tokens} tokens，耗时 {self.elapsed * 1000:.0f}ms（{stages}）"
+
+
+class _Stage:
+    """记录一个阶段的耗时"""
+    def __init__(self, result, name):
+        self.result = result
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        self.result.timings[self.name] = elapsed
+        tracing.record(f"retrieval.{self.name}", elapsed)
+        return False
+
+
+def _snippet_text(node, index):
+    """片段的正文：主题或去掉前缀和思考过程的聊天记录，系统消息不作为片段（返回空字符串）"""
+    if index == TOPIC_INDEX:
+        return " ".join(node.topic.split())
+    chats = node.peek_chats()
+    if index >= len(chats):
+        return ""
+    chat = chats[index]
+    kind = message_kind(chat)
+    if kind == 'system':
+        return ""
+    text = chat[len(PREFIXES.get(kind, "")):]
+    if kind == 'ai':
+        text = THINK_PATTERN.sub("", text)
+    text = text.strip()
+    if not text:
+        return ""
+    label = LABELS.get(kind)
+    return f"{label}: {text}" if label else text
+
+
+class Retriever:
+    """
+    跨分支检索器
+
+    持有一个 EmbeddingIndex，每次检索前按树的变化增量更新；可被多个生成线程同时使用，
+    last_result 为最近一次检索的结果。
+    """
+    def __init__(self, client, index=None):
+        """
+        参数:
+            client - EmbeddingClient 对象
+            index  - 已加载的 EmbeddingIndex，为空时创建空索引（首次检索时计算整棵树的向量）
+        """
+        self.client = client
+        self.index = index if index is not None else EmbeddingIndex(client.model)
+        self.last_result = None
+        self._indexed_hash = None
+        self._lock = threading.Lock()
+
+    def refresh(self, root):
+        """
+        使索引与树一致，树的 Merkle 哈希与上次更新时相同时直接返回
+
+        返回:
+            EmbeddingIndex.update() 的统计，未更新时为 None
+        """
+        root_hash = root.subtree_hash()
+        with self._lock:
+            if root_hash == self._indexed_hash:
+                return None
+            result = self.index.update(root, self.client)
+            self._indexed_hash = root_hash
+            return result
+
+    def retrieve(self, node, query=None, scope=SCOPE_SUBTREE, k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET,
+                 min_score=MIN_SCORE):
+        """
+        为节点中的提问检索其他节点的相关片段
+
+        参数:
+            node         - 提问所在的节点，其自身的对话不参与检索
+            query        - 检索的问题，为空时使用节点最后一条用户消息
+            scope        - SCOPE_SUBTREE（父节点所在子树）或 SCOPE_TREE（整棵树）
+            k            - 最多放入的片段数
+            token_budget - 系统消息（含说明文字）估计 token 数的上限
+            min_score    - 相似度下限
+
+        返回:
+            RetrievalResult 对象
+        """
+        if scope not in SCOPES:
+            raise ValueError(f"未知的检索范围: {scope}")
+        result = RetrievalResult()
+        query = query if query is not None else query_text(node.peek_chats())
+        if not query or k <= 0 or token_budget <= estimate_tokens(HEADER) + MIN_SNIPPET_TOKENS:
+            return result
+
+        root = node
+        while root.parent is not None:
+            root = root.parent
+        with _Stage(result, 'index'):
+            result.indexed = self.refresh(root)
+        with _Stage(result, 'embed'):
+            vector = self.client.embed([query])[0]
+        with _Stage(result, 'search'):
+            scope_root = (node.parent or node) if scope == SCOPE_SUBTREE else root
+            nodes = {n.id: n for n in scope_root.walk() if n is not node}
+            with self._lock:
+                candidates = self.index.search(vector, k * CANDIDATE_FACTOR, list(nodes))
+        with _Stage(result, 'assemble'):
+            self._assemble(result, nodes, candidates, k, token_budget, min_score)
+        self.last_result = result
+        return result
+
+    @staticmethod
+    def _assemble(result, nodes, candidates, k, token_budget, min_score):
+        # 按字符数控制预算：总字符数不超过 token_budget * CHARS_PER_TOKEN 时估计值一定不超过预算
+        remaining = token_budget * CHARS_PER_TOKEN - len(HEADER)
+        min_chars = MIN_SNIPPET_TOKENS * CHARS_PER_TOKEN
+        seen = set()
+        lines = []
+        for score, node_id, index in candidates:
+            if score < min_score or len(lines) >= k or remaining < min_chars:
+                break
+            node = nodes.get(node_id)
+            if node is None:
+                continue
+            text = _snippet_text(node, index)
+            if not text or text in seen:
+                continue
+            seen.add(text)
+            topic = " ".join(node.topic.split())[:40]
+            line = f"【{topic}】{text}\n" if index != TOPIC_INDEX else f"【{topic}】\n"
+            if len(line) > remaining:
+                line = line[:remaining - 2] + "…\n"
+            remaining -= len(line)
+            lines.append(line)
+            result.snippets.append((score, node_id, index, text))
+        if lines:
+            content = HEADER + "".join(lines)
+            result.message = {'role': 'system', 'content': content}
+            result.tokens = estimate_tokens(content)
@@ -0,0 +1,395 @@
+import itertools
+import threading
+import logging
+from collections import OrderedDict, deque
+
+from core.generation import (GenerationHandle, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_NAMES,
+                             STATE_QUEUED, STATE_RUNNING)
+
+logger = logging.getLogger(__name__)
+
+# 每个优先级类别保留的最近样本数，用于计算分位数
+METRIC_WINDOW = 1000
+# 每个 (服务地址, 模型) 保留的最近生成数，统计随之滚动更新
+MODEL_WINDOW = 100
+
+
+def percentile(values, fraction):
+    """返回已排序列表的分位数，列表为空时返回 None"""
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class _ClassMetrics:
+    """某个优先级类别的排队和首字延迟统计"""
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.preempted = 0
+        self.queue_times = deque(maxlen=METRIC_WINDOW)
+        self.ttfts = deque(maxlen=METRIC_WINDOW)
+
+    def summary(self):
+        queue_times = sorted(self.queue_times)
+        ttfts = sorted(self.ttfts)
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'failed': self.failed,
+            'preempted': self.preempted,
+            'queue_time_p50': percentile(queue_times, 0.5),
+            'queue_time_p95': percentile(queue_times, 0.95),
+            'ttft_p50': percentile(ttfts, 0.5),
+            'ttft_p95': percentile(ttfts, 0.95),
+        }
+
+
+def _ns_rate(count, duration_ns):
+    """由 Ollama 返回的数量和纳秒耗时计算每秒速率"""
+    if not count or not duration_ns:
+        return None
+    return count / (duration_ns / 1e9)
+
+
+class _ModelMetrics:
+    """某个服务地址上某个模型最近若干次生成的延迟和吞吐"""
+    def __init__(self):
+        self.samples = deque(maxlen=MODEL_WINDOW)
+        self.total = 0
+
+    def add(self, handle, cancelled):
+        final = handle.final or {}
+        self.total += 1
+        self.samples.append({
+            'error': handle.error is not None and not cancelled,
+            'cancelled': cancelled,
+            'queue_time': handle.queue_time,
+            'ttft': handle.ttft,
+            'tokens_per_sec': _ns_rate(final.get('eval_count'), final.get('eval_duration')),
+            'prompt_tokens': final.get('prompt_eval_count'),
+            'prompt_tokens_per_sec': _ns_rate(final.get('prompt_eval_count'), final.get('prompt_eval_duration')),
+            'load_time': final['load_duration'] / 1e9 if final.get('load_duration') else None,
+        })
+
+    def summary(self):
+        samples = list(self.samples)
+        finished = [s for s in samples if not s['cancelled']]
+
+        def values(key):
+            return sorted(s[key] for s in finished if s[key] is not None)
+
+        def mean(key):
+            items = values(key)
+            return sum(items) / len(items) if items else None
+
+        queue_times = values('queue_time')
+        ttfts = values('ttft')
+        errors = sum(1 for s in finished if s['error'])
+        return {
+            'total': self.total,
+            'window': len(samples),
+            'errors': errors,
+            'error_rate': errors / len(finished) if finished else None,
+            'cancelled': len(samples) - len(finished),
+            'ttft_p50': percentile(ttfts, 0.5),
+            'ttft_p95': percentile(ttfts, 0.95),
+            'queue_time_p50': percentile(queue_times, 0.5),
+            'queue_time_p95': percentile(queue_times, 0.95),
+            'tokens_per_sec': mean('tokens_per_sec'),
+            'prompt_tokens': mean('prompt_tokens'),
+            'prompt_tokens_per_sec': mean('prompt_tokens_per_sec'),
+            'load_time': mean('load_time'),
+        }
+
+
+class _Endpoint:
+    """一个 Ollama 服务地址的并发槽位和排队请求"""
+    def __init__(self, limit, reserved):
+        self.limit = max(1, limit)
+        # 为交互请求保留的槽位，后台请求最多使用 limit - reserved 个
+        self.reserved = max(0, min(reserved, self.limit - 1))
+        self.running = set()
+        # 优先级 -> OrderedDict(fair_key -> deque[handle])
+        self.queues = {}
+
+    def queued_count(self):
+        return sum(len(q) for queues in self.queues.values() for q in queues.values())
+
+
+class RequestScheduler:
+    """
+    位于 AIModel 之前的生成请求调度器
+
+    - 优先级类别：数值越小越优先，交互请求（PRIORITY_INTERACTIVE）总是先于其他请求出队；
+    - 按服务地址限制并发：每个 endpoint 有独立的槽位上限，并为交互请求预留槽位，
+      大批量后台任务运行时交互请求仍能立即开始，首字延迟不受影响；
+    - 公平排队：同一优先级内按 fair_key（树或批量任务）轮流出队，一个大任务不会饿死其他任务；
+    - 抢占：交互请求没有可用槽位时中止优先级最低的可抢占生成，被抢占的生成重新排队；
+    - 统计：按优先级类别记录排队时间和首字延迟。
+    """
+    def __init__(self, default_limit=4, reserved_interactive=1, preempt=True):
+        """
+        参数:
+            default_limit        - 未单独设置的 endpoint 的并发上限
+            reserved_interactive - 每个 endpoint 为交互请求预留的槽位数
+            preempt              - 是否允许交互请求抢占后台生成
+        """
+        self.default_limit = default_limit
+        self.reserved_interactive = reserved_interactive
+        self.preempt = preempt
+        self._endpoints = {}
+        self._metrics = {}
+        # (服务地址, 模型) -> _ModelMetrics
+        self._model_metrics = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def set_limit(self, endpoint, limit, reserved_interactive=None):
+        """设置某个服务地址的并发上限和交互预留槽位"""
+        with self._lock:
+            state = self._endpoint(endpoint)
+            reserved = self.reserved_interactive if reserved_interactive is None else reserved_interactive
+            state.limit = max(1, limit)
+            state.reserved = max(0, min(reserved, state.limit - 1))
+        self._dispatch(endpoint)
+
+    def _endpoint(self, endpoint):
+        state = self._endpoints.get(endpoint)
+        if state is None:
+            state = self._endpoints[endpoint] = _Endpoint(self.default_limit, self.reserved_interactive)
+        return state
+
+    def _class_metrics(self, priority):
+        name = PRIORITY_NAMES.get(priority, f"priority_{priority}")
+        metrics = self._metrics.get(name)
+        if metrics is None:
+            metrics = self._metrics[name] = _ClassMetrics()
+        return metrics
+
+    def submit(self, ai_model, messages, node=None, priority=PRIORITY_NORMAL, model=None, options=None,
+               on_chunk=None, on_done=None, preemptible=None, fair_key=None, prepare=None):
+        """
+        提交一次流式生成
+
+        参数:
+            ai_model    - AIModel 对象，其 base_url 决定使用哪个 endpoint 的槽位
+            messages    - Ollama 格式的消息列表
+            node        - 结束后写入回复的 TreeNode，为空时不写入
+            priority    - PRIORITY_* 常量或任意整数，越小越优先
+            model       - 使用的模型，为空时使用 ai_model 的当前模型
+            options     - 传给 Ollama 的生成参数
+            on_chunk    - 回调 (handle, 文本片段)，在工作线程中调用
+            on_done     - 回调 (handle)，结束时在工作线程中调用
+            preemptible - 是否允许被抢占，默认非交互请求可被抢占
+            fair_key    - 公平排队的分组（如树的根节点 ID 或批量任务 ID）
+            prepare     - 回调 (handle)，取得槽位后、发送请求前在工作线程中调用一次，返回实际发送的消息列表
+
+        返回:
+            GenerationHandle 对象
+        """
+        handle = GenerationHandle(self, ai_model, messages, node, priority, model, options,
+                                  on_chunk, on_done, preemptible, fair_key, prepare)
+        with self._lock:
+            handle.seq = next(self._counter)
+            self._class_metrics(priority).submitted += 1
+            self._enqueue(handle)
+            victim = self._pick_victim(handle)
+        if victim is not None:
+            logger.info(f"优先级 {priority} 的请求抢占了优先级 {victim.priority} 的生成")
+            victim._preempt()
+        self._dispatch(handle.endpoint)
+        return handle
+
+    def _enqueue(self, handle, front=False):
+        state = self._endpoint(handle.endpoint)
+        queues = state.queues.setdefault(handle.priority, OrderedDict())
+        queue = queues.get(handle.fair_key)
+        if queue is None:
+            queue = queues[handle.fair_key] = deque()
+        if front:
+            queue.appendleft(handle)
+        else:
+            queue.append(handle)
+
+    def _can_start(self, state, priority):
+        if len(state.running) >= state.limit:
+            return False
+        if priority > PRIORITY_INTERACTIVE:
+            background = sum(1 for h in state.running if h.priority > PRIORITY_INTERACTIVE)
+            return background < state.limit - state.reserved
+        return True
+
+    def _pick_victim(self, handle):
+        """交互请求没有可用槽位时选出要被抢占的生成（调用时需持有锁）"""
+        state = self._endpoint(handle.endpoint)
+        if not self.preempt or self._can_start(state, handle.priority):
+            return None
+        candidates = [h for h in state.running
+                      if h.preemptible and h.priority > handle.priority and not h._preempted]
+        if not candidates:
+            return None
+        # 优先抢占优先级最低、开始最晚（浪费的计算最少）的生成
+        return max(candidates, key=lambda h: (h.priority, h.started_at or 0))
+
+    def _next_handle(self, state):
+        """按优先级、再按 fair_key 轮流取出下一个可以开始的请求（调用时需持有锁）"""
+        for priority in sorted(state.queues):
+            queues = state.queues[priority]
+            if not queues or not self._can_start(state, priority):
+                continue
+            fair_key, queue = next(iter(queues.items()))
+            handle = queue.popleft()
+            # 该分组移到队尾，下次轮到其他分组
+            del queues[fair_key]
+            if queue:
+                queues[fair_key] = queue
+            return handle
+        return None
+
+    def _dispatch(self, endpoint):
+        to_start = []
+        with self._lock:
+            state = self._endpoint(endpoint)
+            while True:
+                handle = self._next_handle(state)
+                if handle is None:
+                    break
+                if handle._cancelled:
+                    continue
+                handle.state = STATE_RUNNING
+                state.running.add(handle)
+                to_start.append(handle)
+        for handle in to_start:
+            threading.Thread(target=handle._run, daemon=True).start()
+
+    def _cancel_queued(self, handle):
+        with self._lock:
+            queued = handle.state == STATE_QUEUED
+            if queued:
+                queues = self._endpoint(handle.endpoint).queues.get(handle.priority, {})
+                queue = queues.get(handle.fair_key)
+                if queue is not None and handle in queue:
+                    queue.remove(handle)
+                    if not queue:
+                        del queues[handle.fair_key]
+        if queued:
+            self._record(handle, cancelled=True)
+            handle._finish()
+
+    def _finished(self, handle):
+        with self._lock:
+            self._endpoint(handle.endpoint).running.discard(handle)
+            requeue = handle._preempted and not handle._cancelled
+            if requeue:
+                self._class_metrics(handle.priority).preempted += 1
+                handle._requeue()
+                # 被抢占的请求排在同组后来者之前
+                self._enqueue(handle, front=True)
+        if not requeue:
+            self._record(handle, cancelled=handle._cancelled)
+            handle._finish()
+        self._dispatch(handle.endpoint)
+
+    def _record(self, handle, cancelled):
+        with self._lock:
+            metrics = self._class_metrics(handle.priority)
+            if cancelled:
+                metrics.cancelled += 1
+            elif handle.error is not None:
+                metrics.failed += 1
+            else:
+                metrics.completed += 1
+            if handle.queue_time is not None:
+                metrics.queue_times.append(handle.queue_time)
+            if handle.ttft is not None:
+                metrics.ttfts.append(handle.ttft)
+            key = (handle.endpoint, handle.model_name)
+            model_metrics = self._model_metrics.get(key)
+            if model_metrics is None:
+                model_metrics = self._model_metrics[key] = _ModelMetrics()
+            model_metrics.add(handle, cancelled)
+
+    def active(self):
+        """返回正在运行的生成列表"""
+        with self._lock:
+            return [h for state in self._endpoints.values() for h in state.running]
+
+    def pending(self):
+        """返回尚未结束的生成列表（正在运行和排队中的）"""
+        with self._lock:
+            handles = []
+            for state in self._endpoints.values():
+                handles.extend(state.running)
+                for queues in state.queues.values():
+                    for queue in queues.values():
+                        handles.extend(queue)
+            return handles
+
+    def stats(self):
+        """
+        返回调度器统计
+
+        返回:
+            {'endpoints': {地址: {limit, reserved, running, queued}}, 'classes': {类别: 排队/首字延迟统计}}
+        """
+        with self._lock:
+            endpoints = {name: {'limit': state.limit, 'reserved': state.reserved,
+                                'running': len(state.running), 'queued': state.queued_count()}
+                         for name, state in self._endpoints.items()}
+            classes = {name: metrics.summary() for name, metrics in self._metrics.items()}
+        return {'endpoints': endpoints, 'classes': classes}
+
+    def model_stats(self):
+        """
+        返回按服务地址和模型统计的最近生成情况，首字延迟、排队时间为秒，
+        生成和提示处理速度来自 Ollama 返回的 eval_count / eval_duration 等计时字段
+
+        返回:
+            [{'endpoint', 'model', 'total', 'window', 'errors', 'error_rate', 'cancelled', 'ttft_p50', 'ttft_p95',
+              'queue_time_p50', 'queue_time_p95', 'tokens_per_sec', 'prompt_tokens', 'prompt_tokens_per_sec',
+              'load_time'}]
+        """
+        with self._lock:
+            items = [(key, metrics.summary()) for key, metrics in self._model_metrics.items()]
+        rows = []
+        for (endpoint, model), summary in sorted(items):
+            rows.append(dict(summary, endpoint=endpoint, model=model))
+        return rows
+
+    def format_model_stats(self):
+        """将按模型的统计格式化为便于阅读的多行文本"""
+        lines = []
+        for row in self.model_stats():
+            lines.append(f"{row['model']} @ {row['endpoint']}: 最近 {row['window']} 次 "
+                         f"错误率 {_format(row['error_rate'], '{:.0%}')} "
+                         f"首字 p50 {_format(row['ttft_p50'], '{:.2f}s')} p95 {_format(row['ttft_p95'], '{:.2f}s')} "
+                         f"生成 {_format(row['tokens_per_sec'], '{:.1f} tok/s')} "
+                         f"提示 {_format(row['prompt_tokens'], '{:.0f} tok')} "
+                         f"({_format(row['prompt_tokens_per_sec'], '{:.0f} tok/s')}) "
+                         f"排队 p50 {_format(row['queue_time_p50'], '{:.2f}s')}")
+        return "\n".join(lines)
+
+    def format_stats(self):
+        """将统计格式化为便于阅读的多行文本"""
+        stats = self.stats()
+        lines = []
+        for name, state in stats['endpoints'].items():
+            lines.append(f"{name}: 运行 {state['running']}/{state['limit']} (交互预留 {state['reserved']}) "
+                         f"排队 {state['queued']}")
+        for name, summary in stats['classes'].items():
+            def ms(value):
+                return "-" if value is None else f"{value * 1000:.0f}ms"
+            lines.append(f"[{name}] 提交 {summary['submitted']} 完成 {summary['completed']} "
+                         f"取消 {summary['cancelled']} 失败 {summary['failed']} 被抢占 {summary['preempted']} "
+                         f"排队 p50 {ms(summary['queue_time_p50'])} p95 {ms(summary['queue_time_p95'])} "
+                         f"首字 p50 {ms(summary['ttft_p50'])} p95 {ms(summary['ttft_p95'])}")
+        return "\n".join(lines)
+
+
+def _format(value, pattern):
+    return "-" if value is None else pattern.format(value)
@@ -0,0 +1,756 @@
+"""
+多人共用聊天树的服务端：基于 asyncio 的 HTTP / WebSocket 接口
+
+只使用标准库。所有对树的修改都在事件循环线程中执行，不需要加锁；流式生成仍由 ChatService 的调度器
+在工作线程中进行，收到的片段和最终的回复都通过 call_soon_threadsafe 交回事件循环，回复也在事件循环中写入节点
+（start_reply(write_back=False) 与 finish_reply()），工作线程不修改树。同一节点同时只能有一个生成，
+生成尚未结束时再次生成或删除该节点（及其祖先）返回 409。
+
+HTTP 接口（请求和响应均为 JSON）:
+    GET    /api/trees                               已打开和记录文件夹中的树
+    GET    /api/trees/{树}                           树的结构（节点 ID、主题、子节点，不含聊天记录）
+    POST   /api/trees/{树}/save                      保存到记录文件
+    GET    /api/trees/{树}/nodes/{ID}?since=N        节点详情，since 指定时只返回第 N 条之后的聊天记录
+    POST   /api/trees/{树}/nodes                     {"parent", "topic"} 创建子节点
+    PATCH  /api/trees/{树}/nodes/{ID}                {"topic"} 重命名，{"parent", "index"} 移动
+    DELETE /api/trees/{树}/nodes/{ID}                删除节点及其子树
+    POST   /api/trees/{树}/nodes/{ID}/copy           {"parent"} 复制子树
+    POST   /api/trees/{树}/nodes/{ID}/messages       {"text", "generate"} 追加用户消息，可同时开始生成回复
+    POST   /api/trees/{树}/nodes/{ID}/generate       {"stream", "model"} 生成回复，stream 为真时以 NDJSON 分块返回
+    GET    /api/stats                                连接数、请求数、推送的事件数
+
+WebSocket /api/trees/{树}/ws:
+    客户端发送 {"id", "op", ...}，op 为 subscribe / unsubscribe / get / create / rename / move / delete /
+    copy / append / generate，参数与 HTTP 接口相同，服务端回复 {"type": "result", "id", "ok", "result" 或 "error"}。
+    订阅后收到 {"type": "event", "tree", "seq", "event", "node", ...}，event 为 created / renamed / moved /
+    deleted / copied / message / chunk / generation_done，seq 在每棵树内递增，客户端可据此发现遗漏；
+    chunk 事件数量多，订阅时指定 {"chunks": true} 才会收到。
+
+每个事件只编码一次，同一帧直接写给所有订阅者；写缓冲超过 MAX_BUFFERED_BYTES 的慢客户端会被断开，
+不会拖慢其他客户端和服务端的内存。
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from core.service import ChatService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# 单个请求体或 WebSocket 消息的上限
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# 订阅者的写缓冲超过该字节数时断开
+MAX_BUFFERED_BYTES = 4 * 1024 * 1024
+# 自动保存的间隔（秒），树没有变化时直接跳过，有变化时在线程池中写文件
+AUTOSAVE_INTERVAL = 30
+TREE_NAME_PATTERN = re.compile(r"^[^/\\]+$")
+
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    """以指定的 HTTP 状态码返回给客户端的错误"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ------------------------ WebSocket 帧 ------------------------
+def encode_frame(payload, opcode=OP_TEXT, mask=False):
+    """
+    编码一个 WebSocket 帧
+
+    参数:
+        payload - bytes 或 str
+        opcode  - 帧类型
+        mask    - 客户端发送的帧必须加掩码
+    """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    length = len(payload)
+    head = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        head.append(mask_bit | length)
+    elif length < 1 << 16:
+        head.append(mask_bit | 126)
+        head += length.to_bytes(2, "big")
+    else:
+        head.append(mask_bit | 127)
+        head += length.to_bytes(8, "big")
+    if mask:
+        key = os.urandom(4)
+        return bytes(head) + key + _apply_mask(payload, key)
+    return bytes(head) + payload
+
+
+def _apply_mask(data, key):
+    if not data:
+        return data
+    repeated = (key * (len(data) // 4 + 1))[:len(data)]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(repeated, "big")).to_bytes(len(data), "big")
+
+
+async def read_message(reader):
+    """
+    读取一条完整的 WebSocket 消息（合并分片），自动忽略 pong
+
+    返回:
+        (opcode, 数据)，opcode 为 OP_TEXT / 0x2 / OP_CLOSE / OP_PING
+
+    异常:
+        ApiError(413) - 单个帧或合并后的消息超过 MAX_BODY_BYTES
+    """
+    parts = []
+    # 已收到的分片总长度，不限制时客户端可以一直发送非 FIN 分片耗尽内存
+    total = 0
+    message_opcode = None
+    while True:
+        head = await reader.readexactly(2)
+        fin = head[0] & 0x80
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2), "big")
+        elif length == 127:
+            length = int.from_bytes(await reader.readexactly(8), "big")
+        if length > MAX_BODY_BYTES:
+            raise ApiError(413, "消息过大")
+        key = await reader.readexactly(4) if head[1] & 0x80 else None
+        data = await reader.readexactly(length)
+        if key is not None:
+            data = _apply_mask(data, key)
+        if opcode >= 0x8:
+            # 控制帧可以夹在分片之间
+            if opcode == OP_PONG:
+                continue
+            return opcode, data
+        if opcode != 0:
+            message_opcode = opcode
+        total += len(data)
+        if total > MAX_BODY_BYTES:
+            raise ApiError(413, "消息过大")
+        parts.append(data)
+        if fin:
+            return message_opcode, b"".join(parts)
+
+
+def websocket_accept(key):
+    """握手响应中的 Sec-WebSocket-Accept"""
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+
+
+# ------------------------ HTTP ------------------------
+async def read_request(reader):
+    """
+    读取一个 HTTP 请求
+
+    返回:
+        (方法, 路径, 查询参数, 请求头, 请求体)，连接已关闭时返回 None
+    """
+    try:
+        line = await reader.readline()
+    except (ConnectionError, asyncio.LimitOverrunError):
+        return None
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ApiError(400, "请求行格式错误")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY_BYTES:
+        raise ApiError(413, "请求体过大")
+    body = await reader.readexactly(length) if length else b""
+    parts = urlsplit(target)
+    query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    return method.upper(), unquote(parts.path), query, headers, body
+
+
+def encode_response(status, payload=None, headers=None):
+    """编码 JSON 响应"""
+    body = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {len(body)}"]
+    if payload is not None:
+        lines.append("Content-Type: application/json; charset=utf-8")
+    for name, value in (headers or {}).items():
+        lines.append(f"{name}: {value}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def _chunk(payload):
+    """分块传输编码的一块 NDJSON"""
+    data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+    return f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n"
+
+
+def node_summary(node):
+    """节点的基本信息（不含聊天记录）"""
+    return {'id': node.id, 'topic': node.topic, 'parent': node.parent.id if node.parent else None,
+            'children': [child.id for child in node.children]}
+
+
+def tree_structure(root):
+    """树的结构 {'id', 'topic', 'messages', 'children': [...]}，不含聊天记录"""
+    result = None
+    stack = [(root, None)]
+    while stack:
+        node, siblings = stack.pop()
+        count = node.packed_chats.count if node.is_compressed else len(node.chats)
+        item = {'id': node.id, 'topic': node.topic, 'messages': count, 'children': []}
+        if siblings is None:
+            result = item
+        else:
+            siblings.append(item)
+        stack.extend((child, item['children']) for child in reversed(node.children))
+    return result
+
+
+class Connection:
+    """一个 WebSocket 客户端"""
+    def __init__(self, writer, chunks=False):
+        self.writer = writer
+        self.chunks = chunks
+        self.subscribed = False
+
+    @property
+    def peer(self):
+        return self.writer.get_extra_info("peername")
+
+    def send(self, frame):
+        """写入一帧，写缓冲过大时断开并返回 False"""
+        transport = self.writer.transport
+        if transport.is_closing():
+            return False
+        if transport.get_write_buffer_size() > MAX_BUFFERED_BYTES:
+            logger.warning(f"客户端 {self.peer} 接收过慢，已断开")
+            transport.abort()
+            return False
+        self.writer.write(frame)
+        return True
+
+
+class HostedTree:
+    """
+    服务端打开的一棵树：ChatService、节点索引和订阅者
+    """
+    def __init__(self, name, path, service):
+        self.name = name
+        self.path = path
+        self.service = service
+        self.subscribers = set()
+        self.seq = 0
+        # 同一棵树的保存依次进行，不会有两个线程同时写同一个文件
+        self.save_lock = asyncio.Lock()
+        self._nodes = {}
+        self._indexed_hash = None
+
+    @property
+    def root(self):
+        return self.service.tree.root
+
+    def node(self, node_id):
+        """按 ID 查找节点，找不到时抛出 404"""
+        node = self._nodes.get(node_id)
+        if node is None or not self.root.is_ancestor_of(node):
+            # 树有变化时才重建索引，不存在的 ID 不会每次都触发全树遍历
+            root_hash = self.root.subtree_hash()
+            if root_hash != self._indexed_hash:
+                self._nodes = {n.id: n for n in self.root.walk()}
+                self._indexed_hash = root_hash
+            node = self._nodes.get(node_id)
+        if node is None:
+            raise ApiError(404, f"找不到节点: {node_id}")
+        return node
+
+    def index(self, node):
+        """把新增的子树加入索引"""
+        for descendant in node.walk():
+            self._nodes[descendant.id] = descendant
+
+
+class TreeServer:
+    """
+    HTTP / WebSocket 服务端
+
+    用法:
+        server = TreeServer(settings)
+        asyncio.run(server.serve_forever())
+    """
+    def __init__(self, settings, host="127.0.0.1", port=DEFAULT_PORT, ai_model=None):
+        """
+        参数:
+            settings - Settings 对象，records_folder 下的 <树名>.json 为各棵树的记录文件
+            host     - 监听地址
+            port     - 监听端口，0 表示自动选择
+            ai_model - 所有树共用的 AIModel，为空时首次生成时创建
+        """
+        self.settings = settings
+        self.host = host
+        self.port = port
+        self.trees = {}
+        self.stats = {'connections': 0, 'websockets': 0, 'requests': 0, 'events': 0, 'frames': 0,
+                      'generations': 0, 'errors': 0}
+        self._ai_model = ai_model
+        self._scheduler = None
+        self._server = None
+        self._loop = None
+
+    # ------------------------ 树 ------------------------
+    def tree_path(self, name):
+        return os.path.join(self.settings.records_folder, name + ".json")
+
+    def open_tree(self, name):
+        """打开（必要时新建）名为 name 的树，同一棵树只加载一次"""
+        hosted = self.trees.get(name)
+        if hosted is not None:
+            return hosted
+        if not TREE_NAME_PATTERN.match(name) or name.startswith("."):
+            raise ApiError(400, f"无效的树名称: {name}")
+        service = ChatService(self.settings, self._ai_model, self._scheduler)
+        path = self.tree_path(name)
+        if os.path.exists(path):
+            service.load(path)
+        hosted = HostedTree(name, path, service)
+        # 各棵树共用同一个 AIModel 和调度器，并发上限对整个服务端生效
+        self._ai_model = service.ai_model if self._ai_model is None else self._ai_model
+        self._scheduler = service.scheduler
+        self.trees[name] = hosted
+        logger.info(f"打开树 {name}（{path}）")
+        return hosted
+
+    def list_trees(self):
+        names = set(self.trees)
+        folder = self.settings.records_folder
+        if os.path.isdir(folder):
+            names.update(os.path.splitext(f)[0] for f in os.listdir(folder)
+                         if f.endswith(".json") and not f.endswith(".emb.json"))
+        return sorted(names)
+
+    async def save_tree(self, hosted):
+        """
+        保存一棵树：在事件循环中取得快照，在线程池中写文件，写入期间其他请求照常处理
+
+        返回:
+            记录文件路径
+        """
+        async with hosted.save_lock:
+            path, write = hosted.service.prepare_save(hosted.path)
+            if write is not None:
+                await self._loop.run_in_executor(None, write)
+        return path
+
+    async def save_all_async(self):
+        for hosted in list(self.trees.values()):
+            try:
+                await self.save_tree(hosted)
+            except Exception as e:
+                logger.error(f"保存树 {hosted.name} 失败: {e}")
+
+    def save_all(self):
+        """在当前线程中保存所有树（服务端退出时使用）"""
+        for hosted in self.trees.values():
+            try:
+                hosted.service.save(hosted.path)
+            except Exception as e:
+                logger.error(f"保存树 {hosted.name} 失败: {e}")
+
+    # ------------------------ 事件 ------------------------
+    def publish(self, hosted, event, node_id, **fields):
+        """向树的订阅者推送事件，只编码一次"""
+        hosted.seq += 1
+        if not hosted.subscribers:
+            return
+        payload = {'type': 'event', 'tree': hosted.name, 'seq': hosted.seq, 'event': event, 'node': node_id}
+        payload.update(fields)
+        frame = encode_frame(json.dumps(payload, ensure_ascii=False))
+        self.stats['events'] += 1
+        for connection in list(hosted.subscribers):
+            if event == 'chunk' and not connection.chunks:
+                continue
+            if connection.send(frame):
+                self.stats['frames'] += 1
+            else:
+                hosted.subscribers.discard(connection)
+
+    # ------------------------ 操作 ------------------------
+    @staticmethod
+    def _int_param(params, name, default=None):
+        """整数参数：查询参数合并到 params 时为字符串，JSON 中也可能是字符串，都不是整数时抛出 400"""
+        value = params.get(name)
+        if value is None or value == "":
+            return default
+        if isinstance(value, bool):
+            raise ApiError(400, f"{name} 必须是整数")
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ApiError(400, f"{name} 必须是整数") from None
+
+    def op_get(self, hosted, params):
+        node = hosted.node(params.get('node'))
+        chats = node.peek_chats()
+        since = self._int_param(params, 'since', 0)
+        result = node_summary(node)
+        result['count'] = len(chats)
+        result['chats'] = list(chats[since:])
+        return result
+
+    def op_create(self, hosted, params):
+        parent = hosted.node(params.get('parent') or hosted.root.id)
+        topic = params.get('topic') or "新主题"
+        node = hosted.service.add_child(parent, topic)
+        hosted.index(node)
+        self.publish(hosted, 'created', node.id, parent=parent.id, topic=topic)
+        return node_summary(node)
+
+    def op_rename(self, hosted, params):
+        node = hosted.node(params.get('node'))
+        topic = params.get('topic')
+        if not topic:
+            raise ApiError(400, "缺少 topic")
+        hosted.service.rename_node(node, topic)
+        self.publish(hosted, 'renamed', node.id, topic=topic)
+        return node_summary(node)
+
+    def op_move(self, hosted, params):
+        node = hosted.node(params.get('node'))
+        parent = hosted.node(params.get('parent'))
+        try:
+            hosted.service.move_node(node, parent, self._int_param(params, 'index'))
+        except ValueError as e:
+            raise ApiError(409, str(e))
+        self.publish(hosted, 'moved', node.id, parent=parent.id, index=parent.children.index(node))
+        return node_summary(node)
+
+    def op_delete(self, hosted, params):
+        node = hosted.node(params.get('node'))
+        if node.parent is None:
+            raise ApiError(409, "根节点不可删除")
+        if any(hosted.service.active_reply(n) is not None for n in node.walk()):
+            raise ApiError(409, "节点上仍有生成在进行，请等待完成后再删除")
+        parent = node.parent
+        hosted.service.delete_node(parent, node)
+        self.publish(hosted, 'deleted', node.id, parent=parent.id)
+        return {'deleted': node.id}
+
+    def op_copy(self, hosted, params):
+        node = hosted.node(params.get('node'))
+        parent = hosted.node(params.get('parent'))
+        copy = hosted.service.copy_node(node, parent)
+        hosted.index(copy)
+        self.publish(hosted, 'copied', copy.id, source=node.id, parent=parent.id, structure=tree_structure(copy))
+        return node_summary(copy)
+
+    def op_append(self, hosted, params):
+        node = hosted.node(params.get('node'))
+        text = params.get('text')
+        if not text:
+            raise ApiError(400, "缺少 text")
+        if params.get('generate'):
+            # 先检查，避免写入了消息却无法生成
+            self._check_idle(hosted, node)
+        message = hosted.service.append_user_message(text, node)
+        index = len(node.chats) - 1
+        self.publish(hosted, 'message', node.id, index=index, message=message)
+        result = {'node': node.id, 'index': index, 'message': message}
+        if params.get('generate'):
+            result['generation'] = self._start_generation(hosted, node, params.get('model'))
+        return result
+
+    def op_generate(self, hosted, params):
+        node = hosted.node(params.get('node'))
+        return {'node': node.id, 'generation': self._start_generation(hosted, node, params.get('model'))}
+
+    OPS = ('get', 'create', 'rename', 'move', 'delete', 'copy', 'append', 'generate')
+
+    def _check_idle(self, hosted, node):
+        """节点上一次的生成尚未结束时抛出 409"""
+        if hosted.service.active_reply(node) is not None:
+            raise ApiError(409, f"节点 '{node.topic}' 的回复尚未生成完毕")
+
+    def _start_generation(self, hosted, node, model=None, on_chunk=None, on_done=None):
+        """
+        开始生成回复，片段和结束事件推送给订阅者
+
+        参数:
+            on_chunk - 回调 (文本片段)，在事件循环线程中调用
+            on_done  - 回调 (handle)，在事件循环线程中调用
+
+        返回:
+            生成的编号（在该树内唯一）
+
+        异常:
+            ApiError(409) - 节点上一次的生成尚未结束
+        """
+        self._check_idle(hosted, node)
+        loop = self._loop
+        self.stats['generations'] += 1
+        generation = self.stats['generations']
+
+        def chunk(handle, text):
+            loop.call_soon_threadsafe(chunk_in_loop, text)
+
+        def chunk_in_loop(text):
+            self.publish(hosted, 'chunk', node.id, generation=generation, text=text)
+            if on_chunk:
+                on_chunk(text)
+
+        def done(handle):
+            loop.call_soon_threadsafe(done_in_loop, handle)
+
+        def done_in_loop(handle):
+            hosted.service.finish_reply(handle, node)
+            self.publish(hosted, 'message', node.id, index=len(node.chats) - 1, message=handle.reply_msg)
+            self.publish(hosted, 'generation_done', node.id, generation=generation, state=handle.state)
+            if on_done:
+                on_done(handle)
+
+        hosted.service.start_reply(node, on_chunk=chunk, on_done=done, model=model, write_back=False)
+        return generation
+
+    async def _generate_http(self, hosted, params, writer):
+        """HTTP 生成：stream 为真时以 NDJSON 分块返回片段，否则等待结束后返回回复"""
+        node = hosted.node(params.get('node'))
+        finished = self._loop.create_future()
+        stream = bool(params.get('stream'))
+        on_chunk = (lambda text: writer.write(_chunk({'chunk': text}))) if stream else None
+        # 片段由 call_soon_threadsafe 交回事件循环，不会早于下面写出的响应头；生成无法开始时仍可返回 409
+        generation = self._start_generation(hosted, node, params.get('model'), on_chunk,
+                                            lambda handle: finished.set_result(handle))
+        if stream:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n"
+                         b"Transfer-Encoding: chunked\r\n\r\n")
+        handle = await finished
+        result = {'node': node.id, 'generation': generation, 'state': handle.state, 'message': handle.reply_msg}
+        if stream:
+            writer.write(_chunk(dict(result, done=True)) + b"0\r\n\r\n")
+            return None
+        return result
+
+    def run_op(self, hosted, op, params):
+        if op not in self.OPS:
+            raise ApiError(400, f"未知的操作: {op}")
+        return getattr(self, "op_" + op)(hosted, params)
+
+    # ------------------------ HTTP 路由 ------------------------
+    def _route(self, method, path, query, body):
+        """
+        把 HTTP 请求映射为 (树, 操作, 参数)，树为空时表示不针对某棵树的请求
+
+        返回:
+            (HostedTree 或 None, 操作名, 参数字典)
+        """
+        parts = [part for part in path.split("/") if part]
+        if len(parts) < 2 or parts[0] != "api":
+            raise ApiError(404, f"未知的路径: {path}")
+        if parts[1:] == ["stats"] and method == "GET":
+            return None, 'stats', {}
+        if parts[1] != "trees":
+            raise ApiError(404, f"未知的路径: {path}")
+        if len(parts) == 2 and method == "GET":
+            return None, 'trees', {}
+        if len(parts) < 3:
+            raise ApiError(405, "不支持的方法")
+        hosted = self.open_tree(parts[2])
+        params = dict(query)
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                raise ApiError(400, "请求体不是有效的 JSON")
+            if not isinstance(data, dict):
+                raise ApiError(400, "请求体必须是 JSON 对象")
+            params.update(data)
+        rest = parts[3:]
+        routes = {
+            ((), "GET"): 'structure',
+            (("save",), "POST"): 'save',
+            (("nodes",), "POST"): 'create',
+        }
+        if len(rest) >= 2 and rest[0] == "nodes":
+            params['node'] = rest[1]
+            action = rest[2] if len(rest) > 2 else None
+            if action is None:
+                op = {'GET': 'get', 'DELETE': 'delete'}.get(method)
+                if method == "PATCH":
+                    op = 'move' if 'parent' in params else 'rename'
+            else:
+                op = {('copy', 'POST'): 'copy', ('messages', 'POST'): 'append',
+                      ('generate', 'POST'): 'generate'}.get((action, method))
+        else:
+            op = routes.get((tuple(rest), method))
+        if op is None:
+            raise ApiError(405 if rest else 404, f"不支持的请求: {method} {path}")
+        return hosted, op, params
+
+    async def _handle_http(self, request, writer):
+        method, path, query, headers, body = request
+        self.stats['requests'] += 1
+        try:
+            hosted, op, params = self._route(method, path, query, body)
+            status = 201 if op in ('create', 'copy') else 200
+            if op == 'stats':
+                result = self.server_stats()
+            elif op == 'trees':
+                result = {'trees': self.list_trees()}
+            elif op == 'structure':
+                result = tree_structure(hosted.root)
+            elif op == 'save':
+                result = {'path': await self.save_tree(hosted)}
+            elif op == 'generate':
+                result = await self._generate_http(hosted, params, writer)
+                if result is None:
+                    return
+            else:
+                result = self.run_op(hosted, op, params)
+        except ApiError as e:
+            status, result = e.status, {'error': str(e)}
+        except Exception as e:
+            logger.exception(f"处理请求 {method} {path} 失败")
+            self.stats['errors'] += 1
+            status, result = 500, {'error': str(e)}
+        writer.write(encode_response(status, result))
+
+    def server_stats(self):
+        result = dict(self.stats)
+        result['cpu_time'] = time.process_time()
+        result['trees'] = {name: {'subscribers': len(hosted.subscribers), 'seq': hosted.seq}
+                           for name, hosted in self.trees.items()}
+        return result
+
+    # ------------------------ WebSocket ------------------------
+    async def _handle_websocket(self, request, reader, writer):
+        method, path, query, headers, body = request
+        parts = [part for part in path.split("/") if part]
+        key = headers.get('sec-websocket-key')
+        if len(parts) != 4 or parts[:2] != ["api", "trees"] or parts[3] != "ws" or not key:
+            writer.write(encode_response(404, {'error': f"未知的路径: {path}"}))
+            return
+        try:
+            hosted = self.open_tree(parts[2])
+        except ApiError as e:
+            writer.write(encode_response(e.status, {'error': str(e)}))
+            return
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n").encode("latin-1"))
+        connection = Connection(writer)
+        self.stats['websockets'] += 1
+        try:
+            while True:
+                opcode, data = await read_message(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(data[:2], OP_CLOSE))
+                    break
+                if opcode == OP_PING:
+                    writer.write(encode_frame(data, OP_PONG))
+                    continue
+                self._handle_ws_request(hosted, connection, data)
+                # 请求方自己的写缓冲过大时暂停读取，避免一个客户端占满内存
+                await writer.drain()
+        finally:
+            hosted.subscribers.discard(connection)
+            self.stats['websockets'] -= 1
+
+    def _handle_ws_request(self, hosted, connection, data):
+        self.stats['requests'] += 1
+        request_id = None
+        try:
+            request = json.loads(data)
+            if not isinstance(request, dict):
+                raise ApiError(400, "消息必须是 JSON 对象")
+            request_id = request.get('id')
+            op = request.get('op')
+            if op == 'subscribe':
+                connection.chunks = bool(request.get('chunks'))
+                hosted.subscribers.add(connection)
+                result = {'seq': hosted.seq, 'root': hosted.root.id}
+                if request.get('structure'):
+                    result['structure'] = tree_structure(hosted.root)
+            elif op == 'unsubscribe':
+                hosted.subscribers.discard(connection)
+                result = {}
+            else:
+                result = self.run_op(hosted, op, request)
+            reply = {'type': 'result', 'id': request_id, 'ok': True, 'result': result}
+        except ApiError as e:
+            reply = {'type': 'result', 'id': request_id, 'ok': False, 'status': e.status, 'error': str(e)}
+        except ValueError as e:
+            reply = {'type': 'result', 'id': request_id, 'ok': False, 'status': 400, 'error': str(e)}
+        except Exception as e:
+            logger.exception("处理 WebSocket 请求失败")
+            self.stats['errors'] += 1
+            reply = {'type': 'result', 'id': request_id, 'ok': False, 'status': 500, 'error': str(e)}
+        connection.send(encode_frame(json.dumps(reply, ensure_ascii=False)))
+
+    # ------------------------ 连接 ------------------------
+    async def _handle_connection(self, reader, writer):
+        self.stats['connections'] += 1
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ApiError as e:
+                    writer.write(encode_response(e.status, {'error': str(e)}, {'Connection': "close"}))
+                    break
+                if request is None:
+                    break
+                headers = request[3]
+                if headers.get('upgrade', "").lower() == "websocket":
+                    await self._handle_websocket(request, reader, writer)
+                    break
+                await self._handle_http(request, writer)
+                await writer.drain()
+                if headers.get('connection', "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ApiError):
+            pass
+        finally:
+            self.stats['connections'] -= 1
+            writer.close()
+
+    async def _autosave(self):
+        while True:
+            await asyncio.sleep(AUTOSAVE_INTERVAL)
+            await self.save_all_async()
+
+    async def start(self):
+        """开始监听，返回实际使用的端口"""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_BODY_BYTES, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"服务端已启动: http://{self.host}:{self.port}")
+        return self.port
+
+    async def serve_forever(self):
+        """启动并一直运行，退出时保存所有树"""
+        await self.start()
+        autosave = asyncio.create_task(self._autosave())
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            autosave.cancel()
+            self.save_all()
@@ -0,0 +1,603 @@
+import os
+import logging
+
+from core import tracing
+from core.archive import compress_cold_nodes
+from core.events import render_event
+from core.tree import Tree, TreeNode
+from core.generation import PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+from core.scheduler import RequestScheduler
+from core.records import DEFAULT_RECORDS_FILE, load_tree, save_tree, serialize_node, write_record
+from core.settings import Settings, apply_ai_model_settings
+
+logger = logging.getLogger(__name__)
+
+# 以该前缀开头的输入视为新建主题
+NEW_TOPIC_PREFIX = "新主题:"
+# 测速时发送的提示
+PROBE_PROMPT = "请用三句话介绍一下你自己。"
+
+
+class ChatService:
+    """
+    与界面无关的聊天树服务层
+
+    负责树的加载、保存、节点增删改以及调用 AI 模型，
+    图形界面和命令行都通过它操作树，本模块不依赖 tkinter。
+    """
+    def __init__(self, settings=None, ai_model=None, scheduler=None):
+        """
+        参数:
+            settings  - Settings 对象，为空时从默认配置文件加载
+            ai_model  - AIModel 对象，为空时在首次使用时才创建（避免启动时连接 Ollama）
+            scheduler - 与其他 ChatService 共用的 RequestScheduler，为空时按设置创建
+        """
+        self.settings = settings or Settings()
+        self.tree = Tree()
+        self._ai_model = ai_model
+        self._scheduler = scheduler
+        self._retriever = None
+        self._history = None
+        # 最近一次保存：绝对路径 -> (根节点的子树哈希, 文件修改时间, 文件大小)
+        self._saved = {}
+        # start_reply() 开始的生成：节点 ID -> (handle, 是否由工作线程写回)，同一节点同时只有一个
+        self._replies = {}
+
+    @property
+    def ai_model(self):
+        """延迟创建并按配置初始化 AIModel"""
+        if self._ai_model is None:
+            from core.ai_model import AIModel
+            self._ai_model = AIModel()
+            apply_ai_model_settings(self._ai_model, self.settings)
+        return self._ai_model
+
+    @property
+    def scheduler(self):
+        """所有流式生成共用的调度器"""
+        if self._scheduler is None:
+            self._scheduler = RequestScheduler(self.settings.max_concurrent_generations,
+                                               self.settings.reserved_interactive_slots)
+        return self._scheduler
+
+    @property
+    def retriever(self):
+        """跨分支检索器，首次使用时加载默认记录文件旁边的向量索引"""
+        if self._retriever is None:
+            from core.embeddings import EmbeddingClient, EmbeddingIndex
+            from core.retrieval import Retriever
+            model = self.settings.embedding_model
+            client = EmbeddingClient(self.ai_model.base_url, model)
+            self._retriever = Retriever(client, EmbeddingIndex.load(self.records_path, model))
+        return self._retriever
+
+    @retriever.setter
+    def retriever(self, retriever):
+        self._retriever = retriever
+
+    @property
+    def history(self):
+        """当前树的撤销 / 重做历史，打开或新建树后重新开始"""
+        if self._history is None or self._history.tree is not self.tree:
+            from core.history import History
+            self._history = History(self.tree, self.settings.history_limit)
+        return self._history
+
+    @property
+    def records_path(self):
+        """自动保存使用的记录文件路径"""
+        return os.path.join(self.settings.records_folder, DEFAULT_RECORDS_FILE)
+
+    # ------------------------ 加载与保存 ------------------------
+    def new_tree(self):
+        """丢弃当前树，创建一个新的空树"""
+        self.tree = Tree()
+        return self.tree
+
+    def load(self, file_path):
+        """
+        从记录文件加载树，替换当前树
+
+        参数:
+            file_path - 记录文件路径
+        """
+        with tracing.span("records.load"):
+            self.tree = load_tree(file_path)
+        return self.tree
+
+    def save(self, file_path=None, force=False):
+        """
+        保存整棵树
+
+        树的 Merkle 哈希与上次保存到同一文件时相同、且文件未被外部修改时跳过写入，
+        频繁的自动保存不会重复写出没有变化的记录。
+
+        参数:
+            file_path - 目标文件，为空时保存到默认记录文件
+            force     - 为 True 时总是写入
+
+        返回:
+            实际写入的文件路径
+        """
+        file_path, write = self.prepare_save(file_path, force)
+        if write is not None:
+            write()
+        return file_path
+
+    def prepare_save(self, file_path=None, force=False):
+        """
+        分两步保存：在修改树的线程中取得树的快照，返回的 write() 只写文件、不访问树，
+        可以交给其他线程执行（服务端用它避免写文件时阻塞事件循环）
+
+        参数与 save() 相同
+
+        返回:
+            (实际写入的文件路径, write)，记录未变化或已经直接保存（文件夹存储）时 write 为 None
+        """
+        from core.folder_store import is_folder_store
+        file_path = file_path or self.records_path
+        key = os.path.abspath(file_path)
+        if self.archive_cold_nodes()['nodes']:
+            # 压缩不改变哈希，但文件中的聊天记录需要换成压缩格式
+            force = True
+        root_hash = self.tree.root.subtree_hash()
+        if not force and self._saved.get(key) == (root_hash,) + _file_stamp(file_path):
+            logger.debug(f"记录未变化，跳过保存: {file_path}")
+            return file_path, None
+        if is_folder_store(file_path):
+            # 文件夹存储只写入有变化的节点，保存时需要访问树，直接在当前线程中进行
+            with tracing.span("records.save"):
+                save_tree(self.tree, file_path)
+            self._saved[key] = (root_hash,) + _file_stamp(file_path)
+            return file_path, None
+        data = serialize_node(self.tree.root)
+        dedup = self.settings.dedup_records
+
+        def write():
+            with tracing.span("records.save"):
+                write_record(data, file_path, dedup)
+            self._saved[key] = (root_hash,) + _file_stamp(file_path)
+
+        return file_path, write
+
+    def archive_cold_nodes(self, idle_seconds=None, codec=None):
+        """
+        压缩长时间未访问的节点的聊天记录（当前节点除外），访问时自动解压
+
+        参数:
+            idle_seconds - 时间窗口（秒），为空时使用设置中的 archive_after_minutes，为 0 时不压缩
+            codec        - 压缩格式，为空时使用设置中的 archive_codec
+
+        返回:
+            core.archive.compress_cold_nodes() 的结果
+        """
+        if idle_seconds is None:
+            if not self.settings.archive_after_minutes:
+                return {'nodes': 0, 'memory_before': 0, 'memory_after': 0, 'disk_before': 0, 'disk_after': 0}
+            idle_seconds = self.settings.archive_after_minutes * 60
+        with tracing.span("records.archive"):
+            result = compress_cold_nodes(self.tree.root, idle_seconds, codec or self.settings.archive_codec,
+                                         skip=[self.tree.get_current_node()])
+        if result['nodes']:
+            logger.info(f"已压缩 {result['nodes']} 个冷节点，内存 {result['memory_before']} -> "
+                        f"{result['memory_after']} 字节，文件 {result['disk_before']} -> {result['disk_after']} 字节")
+        return result
+
+    # ------------------------ 节点操作 ------------------------
+    def find_node(self, node_id):
+        """根据 ID 查找节点"""
+        return self.tree.find_node(node_id)
+
+    def append_chat(self, msg, node=None):
+        """
+        向节点追加一条聊天记录
+
+        参数:
+            msg  - 完整的记录文本（含 "你: " 等前缀和换行）
+            node - 目标节点，为空时使用当前节点
+        """
+        node = node or self.tree.get_current_node()
+        node.chats.append(msg)
+        return msg
+
+    def add_topic(self, topic):
+        """
+        在当前节点下创建新主题并切换过去
+
+        返回:
+            写入新节点的系统消息
+        """
+        with self.history.change(f"新建主题 '{_short(topic)}'"):
+            self.tree.add_topic(topic)
+            return self.append_chat(render_event('new_topic', topic=topic))
+
+    def add_child(self, parent_node, topic="新主题"):
+        """
+        为节点添加子节点，并在父节点中记录系统消息
+
+        返回:
+            新建的 TreeNode 对象
+        """
+        with self.history.change(f"添加子节点 '{_short(topic)}'"):
+            new_node = TreeNode(topic)
+            parent_node.add_child(new_node)
+            self.append_chat(render_event('add_child', parent=parent_node.topic, topic=topic), parent_node)
+        return new_node
+
+    def create_node_from_text(self, parent_node, text):
+        """
+        以一段文本为主题创建子节点
+
+        返回:
+            新建的 TreeNode 对象
+        """
+        with self.history.change("从文本创建节点"):
+            new_node = TreeNode(text)
+            parent_node.add_child(new_node)
+            self.append_chat(render_event('from_text', text=text, parent=parent_node.topic), parent_node)
+        return new_node
+
+    def delete_node(self, parent_node, node):
+        """
+        删除子节点，并在父节点中记录系统消息
+
+        返回:
+            写入父节点的系统消息
+        """
+        with self.history.change(f"删除节点 '{_short(node.topic)}'"):
+            parent_node.delete_child(node)
+            if self.tree.get_current_node() in node.walk():
+                self.tree.set_current_node(parent_node)
+            return self.append_chat(render_event('delete', topic=node.topic), parent_node)
+
+    def rename_node(self, node, new_name):
+        """
+        修改节点名称
+
+        返回:
+            写入该节点的系统消息
+        """
+        with self.history.change(f"重命名为 '{_short(new_name)}'"):
+            node.topic = new_name
+            return self.append_chat(render_event('rename', topic=node.topic), node)
+
+    def move_node(self, node, new_parent, index=None):
+        """
+        把节点及其子树移动到新的父节点下，并在新父节点中记录系统消息
+
+        参数:
+            node       - 要移动的节点（不能是根节点）
+            new_parent - 新的父节点，不能是该节点或其后代
+            index      - 在新父节点子节点中的位置，为空时放在最后
+
+        返回:
+            写入新父节点的系统消息
+        """
+        if node.parent is None:
+            raise ValueError("根节点不能移动")
+        with self.history.change(f"移动节点 '{_short(node.topic)}'"):
+            old_parent = node.move_to(new_parent, index)
+            return self.append_chat(render_event('move', topic=node.topic, parent=old_parent.topic), new_parent)
+
+    def copy_node(self, node, new_parent):
+        """
+        把节点及其子树复制到新的父节点下（使用新的节点 ID，聊天记录字符串与原节点共享）
+
+        返回:
+            复制出的子树根节点
+        """
+        with self.history.change(f"复制节点 '{_short(node.topic)}'"):
+            copy = node.copy()
+            new_parent.add_child(copy)
+            self.append_chat(render_event('copy', topic=node.topic), new_parent)
+        return copy
+
+    def merge_nodes(self, target, source):
+        """
+        把兄弟节点 source 合并到 target：聊天记录接在 target 之后，子节点移到 target 之下，然后移除 source
+
+        返回:
+            移到 target 下的子节点列表
+        """
+        with self.history.change(f"合并节点 '{_short(source.topic)}'"):
+            children = target.merge(source)
+            if self.tree.get_current_node() is source:
+                self.tree.set_current_node(target)
+            self.append_chat(render_event('merge', topic=source.topic), target)
+        return children
+
+    def import_records(self, parent, paths, workers=None, progress=None):
+        """
+        批量导入记录文件，各自作为 parent 的子节点（见 core.bulk_import）
+
+        参数:
+            parent   - 挂载到的节点
+            paths    - 记录文件或文件夹路径列表，文件夹中的 .json 文件全部导入
+            workers  - 解析用的工作进程数，为空时在当前进程中解析
+            progress - 可选的回调 progress(已完成的文件数, 总文件数, 该文件的结果)
+
+        返回:
+            core.bulk_import.import_records() 的结果
+        """
+        from core.bulk_import import find_record_files, import_records
+        files = find_record_files(paths)
+        with self.history.change(f"批量导入 {len(files)} 个记录文件"):
+            with tracing.span("records.bulk_import"):
+                report = import_records(parent, files, workers, progress)
+            if report['imported']:
+                self.append_chat(render_event('import', files=report['imported'], nodes=report['nodes']), parent)
+        return report
+
+    # ------------------------ 撤销与检查点 ------------------------
+    def undo(self):
+        """
+        撤销上一次节点操作（其后追加的聊天消息会先单独记录，因此会先被撤销）
+
+        返回:
+            被撤销的操作说明，没有可撤销的操作时返回 None
+        """
+        return self.history.undo()
+
+    def redo(self):
+        """重做上一次被撤销的操作，返回操作说明，没有可重做的操作时返回 None"""
+        return self.history.redo()
+
+    def checkpoint(self, name):
+        """把树的当前内容记录为命名检查点"""
+        self.history.checkpoint(name)
+
+    def restore_checkpoint(self, name):
+        """
+        回到命名检查点，恢复本身可以撤销
+
+        返回:
+            是否找到检查点
+        """
+        return self.history.restore(name)
+
+    # ------------------------ 聊天 ------------------------
+    def append_user_message(self, input_text, node=None):
+        """记录用户输入，返回写入的消息"""
+        return self.append_chat(f"你: {input_text}\n", node)
+
+    def generate_reply(self, input_text, node=None):
+        """
+        调用 AI 模型生成回复并记录到节点，阻塞直到生成结束
+
+        参数:
+            input_text - 用户输入（已由 append_user_message 写入节点，作为上下文的最后一条）
+            node       - 回复写入的节点，为空时使用当前节点（在调用时确定）
+
+        返回:
+            写入的回复消息
+        """
+        node = node or self.tree.get_current_node()
+        handle = self.start_reply(node)
+        try:
+            handle.wait()
+        except KeyboardInterrupt:
+            # 中断时保留已生成的部分，标记为已取消
+            handle.cancel()
+            handle.wait()
+        return handle.reply_msg
+
+    def start_reply(self, node=None, priority=PRIORITY_INTERACTIVE, on_chunk=None, on_done=None,
+                    model=None, options=None, retrieve=None, write_back=True):
+        """
+        以节点的对话为上下文开始一次可取消的流式生成，结束后回复写入该节点
+
+        参数:
+            node     - 上下文和回复所在的节点，为空时使用当前节点（在调用时确定）
+            priority - 生成优先级，见 core.generation
+            on_chunk - 回调 (handle, 文本片段)，在工作线程中调用
+            on_done  - 回调 (handle)，结束时在工作线程中调用
+            retrieve - 是否先从其他分支检索相关片段附加到上下文，为空时使用设置中的 enable_retrieval；
+                       检索在工作线程中进行，结果保存在 handle.retrieval
+            write_back - 为 False 时结束后不在工作线程中写入节点，由调用者在自己的线程中调用 finish_reply() 写入
+
+        返回:
+            GenerationHandle 对象
+
+        异常:
+            ValueError - 该节点上一次的生成尚未结束，两个回复会交错写入同一节点
+        """
+        node = node or self.tree.get_current_node()
+        if self.active_reply(node) is not None:
+            raise ValueError(f"节点 '{node.topic}' 的回复尚未生成完毕")
+        with tracing.span("send.context_build"):
+            messages = chats_to_messages(node.chats)
+        if retrieve is None:
+            retrieve = self.settings.enable_retrieval
+        prepare = (lambda handle: self.retrieve_context(handle, node)) if retrieve else None
+        handle = self.scheduler.submit(self.ai_model, messages, node if write_back else None, priority,
+                                       model, options, on_chunk, on_done, fair_key=self.tree.root.id, prepare=prepare)
+        self._replies[node.id] = (handle, write_back)
+        return handle
+
+    def active_reply(self, node):
+        """
+        节点上尚未结束的 start_reply() 生成，没有时返回 None；
+        write_back 为 False 的生成在 finish_reply() 写入回复之前都算未结束
+        """
+        entry = self._replies.get(node.id)
+        if entry is None:
+            return None
+        handle, write_back = entry
+        if write_back and handle.finished:
+            del self._replies[node.id]
+            return None
+        return handle
+
+    def finish_reply(self, handle, node):
+        """
+        把 start_reply(write_back=False) 生成的回复写入节点，之后该节点可以开始新的生成
+
+        返回:
+            写入的回复消息
+        """
+        if self._replies.get(node.id, (None,))[0] is handle:
+            del self._replies[node.id]
+        return self.append_chat(handle.reply_msg, node)
+
+    def retrieve_context(self, handle, node):
+        """
+        检索其他分支中与节点最后一条提问相关的片段，作为系统消息放在消息列表开头
+
+        检索失败（如未安装 numpy 或没有向量模型）时只记录警告，按原消息生成。
+
+        参数:
+            handle - GenerationHandle 对象，检索结果写入 handle.retrieval
+            node   - 提问所在的节点
+
+        返回:
+            实际发送的消息列表
+        """
+        settings = self.settings
+        try:
+            result = self.retriever.retrieve(node, scope=settings.retrieval_scope, k=settings.retrieval_top_k,
+                                             token_budget=settings.retrieval_token_budget)
+        except Exception as e:
+            logger.warning(f"跨分支检索失败，不附加参考内容: {e}")
+            return handle.messages
+        handle.retrieval = result
+        logger.info(result.summary())
+        if result.message is None:
+            return handle.messages
+        return [result.message] + handle.messages
+
+    def send_message(self, input_text):
+        """
+        处理一条输入：以 "新主题:" 开头时创建新主题，否则作为聊天消息发送给 AI 模型
+
+        返回:
+            本次写入的消息列表
+        """
+        if input_text.startswith(NEW_TOPIC_PREFIX):
+            topic = input_text[len(NEW_TOPIC_PREFIX):].strip()
+            return [self.add_topic(topic)]
+        node = self.tree.get_current_node()
+        user_msg = self.append_user_message(input_text, node)
+        reply_msg = self.generate_reply(input_text, node)
+        return [user_msg, reply_msg]
+
+    def probe_models(self, models=None, repeat=1, prompt=PROBE_PROMPT, num_predict=64, on_done=None):
+        """
+        依次用同一个提示测试各模型的速度，结果计入调度器的按模型统计（scheduler.model_stats()）
+
+        各模型逐个测试而不是并发，避免 Ollama 同时加载多个模型影响测量；
+        每个模型的第一次请求可能包含模型加载时间，可通过统计中的 load_time 区分。
+
+        参数:
+            models      - 模型名称列表，为空时测试所有可用模型
+            repeat      - 每个模型的请求次数
+            prompt      - 测试提示
+            num_predict - 每次最多生成的 token 数
+            on_done     - 回调 (handle)，每次请求结束时调用
+
+        返回:
+            所有请求的 GenerationHandle 列表
+        """
+        models = models or list(self.ai_model.get_available_models())
+        messages = [{'role': 'user', 'content': prompt}]
+        handles = []
+        for model in models:
+            for _ in range(repeat):
+                handle = self.scheduler.submit(self.ai_model, messages, None, PRIORITY_NORMAL, model,
+                                               {'num_predict': num_predict}, on_done=on_done, fair_key="probe")
+                handles.append(handle)
+                try:
+                    handle.wait()
+                except KeyboardInterrupt:
+                    handle.cancel()
+                    raise
+        return handles
+
+    # ------------------------ 查询 ------------------------
+    def search(self, keyword, node=None):
+        """
+        在节点主题和聊天记录中查找关键字（不区分大小写）
+
+        参数:
+            keyword - 关键字
+            node    - 搜索范围的根节点，为空时搜索整棵树
+
+        返回:
+            (主题路径列表, 节点, 命中的聊天记录或 None) 的列表，命中主题时第三项为 None
+        """
+        keyword = keyword.lower()
+        results = []
+        stack = [(node or self.tree.root, [])]
+        while stack:
+            current, path = stack.pop()
+            path = path + [current.topic]
+            if keyword in current.topic.lower():
+                results.append((path, current, None))
+            for chat in current.chats:
+                if keyword in chat.lower():
+                    results.append((path, current, chat))
+            for child in reversed(current.children):
+                stack.append((child, path))
+        return results
+
+    def stats(self, node=None):
+        """
+        统计节点数、消息数、最大深度以及各类消息数量
+
+        返回:
+            统计结果字典
+        """
+        result = {'nodes': 0, 'messages': 0, 'characters': 0, 'max_depth': 0,
+                  'user': 0, 'ai': 0, 'system': 0, 'other': 0}
+        stack = [(node or self.tree.root, 0)]
+        while stack:
+            current, depth = stack.pop()
+            result['nodes'] += 1
+            result['max_depth'] = max(result['max_depth'], depth)
+            for chat in current.chats:
+                result['messages'] += 1
+                result['characters'] += len(chat)
+                result[message_kind(chat)] += 1
+            stack.extend((child, depth + 1) for child in current.children)
+        return result
+
+
+def _short(text, length=20):
+    """用于操作说明的单行短文本"""
+    text = " ".join(text.split())
+    return text if len(text) <= length else text[:length] + "…"
+
+
+def _file_stamp(file_path):
+    """返回 (修改时间, 大小)，文件不存在时返回 (None, None)"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return (None, None)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def chats_to_messages(chats):
+    """
+    将节点的聊天记录转换为 Ollama 格式的消息列表
+
+    "你: " 开头的记录作为 user，"AI: " 开头的记录作为 assistant，系统消息不发送给模型
+    """
+    messages = []
+    for chat in chats:
+        kind = message_kind(chat)
+        if kind == 'user':
+            messages.append({'role': 'user', 'content': chat[len("你: "):].rstrip("\n")})
+        elif kind == 'ai':
+            messages.append({'role': 'assistant', 'content': chat[len("AI: "):].rstrip("\n")})
+    return messages
+
+
+def message_kind(chat):
+    """根据前缀判断消息类型：user / ai / system / other"""
+    if chat.startswith("你: "):
+        return 'user'
+    if chat.startswith("AI: "):
+        return 'ai'
+    if chat.startswith("系统: "):
+        return 'system'
+    return 'other'
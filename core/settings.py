@@ -0,0 +1,200 @@
+import configparser
+import os
+import shutil
+import logging
+try:
+    from appdirs import user_data_dir
+    USE_APPDIRS = True
+except ImportError:
+    USE_APPDIRS = False
+
+logger = logging.getLogger(__name__)
+
+# 程序目录中的默认配置文件
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "settings.ini")
+SECTION = '设置'
+
+
+def get_config_path(create=True):
+    """
+    获取配置文件路径
+
+    参数:
+        create - 为 True 时确保用户数据目录存在，并在缺少配置文件时从程序目录复制一份
+
+    返回:
+        settings.ini 的完整路径
+    """
+    if not USE_APPDIRS:
+        return DEFAULT_CONFIG_PATH
+    app_data_dir = user_data_dir("TreeChat", "TreeChat")
+    config_path = os.path.join(app_data_dir, "settings.ini")
+    if create:
+        os.makedirs(app_data_dir, exist_ok=True)
+        if not os.path.exists(config_path):
+            try:
+                if os.path.exists(DEFAULT_CONFIG_PATH):
+                    shutil.copy2(DEFAULT_CONFIG_PATH, config_path)
+            except Exception as e:
+                logger.warning(f"无法复制默认配置文件: {e}")
+    return config_path
+
+
+def default_records_folder():
+    """没有配置 records_folder 时使用的记录文件夹"""
+    if USE_APPDIRS:
+        return os.path.join(user_data_dir("TreeChat", "TreeChat"), "records")
+    return "records"
+
+
+def _parse_font(value):
+    font_parts = value.split(',')
+    return (font_parts[0], int(font_parts[1]))
+
+
+class Settings:
+    """
+    应用设置，与界面无关
+
+    FIELDS 中每一项为 (属性名, 配置项名, 读取方式, 默认值)，
+    读取失败时使用默认值，与原先 MainWindow.__init__ 中的逐项读取保持一致。
+    """
+    FIELDS = [
+        ('auto_switch', 'auto_switch_to_new_node', 'bool', True),
+        ('auto_save', 'auto_save_chat', 'bool', False),
+        ('records_folder', 'records_folder', 'str', None),
+        ('show_jump_alert', 'show_jump_alert', 'bool', True),
+        ('show_save_alert', 'show_save_alert', 'bool', True),
+        ('clear_on_jump', 'clear_on_jump', 'bool', True),
+        ('send_shortcut', 'send_shortcut', 'str', "Control-Enter"),
+        ('save_shortcut', 'save_shortcut', 'str', "Control-s"),
+        ('new_chat_shortcut', 'new_chat_shortcut', 'str', "Control-n"),
+        ('open_shortcut', 'open_shortcut', 'str', "Control-o"),
+        ('chat_font', 'chat_font', 'font', ('Microsoft YaHei UI', 10)),
+        ('input_font', 'input_font', 'font', ('Microsoft YaHei UI', 10)),
+        ('button_font_size', 'button_font_size', 'int', 10),
+        ('button_size', 'button_size', 'int', 80),
+        ('global_font_size', 'global_font_size', 'int', 10),
+        ('max_concurrent_generations', 'max_concurrent_generations', 'int', 4),
+        ('reserved_interactive_slots', 'reserved_interactive_slots', 'int', 1),
+        ('enable_tracing', 'enable_tracing', 'bool', False),
+        # 超过该分钟数未访问的节点压缩聊天记录，0 表示不压缩
+        ('archive_after_minutes', 'archive_after_minutes', 'int', 0),
+        ('archive_codec', 'archive_codec', 'str', "zlib"),
+        # 语义搜索使用的向量模型（需先 ollama pull）
+        ('embedding_model', 'embedding_model', 'str', "nomic-embed-text"),
+        # 生成前从其他分支检索相关片段附加到上下文，范围为 subtree（同一子树）或 tree（整棵树）
+        ('enable_retrieval', 'enable_retrieval', 'bool', False),
+        ('retrieval_scope', 'retrieval_scope', 'str', "subtree"),
+        ('retrieval_top_k', 'retrieval_top_k', 'int', 4),
+        ('retrieval_token_budget', 'retrieval_token_budget', 'int', 512),
+        # 撤销栈保留的版本数
+        ('history_limit', 'history_limit', 'int', 200),
+        # 同时打开的工作区（标签页）占用内存的上限（MB），超过时卸载最近最少使用的工作区
+        ('workspace_memory_mb', 'workspace_memory_mb', 'int', 512),
+        # 以去重格式保存记录文件：重复的文本只保存一次，系统消息只保存类型和参数（见 core.dedup）
+        ('dedup_records', 'dedup_records', 'bool', False),
+    ]
+
+    def __init__(self, config_path=None):
+        """
+        从配置文件加载设置
+
+        参数:
+            config_path - 配置文件路径，为空时使用 get_config_path()
+        """
+        self.config_path = config_path or get_config_path()
+        self.config = configparser.ConfigParser()
+        # 指定编码为 utf-8 避免 UnicodeDecodeError
+        self.config.read(self.config_path, encoding="utf-8")
+        for name, option, kind, default in self.FIELDS:
+            try:
+                if kind == 'bool':
+                    value = self.config.getboolean(SECTION, option)
+                elif kind == 'int':
+                    value = self.config.getint(SECTION, option)
+                elif kind == 'font':
+                    value = _parse_font(self.config.get(SECTION, option))
+                else:
+                    value = self.config.get(SECTION, option)
+            except Exception:
+                value = default
+            setattr(self, name, value)
+        if self.records_folder is None:
+            self.records_folder = default_records_folder()
+
+    def get(self, option, fallback=None):
+        """读取任意配置项的原始字符串"""
+        return self.config.get(SECTION, option, fallback=fallback)
+
+    def getboolean(self, option, fallback=False):
+        """读取布尔类型的配置项"""
+        try:
+            return self.config.getboolean(SECTION, option)
+        except Exception:
+            return fallback
+
+    def ensure_records_folder(self):
+        """
+        确保记录文件夹存在，无法创建时回退到程序目录下的 records
+
+        返回:
+            最终使用的记录文件夹
+        """
+        try:
+            if not os.path.exists(self.records_folder):
+                os.makedirs(self.records_folder)
+                logger.info(f"创建记录文件夹: {self.records_folder}")
+        except Exception as e:
+            logger.error(f"创建记录文件夹失败: {e}")
+            self.records_folder = "records"
+            if not os.path.exists(self.records_folder):
+                os.makedirs(self.records_folder)
+        return self.records_folder
+
+
+def apply_ai_model_settings(ai_model, settings):
+    """
+    将配置文件中的服务地址、模型和手动添加的模型列表应用到 AIModel
+
+    参数:
+        ai_model - AIModel 对象
+        settings - Settings 对象
+    """
+    config = settings.config
+    try:
+        # 首先加载服务地址
+        if config.has_option(SECTION, 'ollama_base_url'):
+            base_url = config.get(SECTION, 'ollama_base_url')
+            logger.info(f"从配置文件加载Ollama服务地址: {base_url}")
+            ai_model.set_base_url(base_url)
+
+        # 加载模型设置
+        if config.has_option(SECTION, 'ai_model'):
+            model_name = config.get(SECTION, 'ai_model')
+            logger.info(f"从配置文件加载AI模型: {model_name}")
+
+            # 先尝试刷新模型列表，但不强制执行测试
+            ai_model.load_available_models()
+
+            # 尝试设置模型
+            if not ai_model.set_model(model_name):
+                logger.warning(f"无法设置模型 {model_name}，使用默认模型")
+                # 如果失败，直接设置模型名称，让AIModel内部处理
+                ai_model.model = model_name
+                if model_name not in ai_model.available_models:
+                    ai_model.available_models.append(model_name)
+
+        # 加载手动添加的模型列表（如果存在）
+        if config.has_option(SECTION, 'manual_models'):
+            manual_models_str = config.get(SECTION, 'manual_models')
+            if manual_models_str:
+                for model in manual_models_str.split(','):
+                    model = model.strip()
+                    if model and model not in ai_model.available_models:
+                        ai_model.available_models.append(model)
+    except Exception as e:
+        logger.error(f"加载AI模型设置失败: {str(e)}")
+        # 使用默认设置
+        ai_model.set_model("gemma3n:e4b")  # 使用用户实际拥有的模型
+        ai_model.set_base_url("http://localhost:11434")
@@ -0,0 +1,220 @@
+"""
+轻量的分阶段耗时统计
+
+用法:
+    from core import tracing
+
+    with tracing.span("records.save"):
+        save_tree(tree, path)
+    tracing.record("generation.ttft", handle.ttft, model="gemma3n:e4b")
+
+    tracing.export("metrics.prom")   # Prometheus 文本格式的直方图
+    tracing.export("spans.jsonl")    # 最近的原始耗时记录，每行一个 JSON
+
+默认关闭，关闭时 span() 返回一个共享的空上下文管理器，record() 直接返回，
+热路径上只多一次属性判断。设置环境变量 TREECHAT_TRACE=1、在设置中开启 enable_tracing
+或调用 enable() 后开始统计。
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# 直方图的桶上限（秒），覆盖从控件插入到整次生成的耗时
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 保留的原始记录条数，用于 JSON lines 导出
+EVENT_WINDOW = 10000
+METRIC_NAME = "treechat_span_duration_seconds"
+
+
+class Histogram:
+    """累积的耗时直方图"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, fraction):
+        """按桶估计分位数（返回所在桶的上限，落在 +Inf 桶时返回最大值）"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+
+class _NullSpan:
+    """关闭统计时使用的空上下文管理器"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, labels):
+        self.tracer = tracer
+        self.name = name
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        if exc_type is not None:
+            self.labels = dict(self.labels, error=exc_type.__name__)
+        self.tracer.record(self.name, duration, **self.labels)
+        return False
+
+
+class Tracer:
+    """按 (名称, 标签) 聚合耗时的统计器，可在多个线程中同时使用"""
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._histograms = {}
+        self._events = deque(maxlen=EVENT_WINDOW)
+        self._lock = threading.Lock()
+
+    def span(self, name, **labels):
+        """返回记录 with 块耗时的上下文管理器"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, labels)
+
+    def record(self, name, seconds, **labels):
+        """记录一次已测得的耗时，seconds 为 None 时忽略"""
+        if not self.enabled or seconds is None:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            self._events.append((time.time(), name, labels, seconds))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._events.clear()
+
+    def histograms(self):
+        """返回 {(名称, 标签元组): Histogram} 的快照"""
+        with self._lock:
+            return dict(self._histograms)
+
+    def summary(self):
+        """
+        返回各阶段的汇总
+
+        返回:
+            [{'name', 'labels', 'count', 'sum', 'min', 'max', 'p50', 'p95'}]，按名称排序
+        """
+        rows = []
+        for (name, labels), histogram in sorted(self.histograms().items()):
+            rows.append({'name': name, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                         'min': histogram.min, 'max': histogram.max,
+                         'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95)})
+        return rows
+
+    def format_summary(self):
+        """将汇总格式化为便于阅读的多行文本"""
+        lines = []
+        for row in self.summary():
+            labels = ",".join(f"{k}={v}" for k, v in row['labels'].items())
+            name = f"{row['name']}{{{labels}}}" if labels else row['name']
+            lines.append(f"{name:<48} 次数 {row['count']:>6}  平均 {row['sum'] / row['count'] * 1000:9.2f}ms  "
+                         f"p50≤{row['p50'] * 1000:9.2f}ms  p95≤{row['p95'] * 1000:9.2f}ms  "
+                         f"最大 {row['max'] * 1000:9.2f}ms")
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        """返回 Prometheus 文本格式的直方图"""
+        lines = [f"# HELP {METRIC_NAME} TreeChat 各阶段耗时",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        for (name, labels), histogram in sorted(self.histograms().items()):
+            base = [f'span="{_escape(name)}"'] + [f'{k}="{_escape(v)}"' for k, v in labels]
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], histogram.counts):
+                cumulative += count
+                bucket_labels = ",".join(base + [f'le="{bound}"'])
+                lines.append(f"{METRIC_NAME}_bucket{{{bucket_labels}}} {cumulative}")
+            series = ",".join(base)
+            lines.append(f"{METRIC_NAME}_sum{{{series}}} {histogram.sum}")
+            lines.append(f"{METRIC_NAME}_count{{{series}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+
+    def write_jsonl(self, path):
+        """把最近的原始耗时记录写入 JSON lines 文件"""
+        with self._lock:
+            events = list(self._events)
+        with open(path, "w", encoding="utf-8") as f:
+            for timestamp, name, labels, seconds in events:
+                f.write(json.dumps({'ts': timestamp, 'span': name, 'labels': labels, 'seconds': seconds},
+                                   ensure_ascii=False, default=str) + "\n")
+
+    def export(self, path):
+        """按扩展名导出：.jsonl 为原始记录，其他为 Prometheus 文本格式"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith(".jsonl"):
+            self.write_jsonl(path)
+        else:
+            self.write_prometheus(path)
+        return path
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 进程内共用的统计器
+tracer = Tracer(enabled=os.environ.get("TREECHAT_TRACE", "") not in ("", "0"))
+
+
+def enable(enabled=True):
+    tracer.enabled = enabled
+
+
+def span(name, **labels):
+    if not tracer.enabled:
+        return _NULL_SPAN
+    return _Span(tracer, name, labels)
+
+
+def record(name, seconds, **labels):
+    if tracer.enabled:
+        tracer.record(name, seconds, **labels)
+
+
+def export(path):
+    return tracer.export(path)
@@ -1,22 +1,220 @@
+import hashlib
+import threading
+import time
 import uuid
 
+from core.archive import DEFAULT_CODEC, MIN_PACK_BYTES, pack_chats, unpack_chats
+
+# 保护哈希缓存：生成线程追加回复时会使哈希失效，同时界面线程可能正在计算哈希
+_hash_lock = threading.RLock()
+
+
+def _encode(text):
+    data = text.encode("utf-8")
+    return len(data).to_bytes(8, "big") + data
+
+
+class ChatList(list):
+    """
+    节点的聊天记录列表
+
+    与普通列表用法相同，任何修改都会使所属节点及其祖先的哈希失效；
+    追加消息时增量更新聊天记录的摘要，不需要重新计算整个节点。
+    """
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner, chats=()):
+        super().__init__(chats)
+        self._owner = owner
+
+    def append(self, chat):
+        with _hash_lock:
+            if self._owner._chats is not self:
+                # 取得列表后节点被压缩（生成线程写回回复时可能发生），追加到解压后的新列表
+                self._owner.chats.append(chat)
+                return
+            super().append(chat)
+            self._owner._chat_appended(chat)
+
+    def _changed(self):
+        self._owner._content_changed()
+
+    def extend(self, chats):
+        with _hash_lock:
+            super().extend(chats)
+            self._changed()
+
+    def insert(self, index, chat):
+        with _hash_lock:
+            super().insert(index, chat)
+            self._changed()
+
+    def remove(self, chat):
+        with _hash_lock:
+            super().remove(chat)
+            self._changed()
+
+    def pop(self, index=-1):
+        with _hash_lock:
+            chat = super().pop(index)
+            self._changed()
+            return chat
+
+    def clear(self):
+        with _hash_lock:
+            super().clear()
+            self._changed()
+
+    def sort(self, *args, **kwargs):
+        with _hash_lock:
+            super().sort(*args, **kwargs)
+            self._changed()
+
+    def reverse(self):
+        with _hash_lock:
+            super().reverse()
+            self._changed()
+
+    def __setitem__(self, index, value):
+        with _hash_lock:
+            super().__setitem__(index, value)
+            self._changed()
+
+    def __delitem__(self, index):
+        with _hash_lock:
+            super().__delitem__(index)
+            self._changed()
+
+    def __iadd__(self, chats):
+        self.extend(chats)
+        return self
+
+    def __imul__(self, count):
+        with _hash_lock:
+            super().__imul__(count)
+            self._changed()
+        return self
+
+
 class TreeNode:
     """
     树节点类，用于表示聊天记录的层次结构
     
     每个节点包含一个主题、唯一的ID、子节点列表和聊天记录
+
+    subtree_hash() 返回整棵子树的 Merkle 哈希（由节点 ID、主题、聊天记录和子节点的哈希计算），
+    结果会被缓存；修改主题、聊天记录或通过 add_child / delete_child 修改子节点时，
+    本节点和所有祖先的缓存沿 parent 链失效，未修改的子树不需要重新计算。
+    直接修改 id 或 children 列表后需调用 invalidate()。
+
+    move_to() / copy() / merge() 移动、复制子树和合并兄弟节点，复制出的节点与原节点共享聊天记录字符串。
+
+    compress() 把聊天记录压缩保存（见 core.archive），之后访问 chats 时自动解压；
+    last_access 为最近一次 touch() 或解压的时间（time.monotonic()），用于判断冷节点。
     """
-    def __init__(self, topic):
+    def __init__(self, topic, node_id=None):
         """
         初始化一个新的树节点
 
         参数:
-            topic - 节点的话题（类似文件夹名称）
+            topic   - 节点的话题（类似文件夹名称）
+            node_id - 节点 ID（从记录文件还原时使用），为空时生成新的唯一 ID
         """
-        self.id = str(uuid.uuid4())  # 为每个节点生成唯一 ID
-        self.topic = topic
+        self.id = node_id or str(uuid.uuid4())  # 为每个节点生成唯一 ID
+        self.parent = None
+        self._topic = topic
         self.children = []
-        self.chats = []  # 保存该节点下的聊天记录
+        self._chats = ChatList(self)  # 保存该节点下的聊天记录，压缩后为 None
+        self._packed = None  # 压缩后的聊天记录（PackedChats）
+        self.last_access = time.monotonic()
+        self._chats_digest = None  # 聊天记录的增量摘要（hashlib 对象），尚未计算时为 None
+        self._content_hash = None
+        self._hash = None
+
+    @property
+    def topic(self):
+        return self._topic
+
+    @topic.setter
+    def topic(self, topic):
+        with _hash_lock:
+            self._topic = topic
+            self._content_hash = None
+            self._invalidate_hash()
+
+    @property
+    def chats(self):
+        chats = self._chats
+        if chats is None:
+            chats = self.decompress()
+        return chats
+
+    @chats.setter
+    def chats(self, chats):
+        with _hash_lock:
+            self._chats = ChatList(self, chats)
+            self._packed = None
+            self._content_changed()
+
+    # ------------------------ 压缩 ------------------------
+    @property
+    def is_compressed(self):
+        return self._chats is None
+
+    @property
+    def packed_chats(self):
+        """压缩后的聊天记录（PackedChats），未压缩时为 None"""
+        return self._packed
+
+    def peek_chats(self):
+        """读取聊天记录但不改变压缩状态：已压缩的节点返回临时解压的列表（修改它不会影响节点）"""
+        packed = self._packed
+        if packed is not None:
+            return unpack_chats(packed)
+        return self.chats
+
+    def set_packed_chats(self, packed):
+        """直接设置压缩后的聊天记录（从记录文件加载时使用），第一次访问 chats 时才解压"""
+        with _hash_lock:
+            self._chats = None
+            self._packed = packed
+            self._content_changed()
+
+    def touch(self):
+        """记录一次访问，刚访问过的节点不会被压缩"""
+        self.last_access = time.monotonic()
+
+    def compress(self, codec=DEFAULT_CODEC):
+        """
+        压缩本节点的聊天记录
+
+        参数:
+            codec - 'zlib' 或 'lzma'
+
+        返回:
+            PackedChats 对象；已压缩、没有聊天记录或内容太短不值得压缩时返回 None
+        """
+        with _hash_lock:
+            if self._chats is None or not self._chats:
+                return None
+            packed = pack_chats(self._chats, codec)
+            if packed.size < MIN_PACK_BYTES or len(packed.data) >= packed.size:
+                return None
+            # 摘要随压缩数据保存，压缩后计算哈希不需要解压
+            packed.digest = self._digest_chats()
+            self._packed = packed
+            self._chats = None
+            return packed
+
+    def decompress(self):
+        """解压聊天记录（未压缩时直接返回），返回聊天记录列表"""
+        with _hash_lock:
+            if self._chats is None:
+                # 内容不变，摘要和哈希缓存仍然有效
+                self._chats = ChatList(self, unpack_chats(self._packed))
+                self._packed = None
+                self.last_access = time.monotonic()
+            return self._chats
 
     def add_child(self, child):
         """
@@ -25,7 +223,10 @@ class TreeNode:
         参数:
             child - 新的子 TreeNode 对象
         """
-        self.children.append(child)
+        with _hash_lock:
+            self.children.append(child)
+            child.parent = self
+            self._invalidate_hash()
 
     def delete_child(self, child):
         """
@@ -34,7 +235,198 @@ class TreeNode:
         参数:
             child - 要删除的子 TreeNode 对象
         """
-        self.children.remove(child)
+        with _hash_lock:
+            self.children.remove(child)
+            child.parent = None
+            self._invalidate_hash()
+
+    def insert_child(self, index, child):
+        """
+        在指定位置插入子节点
+
+        参数:
+            index - 插入位置，与 list.insert 相同
+            child - 新的子 TreeNode 对象
+        """
+        with _hash_lock:
+            self.children.insert(index, child)
+            child.parent = self
+            self._invalidate_hash()
+
+    # ------------------------ 子树操作 ------------------------
+    def is_ancestor_of(self, node):
+        """本节点是否为 node 或其祖先"""
+        while node is not None:
+            if node is self:
+                return True
+            node = node.parent
+        return False
+
+    def move_to(self, new_parent, index=None):
+        """
+        把本节点及其子树移动到 new_parent 下
+
+        只修改两处父子关系，子树内部不做任何改动（子树哈希缓存仍然有效），
+        只有新旧父节点到根节点路径上的哈希失效。
+
+        参数:
+            new_parent - 新的父节点，不能是本节点或其后代
+            index      - 在新父节点子节点中的位置，为空时放在最后
+
+        返回:
+            原来的父节点
+        """
+        if self.is_ancestor_of(new_parent):
+            raise ValueError("不能把节点移动到自身或其后代之下")
+        with _hash_lock:
+            old_parent = self.parent
+            if old_parent is not None:
+                old_parent.delete_child(self)
+            if index is None:
+                new_parent.add_child(self)
+            else:
+                new_parent.insert_child(index, self)
+            return old_parent
+
+    def copy(self):
+        """
+        深复制本节点及其子树，复制出的节点使用新的 ID
+
+        聊天记录字符串不复制，与原节点共享（字符串不可变）；已压缩的节点共享压缩数据，不需要解压。
+
+        返回:
+            复制出的子树根节点（没有父节点）
+        """
+        with _hash_lock:
+            root = None
+            stack = [(self, None)]
+            while stack:
+                node, parent = stack.pop()
+                copy = TreeNode(node._topic)
+                if node._packed is not None:
+                    copy._chats = None
+                    copy._packed = node._packed
+                else:
+                    copy._chats = ChatList(copy, node._chats)
+                    if node._chats_digest is not None:
+                        # 聊天记录的摘要与节点 ID 无关，可以直接沿用
+                        copy._chats_digest = node._chats_digest.copy()
+                if parent is None:
+                    root = copy
+                else:
+                    parent.children.append(copy)
+                    copy.parent = parent
+                stack.extend((child, copy) for child in reversed(node.children))
+            return root
+
+    def merge(self, sibling):
+        """
+        把兄弟节点合并到本节点：其聊天记录接在本节点之后，其子节点移到本节点之下，然后移除该兄弟节点
+
+        参数:
+            sibling - 与本节点父节点相同的另一个节点
+
+        返回:
+            移过来的子节点列表
+        """
+        if sibling is self or sibling.parent is None or sibling.parent is not self.parent:
+            raise ValueError("只能合并同一父节点下的两个不同节点")
+        with _hash_lock:
+            self.chats.extend(sibling.chats)
+            children = list(sibling.children)
+            for child in children:
+                child.move_to(self)
+            self.parent.delete_child(sibling)
+            return children
+
+    # ------------------------ Merkle 哈希 ------------------------
+    def _invalidate_hash(self):
+        """清除本节点和祖先的子树哈希缓存"""
+        node = self
+        while node is not None and node._hash is not None:
+            # 有缓存的节点的所有后代也都有缓存，遇到已失效的祖先即可停止
+            node._hash = None
+            node = node.parent
+
+    def _content_changed(self):
+        self._chats_digest = None
+        self._content_hash = None
+        self._invalidate_hash()
+
+    def _chat_appended(self, chat):
+        if self._chats_digest is not None:
+            self._chats_digest.update(_encode(chat))
+        self._content_hash = None
+        self._invalidate_hash()
+
+    def invalidate(self):
+        """清除本节点的全部哈希缓存及祖先的子树哈希缓存"""
+        with _hash_lock:
+            node = self
+            self._content_changed()
+            while node is not None:
+                node._hash = None
+                node = node.parent
+
+    def _digest_chats(self):
+        """聊天记录的摘要（bytes）"""
+        if self._chats_digest is not None:
+            return self._chats_digest.digest()
+        if self._packed is not None and self._packed.digest is not None:
+            # 从记录文件加载的压缩节点，不需要解压
+            return self._packed.digest
+        self._chats_digest = hashlib.sha256()
+        for chat in self.chats:
+            self._chats_digest.update(_encode(chat))
+        return self._chats_digest.digest()
+
+    def content_hash(self):
+        """本节点自身内容（ID、主题、聊天记录）的哈希，十六进制字符串"""
+        with _hash_lock:
+            if self._content_hash is None:
+                digest = hashlib.sha256()
+                digest.update(_encode(self.id))
+                digest.update(_encode(self._topic))
+                digest.update(self._digest_chats())
+                self._content_hash = digest.hexdigest()
+            return self._content_hash
+
+    def subtree_hash(self):
+        """
+        整棵子树的 Merkle 哈希，十六进制字符串
+
+        两棵子树的哈希相同即可认为内容完全相同（包括节点 ID 和子节点顺序）。
+        """
+        with _hash_lock:
+            if self._hash is not None:
+                return self._hash
+            # 后序计算，避免深层的树触发递归深度限制
+            stack = [(self, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if node._hash is not None:
+                    continue
+                if not expanded:
+                    stack.append((node, True))
+                    stack.extend((child, False) for child in node.children if child._hash is None)
+                    continue
+                digest = hashlib.sha256(node.content_hash().encode("ascii"))
+                for child in node.children:
+                    digest.update(child._hash.encode("ascii"))
+                node._hash = digest.hexdigest()
+            return self._hash
+
+    def walk(self):
+        """
+        以先序遍历的方式依次返回本节点及其所有后代节点
+
+        使用显式栈而非递归，深层的树也不会触发递归深度限制
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
 
     def __str__(self, level=0):
         """
@@ -102,3 +494,18 @@ class Tree:
             node - 要设置为当前节点的 TreeNode 对象
         """
         self.current_node = node
+
+    def find_node(self, node_id):
+        """
+        根据节点 ID 查找节点
+
+        参数:
+            node_id - 节点的唯一 ID
+
+        返回:
+            找到的 TreeNode 对象，否则返回 None
+        """
+        for node in self.root.walk():
+            if node.id == node_id:
+                return node
+        return None
@@ -0,0 +1,266 @@
+"""
+同时打开的多棵聊天树（工作区）
+
+每个工作区对应一个记录文件和一个 ChatService，界面中显示为一个标签页。已加载的工作区一直留在内存中，
+切换回来时不需要重新读取文件；所有已加载的树估计占用的内存超过上限（workspace_memory_mb）时，
+按最近使用的时间从旧到新卸载：有修改的先写回记录文件，再丢弃树，之后切换到该工作区时重新加载。
+当前工作区和仍有生成在进行的工作区不会被卸载。所有工作区共用一个生成调度器。
+
+启动时的工作区（new()）保存到默认记录文件，与只有一棵树时的行为相同；打开的记录文件（open()）在用户确认
+（overwrite 为 True，手动保存一次也视为确认）之前不会被写回，有修改的此类工作区也不会被卸载。
+"""
+import os
+import time
+import logging
+
+from core import tracing
+from core.memory import cached_subtree_bytes
+from core.scheduler import RequestScheduler
+from core.service import ChatService
+
+logger = logging.getLogger(__name__)
+
+
+class Workspace:
+    """一个打开的记录文件，service 为空表示已被卸载"""
+    def __init__(self, path, service=None):
+        self.path = os.path.abspath(path)
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.service = service
+        self.last_used = time.monotonic()
+        # 估计的内存占用（字节），以及按子树哈希缓存的各子树大小
+        self.bytes = 0
+        self._sizes = {}
+        # 加载或保存后的根节点子树哈希，与当前哈希不同时卸载前需要写回
+        self.saved_hash = None
+        # 是否允许写回 path：None 为尚未询问，False 为用户拒绝了自动保存覆盖该文件
+        self.overwrite = None
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def loaded(self):
+        return self.service is not None
+
+    @property
+    def tree(self):
+        return self.service.tree if self.service is not None else None
+
+    def __repr__(self):
+        return f"Workspace({self.name!r}, loaded={self.loaded})"
+
+
+class WorkspaceManager:
+    """
+    管理多个工作区，按内存上限卸载最近最少使用的工作区
+
+    界面只通过 active 工作区的 service 操作树；切换、打开、关闭工作区以及每次修改后调用 enforce_limit()。
+    """
+    def __init__(self, settings, ai_model=None, memory_limit=None):
+        """
+        参数:
+            settings     - Settings 对象
+            ai_model     - 所有工作区共用的 AIModel，为空时由各 ChatService 延迟创建
+            memory_limit - 内存上限（字节），为空时使用设置中的 workspace_memory_mb，为 0 时不限制
+        """
+        self.settings = settings
+        self.ai_model = ai_model
+        if memory_limit is None:
+            memory_limit = settings.workspace_memory_mb * 1024 * 1024
+        self.memory_limit = memory_limit
+        self.workspaces = []
+        self.active = None
+        self._scheduler = None
+
+    @property
+    def scheduler(self):
+        """所有工作区共用的调度器"""
+        if self._scheduler is None:
+            self._scheduler = RequestScheduler(self.settings.max_concurrent_generations,
+                                               self.settings.reserved_interactive_slots)
+        return self._scheduler
+
+    def _create_service(self):
+        return ChatService(self.settings, self.ai_model, self.scheduler)
+
+    def find(self, path):
+        """按记录文件路径查找已打开的工作区"""
+        path = os.path.abspath(path)
+        for workspace in self.workspaces:
+            if workspace.path == path:
+                return workspace
+        return None
+
+    # ------------------------ 打开与切换 ------------------------
+    def new(self, path, activate=True):
+        """
+        打开一个空树的工作区，保存时写入 path（该路径已打开时直接切换过去）
+
+        返回:
+            Workspace 对象
+        """
+        workspace = self.find(path)
+        if workspace is None:
+            # saved_hash 为空：即使没有修改，卸载前也写出，重新加载时得到的是这棵树而不是文件中原有的内容
+            workspace = Workspace(path, self._create_service())
+            workspace.overwrite = True
+            self.workspaces.append(workspace)
+        if activate:
+            self.activate(workspace)
+        return workspace
+
+    def open(self, path, activate=True):
+        """
+        打开记录文件，已打开时直接切换过去
+
+        返回:
+            Workspace 对象
+        """
+        workspace = self.find(path)
+        if workspace is None:
+            workspace = Workspace(path)
+            self._load(workspace)
+            self.workspaces.append(workspace)
+        if activate:
+            self.activate(workspace)
+        return workspace
+
+    def _load(self, workspace):
+        service = self._create_service()
+        with tracing.span("workspace.load"):
+            if os.path.exists(workspace.path):
+                service.load(workspace.path)
+            else:
+                # 从未保存过的工作区
+                service.new_tree()
+        workspace.service = service
+        workspace.saved_hash = service.tree.root.subtree_hash()
+        workspace.loads += 1
+
+    def activate(self, workspace):
+        """
+        切换到工作区，已卸载时重新加载，然后按内存上限卸载其他工作区
+
+        返回:
+            该工作区的 ChatService
+        """
+        if not workspace.loaded:
+            self._load(workspace)
+            logger.info(f"重新加载工作区 {workspace.name}")
+        workspace.last_used = time.monotonic()
+        self.active = workspace
+        self.enforce_limit()
+        return workspace.service
+
+    def close(self, workspace, save=True):
+        """
+        关闭工作区，save 为 True 时先写回有修改的内容；关闭当前工作区后切换到相邻的工作区
+
+        返回:
+            新的当前工作区，没有其他工作区时为 None
+        """
+        if save and workspace.loaded:
+            self.flush(workspace)
+        index = self.workspaces.index(workspace)
+        self.workspaces.remove(workspace)
+        workspace.service = None
+        if workspace is self.active:
+            self.active = None
+            if self.workspaces:
+                self.activate(self.workspaces[min(index, len(self.workspaces) - 1)])
+        return self.active
+
+    # ------------------------ 保存与卸载 ------------------------
+    def is_dirty(self, workspace):
+        """工作区的树在上次加载或保存后是否有修改"""
+        return workspace.loaded and workspace.tree.root.subtree_hash() != workspace.saved_hash
+
+    def save(self, workspace=None, file_path=None, force=False):
+        """
+        保存工作区（默认为当前工作区），写入工作区自己的记录文件后 overwrite 置为 True
+
+        参数:
+            file_path - 另存为的文件，为空时写入工作区自己的记录文件
+            force     - 为 True 时总是写入
+
+        返回:
+            实际写入的文件路径
+        """
+        workspace = workspace or self.active
+        file_path = workspace.service.save(file_path or workspace.path, force)
+        if os.path.abspath(file_path) == workspace.path:
+            workspace.saved_hash = workspace.tree.root.subtree_hash()
+            workspace.overwrite = True
+        return file_path
+
+    def flush(self, workspace):
+        """有修改时写回记录文件，返回是否写入"""
+        if not self.is_dirty(workspace):
+            return False
+        self.save(workspace)
+        return True
+
+    def save_all(self):
+        """写回所有有修改的已加载工作区，返回写入的数量"""
+        return sum(self.flush(workspace) for workspace in self.workspaces if workspace.loaded)
+
+    def is_busy(self, workspace):
+        """工作区是否有正在运行或排队的生成"""
+        if not workspace.loaded or self._scheduler is None:
+            return False
+        root = workspace.tree.root
+        for handle in self._scheduler.pending():
+            node = handle.node
+            while node is not None and node.parent is not None:
+                node = node.parent
+            if node is root:
+                return True
+        return False
+
+    def measure(self, workspace):
+        """估计已加载工作区占用的内存（字节），只重新计算上次之后修改过的子树"""
+        if workspace.loaded:
+            workspace.bytes = cached_subtree_bytes(workspace.tree.root, workspace._sizes)
+        else:
+            workspace.bytes = 0
+        return workspace.bytes
+
+    def evict(self, workspace):
+        """写回并卸载工作区，之后切换过去时重新加载"""
+        with tracing.span("workspace.evict"):
+            self.flush(workspace)
+            workspace.service = None
+            workspace._sizes = {}
+            workspace.bytes = 0
+            workspace.evictions += 1
+        logger.info(f"已卸载工作区 {workspace.name}")
+
+    def enforce_limit(self):
+        """
+        所有已加载工作区的内存超过上限时，从最久未使用的开始卸载，直到不超过上限或没有可卸载的工作区
+
+        返回:
+            被卸载的工作区列表
+        """
+        if not self.memory_limit:
+            return []
+        loaded = [workspace for workspace in self.workspaces if workspace.loaded]
+        total = sum(self.measure(workspace) for workspace in loaded)
+        evicted = []
+        for workspace in sorted(loaded, key=lambda w: w.last_used):
+            if total <= self.memory_limit:
+                break
+            if workspace is self.active or self.is_busy(workspace):
+                continue
+            if not workspace.overwrite and self.is_dirty(workspace):
+                # 卸载前需要写回，但用户还没有同意覆盖打开的文件
+                continue
+            total -= workspace.bytes
+            self.evict(workspace)
+            evicted.append(workspace)
+        return evicted
+
+    def stats(self):
+        """返回各工作区的状态：[{'name', 'path', 'loaded', 'active', 'bytes', 'loads', 'evictions'}]"""
+        return [{'name': w.name, 'path': w.path, 'loaded': w.loaded, 'active': w is self.active,
+                 'bytes': w.bytes, 'loads': w.loads, 'evictions': w.evictions} for w in self.workspaces]
@@ -17,24 +17,46 @@ except ImportError:
     USE_CUSTOMTKINTER = False
 
 import configparser
-import os, json, time
+import os, time
 import logging
-try:
-    from appdirs import user_data_dir
-    USE_APPDIRS = True
-except ImportError:
-    USE_APPDIRS = False
+import queue
+import threading
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-from core.tree import Tree, TreeNode
+from core import tracing
 from core.ai_model import AIModel
+from core.bulk_import import format_import_report
+from core.export import write_export
+from core.fanout import FanOut, default_variants
+from core.records import DEFAULT_RECORDS_FILE
+from core.service import NEW_TOPIC_PREFIX
+from core.settings import Settings, get_config_path, apply_ai_model_settings
+from core.workspace import WorkspaceManager
 from config.shortcuts import INPUT_SHORTCUTS, MAIN_SHORTCUTS, CHAT_SHORTCUTS
 
+# 检查冷节点的间隔（毫秒）
+ARCHIVE_INTERVAL_MS = 60 * 1000
+
 class MainWindow:
+    @property
+    def service(self):
+        """当前工作区（标签页）的服务层"""
+        return self.workspaces.active.service
+
+    @property
+    def tree(self):
+        """当前打开的树，由服务层持有"""
+        return self.service.tree
+
+    @tree.setter
+    def tree(self, tree):
+        self.service.tree = tree
+
     def __init__(self, root):
+        startup_started = time.perf_counter()
         self.root = root
         self.root.title("TreeChat")
         self.root.geometry("2400x2000")  # 设置窗口大小
@@ -48,11 +70,25 @@ class MainWindow:
         file_menu = tk.Menu(menubar, tearoff=0, font=('Microsoft YaHei UI', 15))
         file_menu.add_command(label="新建聊天", command=self.new_chat_record)
         file_menu.add_command(label="打开历史聊天记录", command=self.open_chat_records)
+        file_menu.add_command(label="批量导入聊天记录", command=self.bulk_import_records)
         file_menu.add_command(label="保存聊天记录", command=self.save_chat_records)
         file_menu.add_command(label="另存为", command=self.save_chat_records_as)
+        file_menu.add_command(label="关闭当前工作区", command=self.close_workspace)
+        file_menu.add_command(label="导出为 Markdown / HTML", command=self.export_document)
+        file_menu.add_command(label="导出性能统计", command=self.export_tracing)
         file_menu.add_separator()
         file_menu.add_command(label="退出", command=self.root.quit)
         menubar.add_cascade(label="文件", menu=file_menu)
+        edit_menu = tk.Menu(menubar, tearoff=0, font=('Microsoft YaHei UI', 15))
+        edit_menu.add_command(label="撤销节点操作", command=self.undo_node_operation)
+        edit_menu.add_command(label="重做节点操作", command=self.redo_node_operation)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="创建检查点", command=self.create_checkpoint)
+        edit_menu.add_command(label="恢复检查点", command=self.restore_checkpoint)
+        menubar.add_cascade(label="编辑", menu=edit_menu)
+        tools_menu = tk.Menu(menubar, tearoff=0, font=('Microsoft YaHei UI', 15))
+        tools_menu.add_command(label="性能面板", command=self.open_perf_panel)
+        menubar.add_cascade(label="工具", menu=tools_menu)
         self.root.config(menu=menubar)
 
         # 设置按钮字体大小，默认为20
@@ -66,121 +102,40 @@ class MainWindow:
             self.settings_button = tk.Button(self.root, text="设置", command=self.open_settings_dialog, font=settings_button_font)
         self.settings_button.pack(anchor="nw", padx=5, pady=5)
 
-        # 获取配置文件路径
-        if USE_APPDIRS:
-            # 使用用户数据目录存储配置
-            app_data_dir = user_data_dir("TreeChat", "TreeChat")
-            config_path = os.path.join(app_data_dir, "settings.ini")
-            # 确保目录存在
-            os.makedirs(app_data_dir, exist_ok=True)
-            # 如果用户数据目录中没有配置文件，从程序目录复制
-            if not os.path.exists(config_path):
-                try:
-                    # 尝试从程序目录复制配置文件
-                    default_config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "settings.ini")
-                    if os.path.exists(default_config_path):
-                        import shutil
-                        shutil.copy2(default_config_path, config_path)
-                except Exception as e:
-                    logger.warning(f"无法复制默认配置文件: {e}")
-        else:
-            # 使用程序目录中的配置文件
-            config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "settings.ini")
-        
-        logger.info(f"配置文件路径: {config_path}")
-        
-        # 加载配置文件，指定编码为 utf-8 避免 UnicodeDecodeError
-        config = configparser.ConfigParser()
-        config.read(config_path, encoding="utf-8")
-        try:
-            self.auto_switch = config.getboolean('设置', 'auto_switch_to_new_node')
-        except Exception:
-            self.auto_switch = True
-        try:
-            self.auto_save = config.getboolean('设置', 'auto_save_chat')
-        except Exception:
-            self.auto_save = False
-        try:
-            self.records_folder = config.get('设置', 'records_folder')
-        except Exception:
-            # 使用用户数据目录存储记录
-            if USE_APPDIRS:
-                self.records_folder = os.path.join(user_data_dir("TreeChat", "TreeChat"), "records")
-            else:
-                self.records_folder = "records"
-        try:
-            self.show_jump_alert = config.getboolean('设置', 'show_jump_alert')
-        except Exception:
-            self.show_jump_alert = True
-        try:
-            self.show_save_alert = config.getboolean('设置', 'show_save_alert')
-        except Exception:
-            self.show_save_alert = True
-        try:
-            self.clear_on_jump = config.getboolean('设置', 'clear_on_jump')
-        except Exception:
-            self.clear_on_jump = True
-        try:
-            self.send_shortcut = config.get('设置', 'send_shortcut')
-        except Exception:
-            self.send_shortcut = "Control-Enter"
-        try:
-            self.save_shortcut = config.get('设置', 'save_shortcut')
-        except Exception:
-            self.save_shortcut = "Control-s"
-        try:
-            self.new_chat_shortcut = config.get('设置', 'new_chat_shortcut')
-        except Exception:
-            self.new_chat_shortcut = "Control-n"
-        try:
-            self.open_shortcut = config.get('设置', 'open_shortcut')
-        except Exception:
-            self.open_shortcut = "Control-o"
-        # 尝试从配置文件加载字体设置
-        try:
-            chat_font_str = config.get('设置', 'chat_font')
-            font_parts = chat_font_str.split(',')
-            self.chat_font = (font_parts[0], int(font_parts[1]))
-        except Exception:
-            self.chat_font = ('Microsoft YaHei UI', 10)
-        try:
-            input_font_str = config.get('设置', 'input_font')
-            font_parts = input_font_str.split(',')
-            self.input_font = (font_parts[0], int(font_parts[1]))
-        except Exception:
-            self.input_font = ('Microsoft YaHei UI', 10)
-        try:
-            self.button_font_size = config.getint('设置', 'button_font_size')
-        except Exception:
-            self.button_font_size = 10  # 默认按钮字体大小
-        try:
-            self.button_size = config.getint('设置', 'button_size')
-        except Exception:
-            self.button_size = 80  # 默认按钮大小
-        try:
-            self.global_font_size = config.getint('设置', 'global_font_size')
-        except Exception:
-            self.global_font_size = 10  # 默认全局字体大小
-
-        # 确保记录文件夹存在
-        try:
-            if not os.path.exists(self.records_folder):
-                os.makedirs(self.records_folder)
-                logger.info(f"创建记录文件夹: {self.records_folder}")
-        except Exception as e:
-            logger.error(f"创建记录文件夹失败: {e}")
-            # 如果无法创建用户数据目录，回退到程序目录
-            self.records_folder = "records"
-            if not os.path.exists(self.records_folder):
-                os.makedirs(self.records_folder)
-
-        # 初始化节点树和 AI 模型
-        self.tree = Tree()
-        self.ai_model = AIModel()
+        # 加载配置文件和基础设置
+        phase_started = time.perf_counter()
+        self.settings = Settings()
+        logger.info(f"配置文件路径: {self.settings.config_path}")
+        self.settings.ensure_records_folder()
+        for name, _, _, _ in Settings.FIELDS:
+            setattr(self, name, getattr(self.settings, name))
+        if self.enable_tracing:
+            tracing.enable()
+        tracing.record("startup.settings", time.perf_counter() - phase_started)
+
+        # 初始化节点树和 AI 模型，树操作统一通过服务层完成
+        with tracing.span("startup.ai_model"):
+            self.ai_model = AIModel()
+        # 每个打开的记录文件是一个工作区，占用内存超过 workspace_memory_mb 时卸载最近最少使用的工作区
+        self.workspaces = WorkspaceManager(self.settings, self.ai_model)
+        self.workspaces.new(os.path.join(self.settings.records_folder, DEFAULT_RECORDS_FILE))
+        # 工作区 -> 标签页的 Frame / Treeview，被卸载的工作区的 Treeview 会销毁，切换回来时重建
+        self.workspace_frames = {}
+        self.tree_views = {}
+        # 正在流式生成的回复：节点 ID -> 已收到的文本片段
+        self.partial_replies = {}
+        # 尚未结束的生成，可通过“停止”按钮取消
+        self.active_generations = []
+        # 剪切或复制的节点：(TreeNode, 'move' / 'copy')，粘贴时使用
+        self.node_clipboard = None
+        # 正在拖动的节点的 Treeview 项和起点坐标
+        self.drag_item = None
+        self.drag_start = None
         
         # 现在可以安全地设置样式和加载AI模型设置了
         self.setup_styles()
-        self.load_ai_model_settings()
+        with tracing.span("startup.ai_model_settings"):
+            self.load_ai_model_settings()
         
         # 创建水平分隔的 PanedWindow
         if USE_CUSTOMTKINTER:
@@ -203,18 +158,25 @@ class MainWindow:
             self.chat_frame = ttk.Frame(self.paned_window)
         self.paned_window.add(self.chat_frame, weight=3)
 
-        # 构造左侧树形组件
-        self.tree_display = ttk.Treeview(self.tree_frame)
-        self.tree_display.pack(fill="both", expand=True, padx=10, pady=10)
-        self.tree_display.bind("<<TreeviewSelect>>", self.on_tree_select)
-        self.tree_display.bind("<Button-3>", self.show_menu)
+        # 构造左侧树形组件：每个工作区一个标签页，各有自己的 Treeview
+        self.workspace_tabs = ttk.Notebook(self.tree_frame)
+        self.workspace_tabs.pack(fill="both", expand=True, padx=10, pady=10)
+        self.workspace_tabs.bind("<<NotebookTabChanged>>", self.on_workspace_tab_changed)
+        self.tree_display = self._create_tree_view(self._add_workspace_tab(self.workspaces.active))
+        self.tree_views[self.workspaces.active] = self.tree_display
 
-        # 右键菜单（针对树形节点）：添加子节点、删除节点、修改节点名称、查看主题
+        # 右键菜单（针对树形节点）：添加子节点、删除节点、修改节点名称、查看主题、移动 / 复制 / 合并子树
         self.menu = tk.Menu(self.root, tearoff=0, font=('Microsoft YaHei UI', 10))
         self.menu.add_command(label="添加子节点", command=self.add_child_node)
         self.menu.add_command(label="删除节点", command=self.delete_node)
         self.menu.add_command(label="修改节点名称", command=self.modify_node_name)
         self.menu.add_command(label="查看主题", command=self.show_topic)
+        self.menu.add_command(label="并行生成分支", command=self.fan_out_branches)
+        self.menu.add_separator()
+        self.menu.add_command(label="剪切节点", command=lambda: self.mark_node_for_paste('move'))
+        self.menu.add_command(label="复制节点", command=lambda: self.mark_node_for_paste('copy'))
+        self.menu.add_command(label="粘贴为子节点", command=self.paste_node)
+        self.menu.add_command(label="合并选中的两个兄弟节点", command=self.merge_selected_nodes)
 
         # 构造右侧聊天记录组件
         if USE_CUSTOMTKINTER:
@@ -252,17 +214,23 @@ class MainWindow:
             self.send_button = ctk.CTkButton(self.button_frame, text="发送", command=self.send_message, font=self.input_font, width=80,
                                            corner_radius=10, fg_color="#3B8ED0", hover_color="#3671A2")
             self.send_button.pack(side="top", pady=(0, 5))
+            self.stop_button = ctk.CTkButton(self.button_frame, text="停止", command=self.stop_generation, font=self.input_font, width=80,
+                                           corner_radius=10, fg_color="#3B8ED0", hover_color="#3671A2")
+            self.stop_button.pack(side="top", pady=(0, 5))
             self.save_button = ctk.CTkButton(self.button_frame, text="保存记录", command=self.save_chat_records, font=self.input_font, width=80,
                                            corner_radius=10, fg_color="#3B8ED0", hover_color="#3671A2")
             self.save_button.pack(side="top")
         else:
             self.send_button = tk.Button(self.input_frame, text="发送", command=self.send_message, font=self.input_font)
             self.send_button.pack(side="left", padx=5, pady=10)
+            self.stop_button = tk.Button(self.input_frame, text="停止", command=self.stop_generation, font=self.input_font)
+            self.stop_button.pack(side="left", padx=5, pady=10)
             self.save_button = tk.Button(self.input_frame, text="保存记录", command=self.save_chat_records, font=self.input_font)
             self.save_button.pack(side="left", padx=5, pady=10)
 
         # 绑定快捷键
         self.root.bind(INPUT_SHORTCUTS['send_message'], self.send_message)  # 发送消息
+        self.root.bind("<Escape>", lambda e: self.stop_generation())  # 停止生成
         self.root.bind(MAIN_SHORTCUTS['save_chat'], lambda e: self.save_chat_records())  # 保存聊天记录
         self.root.bind(MAIN_SHORTCUTS['new_chat'], lambda e: self.new_chat_record())  # 新建聊天
         self.root.bind(MAIN_SHORTCUTS['open_chat'], lambda e: self.open_chat_records())  # 打开聊天记录
@@ -289,6 +257,9 @@ class MainWindow:
         # 更新树形显示及加载当前节点聊天记录
         self.update_tree_display()
         self.load_current_node_chats()
+        if self.archive_after_minutes:
+            self.root.after(ARCHIVE_INTERVAL_MS, self.archive_cold_nodes)
+        tracing.record("startup", time.perf_counter() - startup_started)
 
     def open_settings_dialog(self):
         dialog = tk.Toplevel(self.root)
@@ -557,12 +528,7 @@ class MainWindow:
                 button_font_size = button_font_size_var.get()
 
             # 获取配置文件路径
-            if USE_APPDIRS:
-                app_data_dir = user_data_dir("TreeChat", "TreeChat")
-                config_path = os.path.join(app_data_dir, "settings.ini")
-                os.makedirs(app_data_dir, exist_ok=True)
-            else:
-                config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "settings.ini")
+            config_path = get_config_path()
             
             logger.info(f"保存配置到: {config_path}")
 
@@ -661,42 +627,40 @@ class MainWindow:
         """
         处理发送消息事件：
          - 如果输入以 "新主题:" 开头，则自动在当前节点下创建新节点，并根据设置自动切换及保存；
-         - 否则视为普通聊天消息，发送后调用 AI 模型回复并保存记录。
+         - 否则视为普通聊天消息，发送后调用 AI 模型回复并保存记录；
+           当前节点上的生成尚未结束时不发送，输入保留在输入框中。
         """
+        ui_started = time.perf_counter()
         input_text = self.input_text.get("1.0", tk.END).strip()
         self.input_text.delete("1.0", tk.END)
-        if input_text.startswith("新主题:"):
-            topic = input_text[len("新主题:"):].strip()
-            self.tree.add_topic(topic)
-            sys_msg = f"系统: 已创建新主题 '{topic}'，并切换当前聊天上下文。\n"
+        if input_text.startswith(NEW_TOPIC_PREFIX):
+            sys_msg = self.service.add_topic(input_text[len(NEW_TOPIC_PREFIX):].strip())
             self.output_text.insert(tk.END, sys_msg)
-            self.tree.get_current_node().chats.append(sys_msg)
             if self.auto_switch:
                 self.load_current_node_chats()
             if self.auto_save:
-                self.save_chat_records()
+                self.save_chat_records(auto=True)
         else:
-            user_msg = f"你: {input_text}\n"
-            self.output_text.insert(tk.END, user_msg)
-            self.tree.get_current_node().chats.append(user_msg)
-
-            # 显示正在思考的提示
-            thinking_msg = "AI: 正在思考...\n"
-            self.output_text.insert(tk.END, thinking_msg)
+            node = self.tree.get_current_node()
+            if any(h.node is node and not h.finished for h in self.active_generations):
+                # 同一节点上一次生成尚未结束时不再发送，否则两个回复会交错写入该节点；输入保留在输入框中
+                self.input_text.insert("1.0", input_text)
+                self.output_text.insert(tk.END, "系统: 当前节点的回复尚未生成完毕，请等待完成或点击“停止”后再发送。\n")
+                self.output_text.see(tk.END)
+                return 'break'
+            user_msg = self.service.append_user_message(input_text, node)
+            self.output_text.insert(tk.END, user_msg + "AI: ")
             self.output_text.see(tk.END)
-            self.root.update_idletasks()
-
-            # 调用AI模型生成回复
-            ai_reply = self.ai_model.generate_response(input_text)
+            tracing.record("send.ui_insert", time.perf_counter() - ui_started)
 
-            # 删除正在思考的提示并插入实际回复
-            self.output_text.delete("end-2l", tk.END)
-            reply_msg = f"AI: {ai_reply}\n"
-            self.output_text.insert(tk.END, reply_msg)
-            self.tree.get_current_node().chats.append(reply_msg)
-
-            if self.auto_save:
-                self.save_chat_records()
+            # 在后台流式生成回复，界面保持响应，可随时点击“停止”取消
+            events = queue.Queue()
+            self.partial_replies[node.id] = []
+            handle = self.service.start_reply(node,
+                                              on_chunk=lambda h, chunk: events.put(('chunk', node, chunk)),
+                                              on_done=lambda h: events.put(('done', node, h.reply_msg)))
+            self.active_generations.append(handle)
+            self.poll_stream_events(events, 1, workspace=self.workspaces.active)
 
         return 'break'  # 防止事件继续传播
 
@@ -747,13 +711,86 @@ class MainWindow:
         self.input_text.event_generate("<Shift-Down>")
         return 'break'
 
+    def _create_tree_view(self, frame):
+        """在标签页中创建显示节点树的 Treeview 并绑定事件"""
+        tree_view = ttk.Treeview(frame)
+        tree_view.pack(fill="both", expand=True)
+        tree_view.bind("<<TreeviewSelect>>", self.on_tree_select)
+        tree_view.bind("<Button-3>", self.show_menu)
+        # 拖放节点：拖到另一个节点上松开即移动到其下，按住 Ctrl 松开为复制
+        tree_view.bind("<ButtonPress-1>", self.on_drag_start, add="+")
+        tree_view.bind("<B1-Motion>", self.on_drag_motion, add="+")
+        tree_view.bind("<ButtonRelease-1>", self.on_drag_release, add="+")
+        return tree_view
+
+    def _add_workspace_tab(self, workspace):
+        frame = ttk.Frame(self.workspace_tabs)
+        self.workspace_tabs.add(frame, text=workspace.name)
+        self.workspace_frames[workspace] = frame
+        return frame
+
+    def switch_workspace(self, workspace):
+        """
+        切换到工作区的标签页：已加载的工作区直接显示原有的 Treeview，已卸载的重新加载并重建显示；
+        切换后按内存上限卸载其他工作区，并销毁它们的 Treeview
+        """
+        with tracing.span("ui.switch_workspace"):
+            self.workspaces.activate(workspace)
+            frame = self.workspace_frames.get(workspace) or self._add_workspace_tab(workspace)
+            if self.workspace_tabs.select() != str(frame):
+                self.workspace_tabs.select(frame)
+            tree_view = self.tree_views.get(workspace)
+            self.tree_display = tree_view or self._create_tree_view(frame)
+            self.tree_views[workspace] = self.tree_display
+            if tree_view is None:
+                self.update_tree_display()
+            for other, view in list(self.tree_views.items()):
+                if not other.loaded:
+                    view.destroy()
+                    del self.tree_views[other]
+            self.load_current_node_chats()
+
+    def on_workspace_tab_changed(self, event):
+        """用户点击标签页时切换工作区"""
+        selected = self.workspace_tabs.select()
+        for workspace, frame in self.workspace_frames.items():
+            if str(frame) == selected and workspace is not self.workspaces.active:
+                self.switch_workspace(workspace)
+                break
+
+    def close_workspace(self):
+        """关闭当前工作区的标签页，关闭前写回有修改的内容（打开的记录文件未确认覆盖时先询问）"""
+        workspace = self.workspaces.active
+        if len(self.workspaces.workspaces) == 1:
+            self.output_text.insert(tk.END, "系统: 这是唯一打开的工作区，不能关闭。\n")
+            return
+        if self.workspaces.is_busy(workspace):
+            self.output_text.insert(tk.END, "系统: 当前工作区仍有生成在进行，请先停止。\n")
+            return
+        save = True
+        if not workspace.overwrite and self.workspaces.is_dirty(workspace):
+            save = messagebox.askyesnocancel("关闭工作区", f"是否将修改保存到 {workspace.path}？")
+            if save is None:
+                return
+        try:
+            self.workspaces.close(workspace, save=save)
+        except Exception as e:
+            self.output_text.insert(tk.END, f"系统: 关闭工作区失败：{e}\n")
+            return
+        view = self.tree_views.pop(workspace, None)
+        if view is not None:
+            view.destroy()
+        self.workspace_tabs.forget(self.workspace_frames.pop(workspace))
+        self.switch_workspace(self.workspaces.active)
+
     def update_tree_display(self):
         """
         更新左侧树形节点显示，将所有节点重新插入到 Treeview 中
         """
-        for item in self.tree_display.get_children():
-            self.tree_display.delete(item)
-        self.insert_node(self.tree.root)
+        with tracing.span("ui.tree_refresh"):
+            for item in self.tree_display.get_children():
+                self.tree_display.delete(item)
+            self.insert_node(self.tree.root)
 
     def insert_node(self, node, parent=""):
         """
@@ -772,7 +809,9 @@ class MainWindow:
         """
         item = self.tree_display.identify_row(event.y)
         if item:
-            self.tree_display.selection_set(item)
+            # 在已选中的多个节点上右键时保留选择，用于合并
+            if item not in self.tree_display.selection():
+                self.tree_display.selection_set(item)
             self.menu.post(event.x_root, event.y_root)
 
     def add_child_node(self):
@@ -784,13 +823,10 @@ class MainWindow:
             selected_item = selected_items[0]
             parent_node = self.get_node_by_item_id(selected_item, self.tree.root)
             if parent_node:
-                new_node = TreeNode("新主题")
-                parent_node.add_child(new_node)
-                sys_msg = f"系统: 在 '{parent_node.topic}' 下添加了子节点 '新主题'。\n"
-                parent_node.chats.append(sys_msg)
+                self.service.add_child(parent_node)
                 self.update_tree_display()
                 if self.auto_save:
-                    self.save_chat_records()
+                    self.save_chat_records(auto=True)
         else:
             self.output_text.insert(tk.END, "系统: 请先选择一个节点！\n")
 
@@ -806,12 +842,10 @@ class MainWindow:
                 parent_node = self.get_node_by_item_id(parent_item, self.tree.root)
                 node_to_delete = self.get_node_by_item_id(selected_item, self.tree.root)
                 if parent_node and node_to_delete:
-                    parent_node.delete_child(node_to_delete)
-                    sys_msg = f"系统: 已删除节点 '{node_to_delete.topic}'。\n"
-                    parent_node.chats.append(sys_msg)
+                    self.service.delete_node(parent_node, node_to_delete)
                     self.update_tree_display()
                     if self.auto_save:
-                        self.save_chat_records()
+                        self.save_chat_records(auto=True)
             else:
                 self.output_text.insert(tk.END, "系统: 根节点不可删除！\n")
         else:
@@ -828,15 +862,129 @@ class MainWindow:
             if node:
                 new_name = simpledialog.askstring("修改节点名称", "请输入新的节点名称：", initialvalue=node.topic)
                 if new_name and new_name.strip():
-                    node.topic = new_name.strip()
-                    sys_msg = f"系统: 节点名称已修改为 '{node.topic}'。\n"
-                    node.chats.append(sys_msg)
+                    self.service.rename_node(node, new_name.strip())
                     self.update_tree_display()
                     if self.auto_save:
-                        self.save_chat_records()
+                        self.save_chat_records(auto=True)
         else:
             self.output_text.insert(tk.END, "系统: 请先选择一个节点进行修改！\n")
 
+    def mark_node_for_paste(self, mode):
+        """
+        记下选中的节点，之后通过“粘贴为子节点”移动（mode 为 'move'）或复制（'copy'）到另一个节点下
+        """
+        selected_items = self.tree_display.selection()
+        if not selected_items:
+            self.output_text.insert(tk.END, "系统: 请先选择一个节点！\n")
+            return
+        node = self.get_node_by_item_id(selected_items[0], self.tree.root)
+        if node is None:
+            return
+        if mode == 'move' and node.parent is None:
+            self.output_text.insert(tk.END, "系统: 根节点不可移动！\n")
+            return
+        self.node_clipboard = (node, mode)
+        action = "剪切" if mode == 'move' else "复制"
+        self.output_text.insert(tk.END, f"系统: 已{action}节点 '{node.topic}'，请在目标节点上选择“粘贴为子节点”。\n")
+
+    def paste_node(self):
+        """
+        把剪切或复制的节点粘贴到选中节点下
+        """
+        selected_items = self.tree_display.selection()
+        if not selected_items or self.node_clipboard is None:
+            self.output_text.insert(tk.END, "系统: 请先剪切或复制一个节点，再选择目标节点！\n")
+            return
+        target = self.get_node_by_item_id(selected_items[0], self.tree.root)
+        node, mode = self.node_clipboard
+        if target is None:
+            return
+        if mode == 'move':
+            self.node_clipboard = None
+            self.move_node(node, target)
+        else:
+            self.copy_node(node, target)
+
+    def move_node(self, node, new_parent):
+        """
+        移动子树，只把对应的 Treeview 项挂到新的父项下，不重建整棵树的显示
+        """
+        if node.parent is None or node.parent is new_parent:
+            return
+        if node.is_ancestor_of(new_parent):
+            self.output_text.insert(tk.END, "系统: 不能把节点移动到自身或其子节点之下！\n")
+            return
+        self.service.move_node(node, new_parent)
+        self.tree_display.move(node.id, new_parent.id, "end")
+        self.tree_display.item(new_parent.id, open=True)
+        self.tree_display.see(node.id)
+        if self.auto_save:
+            self.save_chat_records(auto=True)
+
+    def copy_node(self, node, new_parent):
+        """
+        复制子树，只插入新复制出的 Treeview 项
+        """
+        copy = self.service.copy_node(node, new_parent)
+        self.insert_node(copy, new_parent.id)
+        self.tree_display.see(copy.id)
+        if self.auto_save:
+            self.save_chat_records(auto=True)
+
+    def merge_selected_nodes(self):
+        """
+        合并选中的两个兄弟节点：后选中的节点的聊天记录接到先选中的节点之后，子节点一并移过去
+        """
+        selected_items = self.tree_display.selection()
+        if len(selected_items) != 2:
+            self.output_text.insert(tk.END, "系统: 请按住 Ctrl 选中同一父节点下的两个节点！\n")
+            return
+        target = self.get_node_by_item_id(selected_items[0], self.tree.root)
+        source = self.get_node_by_item_id(selected_items[1], self.tree.root)
+        if target is None or source is None or target.parent is None or target.parent is not source.parent:
+            self.output_text.insert(tk.END, "系统: 只能合并同一父节点下的两个节点！\n")
+            return
+        children = self.service.merge_nodes(target, source)
+        for child in children:
+            self.tree_display.move(child.id, target.id, "end")
+        self.tree_display.delete(source.id)
+        self.tree_display.selection_set(target.id)
+        if self.tree.get_current_node() is target:
+            self.load_current_node_chats()
+        if self.auto_save:
+            self.save_chat_records(auto=True)
+
+    def on_drag_start(self, event):
+        self.drag_item = self.tree_display.identify_row(event.y) or None
+        self.drag_start = (event.x, event.y)
+
+    def on_drag_motion(self, event):
+        if self.drag_item is None:
+            return
+        if abs(event.x - self.drag_start[0]) + abs(event.y - self.drag_start[1]) > 5:
+            self.tree_display.configure(cursor="hand2")
+
+    def on_drag_release(self, event):
+        """
+        在另一个节点上松开时把拖动的节点移到其下，按住 Ctrl 时复制
+        """
+        item, self.drag_item = self.drag_item, None
+        self.tree_display.configure(cursor="")
+        if item is None:
+            return
+        target_item = self.tree_display.identify_row(event.y)
+        moved = abs(event.x - self.drag_start[0]) + abs(event.y - self.drag_start[1]) > 5
+        if not moved or not target_item or target_item == item:
+            return
+        node = self.get_node_by_item_id(item, self.tree.root)
+        target = self.get_node_by_item_id(target_item, self.tree.root)
+        if node is None or target is None:
+            return
+        if event.state & 0x0004:
+            self.copy_node(node, target)
+        else:
+            self.move_node(node, target)
+
     def show_topic(self):
         """
         在聊天记录区域显示所选节点的主题信息。
@@ -849,6 +997,95 @@ class MainWindow:
                 sys_msg = f"系统: 当前主题为 '{node.topic}'。\n"
                 self.output_text.insert(tk.END, sys_msg)
 
+    def fan_out_branches(self):
+        """
+        在选中节点下并行生成多个分支：为每个分支创建子节点，同时生成回复并流式写入各自的节点。
+        """
+        selected_items = self.tree_display.selection()
+        if not selected_items:
+            self.output_text.insert(tk.END, "系统: 请先选择一个节点！\n")
+            return
+        parent_node = self.get_node_by_item_id(selected_items[0], self.tree.root)
+        if not parent_node:
+            return
+        prompt = simpledialog.askstring("并行生成分支", "请输入提示：")
+        if not prompt or not prompt.strip():
+            return
+        count = simpledialog.askinteger("并行生成分支", "分支数量：", initialvalue=3, minvalue=1, maxvalue=8)
+        if not count:
+            return
+
+        # 工作线程只向队列写事件，由 Tk 主线程轮询并更新界面
+        events = queue.Queue()
+        fan_out = FanOut(self.service, parent_node, prompt.strip(), default_variants(count))
+        branches = fan_out.start(on_chunk=lambda i, node, chunk: events.put(('chunk', node, chunk)),
+                                 on_done=lambda i, node, msg, error: events.put(('done', node, msg)))
+        for node in branches:
+            self.partial_replies[node.id] = []
+        self.active_generations.extend(fan_out.handles)
+        self.update_tree_display()
+        self.output_text.insert(tk.END, f"系统: 正在 '{parent_node.topic}' 下并行生成 {count} 个分支...\n")
+        self.poll_stream_events(events, len(branches), "系统: 所有分支已生成完毕。\n", self.workspaces.active)
+
+    def poll_stream_events(self, events, remaining, finished_msg=None, workspace=None):
+        """
+        处理工作线程产生的流式事件，全部结束后根据设置自动保存。
+
+        参数:
+            events       - 事件队列：('chunk', 节点, 文本片段) 表示收到新内容，('done', 节点, 回复消息) 表示该节点生成结束
+            remaining    - 尚未结束的生成数
+            finished_msg - 全部结束后在聊天区域显示的提示
+            workspace    - 生成所在的工作区，结束后自动保存该工作区，为空时为当前工作区
+        """
+        current_node = self.tree.get_current_node()
+        poll_started = time.perf_counter()
+        handled = 0
+        try:
+            while True:
+                kind, node, text = events.get_nowait()
+                handled += 1
+                if kind == 'done':
+                    remaining -= 1
+                    streamed = "AI: " + "".join(self.partial_replies.pop(node.id, []))
+                    if node is current_node:
+                        # 补上流式显示之外的部分：换行、取消标记或错误信息
+                        if text.startswith(streamed):
+                            self.output_text.insert(tk.END, text[len(streamed):])
+                        else:
+                            self.output_text.insert(tk.END, "\n" + text)
+                        self.output_text.see(tk.END)
+                    continue
+                self.partial_replies.setdefault(node.id, []).append(text)
+                if node is current_node:
+                    self.output_text.insert(tk.END, text)
+                    self.output_text.see(tk.END)
+        except queue.Empty:
+            pass
+        if handled:
+            tracing.record("send.ui_stream", time.perf_counter() - poll_started)
+        if remaining > 0:
+            self.root.after(50, self.poll_stream_events, events, remaining, finished_msg, workspace)
+        else:
+            self.active_generations = [h for h in self.active_generations if not h.finished]
+            if finished_msg:
+                self.output_text.insert(tk.END, finished_msg)
+            if self.auto_save:
+                with tracing.span("send.persist"):
+                    self.save_chat_records(workspace, auto=True)
+
+    def stop_generation(self):
+        """
+        取消当前节点上正在进行的生成；当前节点没有生成时取消所有生成。
+        已生成的部分会保留在节点中并标记为已取消。
+        """
+        current_node = self.tree.get_current_node()
+        handles = [h for h in self.active_generations if not h.finished]
+        targets = [h for h in handles if h.node is current_node] or handles
+        for handle in targets:
+            handle.cancel()
+        if not targets:
+            self.output_text.insert(tk.END, "系统: 当前没有正在进行的生成。\n")
+
     def get_node_by_item_id(self, item_id, current_node):
         """
         根据 Treeview 的 item_id 递归查找对应的 TreeNode 对象。
@@ -892,55 +1129,59 @@ class MainWindow:
             parent_node = self.get_node_by_item_id(parent_item, self.tree.root)
         else:
             parent_node = self.tree.root
-        new_node = TreeNode(selected_text)
-        parent_node.add_child(new_node)
-        sys_msg = f"系统: 从聊天文本创建了新节点 '{selected_text}' 在 '{parent_node.topic}' 下。\n"
-        parent_node.chats.append(sys_msg)
+        new_node = self.service.create_node_from_text(parent_node, selected_text)
         self.update_tree_display()
         if self.auto_switch:
             self.tree.set_current_node(new_node)
             self.load_current_node_chats()
         if self.auto_save:
-            self.save_chat_records()
+            self.save_chat_records(auto=True)
 
     def load_current_node_chats(self):
         """
         加载当前节点的聊天记录。
         若设置 clear_on_jump 为 True，则先清空显示区域，并根据 show_jump_alert 在顶端提示当前节点名称。
         """
+        with tracing.span("ui.load_chats"):
+            self._load_current_node_chats()
+
+    def _load_current_node_chats(self):
         if self.clear_on_jump:
             self.output_text.delete("1.0", tk.END)
             if self.show_jump_alert:
                 self.output_text.insert(tk.END, f"系统: 当前节点为 '{self.tree.get_current_node().topic}'\n")
-        current_chats = self.tree.get_current_node().chats
+        current_node = self.tree.get_current_node()
+        current_node.touch()
+        current_chats = current_node.chats
         if current_chats:
             self.output_text.insert(tk.END, "".join(current_chats))
         else:
             self.output_text.insert(tk.END, "系统: 当前节点暂无聊天记录。\n")
+        if current_node.id in self.partial_replies:
+            self.output_text.insert(tk.END, "AI: " + "".join(self.partial_replies[current_node.id]))
 
-    def serialize_node(self, node):
-        """
-        序列化树节点为字典格式
-        """
-        return {
-            'id': node.id,
-            'topic': node.topic,
-            'chats': node.chats,
-            'children': [self.serialize_node(child) for child in node.children]
-        }
-
-    def save_chat_records(self):
+    def save_chat_records(self, workspace=None, auto=False):
         """
         将整个树状聊天记录（包括节点结构及所有节点聊天内容）序列化为 JSON，
-        固定保存在"chat_all_records.json"文件中，存放于默认记录文件夹内。
+        保存到工作区的记录文件（启动时的工作区为默认记录文件夹内的"chat_all_records.json"）。
         若 show_save_alert 开启，则在聊天区域提示保存成功。
+        自动保存第一次要覆盖打开的记录文件时先询问；用户拒绝后该工作区不再自动保存，手动保存不受影响。
+
+        参数:
+            workspace - 要保存的工作区，为空时为当前工作区
+            auto      - 是否为修改后的自动保存
         """
-        tree_dict = self.serialize_node(self.tree.root)
-        file_name = "chat_all_records.json"
-        file_path = os.path.join(self.records_folder, file_name)
+        workspace = workspace or self.workspaces.active
+        if auto and not workspace.overwrite:
+            if workspace.overwrite is False:
+                return
+            if not messagebox.askyesno("自动保存", f"自动保存将覆盖打开的记录文件：\n{workspace.path}\n是否继续？"):
+                workspace.overwrite = False
+                self.output_text.insert(tk.END, "系统: 该工作区不再自动保存，可手动保存或另存为。\n")
+                return
+            workspace.overwrite = True
         try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(tree_dict, f, ensure_ascii=False, indent=4)
+            file_path = self.workspaces.save(workspace)
             if self.show_save_alert:
                 self.output_text.insert(tk.END, f"系统: 聊天记录已保存至 {file_path}\n")
         except Exception as e:
@@ -951,28 +1192,54 @@ class MainWindow:
         新建聊天记录，清空当前聊天内容并创建一个新的树状结构。
         """
         if messagebox.askyesno("新建聊天", "确定要开始新的聊天记录吗？这将清除当前所有记录！"):
-            self.tree = Tree()
+            self.service.new_tree()
             self.update_tree_display()
             self.load_current_node_chats()
             self.output_text.insert(tk.END, "系统: 新建聊天记录成功。\n")
 
     def open_chat_records(self):
         """
-        打开历史聊天记录文件，原模原样还原树状结构和各节点聊天内容。
+        在新的标签页中打开历史聊天记录文件，原模原样还原树状结构和各节点聊天内容；已打开的文件直接切换过去。
+        之后的自动保存写回该文件，第一次写回前先询问（见 save_chat_records）。
         """
         file_path = filedialog.askopenfilename(title="打开历史聊天记录", filetypes=[("JSON文件", "*.json")])
         if file_path:
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                self.tree.root = self.build_tree_node_from_dict(data)
-                self.tree.current_node = self.tree.root
-                self.update_tree_display()
-                self.load_current_node_chats()
+                with tracing.span("ui.open_chat_records"):
+                    self.switch_workspace(self.workspaces.open(file_path, activate=False))
                 self.output_text.insert(tk.END, f"系统: 成功打开 {file_path}\n")
             except Exception as e:
                 self.output_text.insert(tk.END, f"系统: 打开文件失败：{e}\n")
 
+    def bulk_import_records(self):
+        """
+        把一个文件夹中的所有记录文件（.json）各自作为子树导入到选中的节点（未选中时为根节点）下，
+        在多个进程中并行解析，完成后列出失败的文件。
+        """
+        folder = filedialog.askdirectory(title="选择要导入的记录文件夹")
+        if not folder:
+            return
+        selected_items = self.tree_display.selection()
+        parent = self.get_node_by_item_id(selected_items[0], self.tree.root) if selected_items else None
+        parent = parent or self.tree.root
+
+        def progress(done, total, result):
+            if done % 20 == 0 or done == total:
+                self.output_text.insert(tk.END, f"系统: 正在导入 {done}/{total}...\n")
+                self.output_text.see(tk.END)
+                self.root.update_idletasks()
+
+        try:
+            with tracing.span("ui.bulk_import"):
+                report = self.service.import_records(parent, [folder], progress=progress)
+                self.update_tree_display()
+        except Exception as e:
+            self.output_text.insert(tk.END, f"系统: 批量导入失败：{e}\n")
+            return
+        self.output_text.insert(tk.END, format_import_report(report) + "\n")
+        if self.auto_save and report['imported']:
+            self.save_chat_records(auto=True)
+
     def save_chat_records_as(self):
         """
         另存为：使用文件对话框选择保存位置和文件名，将整个树状聊天记录导出为 JSON 文件。
@@ -980,24 +1247,161 @@ class MainWindow:
         file_path = filedialog.asksaveasfilename(title="另存为", defaultextension=".json", filetypes=[("JSON 文件", "*.json")])
         if file_path:
             try:
-                tree_dict = self.serialize_node(self.tree.root)
-                with open(file_path, "w", encoding="utf-8") as f:
-                    json.dump(tree_dict, f, ensure_ascii=False, indent=4)
+                self.workspaces.save(file_path=file_path)
                 self.output_text.insert(tk.END, f"系统: 聊天记录已另存为 {file_path}\n")
             except Exception as e:
                 self.output_text.insert(tk.END, f"系统: 另存为失败：{e}\n")
 
-    def build_tree_node_from_dict(self, data):
+    def undo_node_operation(self):
         """
-        递归从字典数据创建 TreeNode 对象，用于打开历史聊天记录时还原树状结构。
+        撤销上一次节点操作（添加、删除、重命名节点或之后追加的聊天消息），只调整变化的部分
         """
-        node = TreeNode(data['topic'])
-        node.id = data.get('id', node.id)
-        node.chats = data.get('chats', [])
-        for child_data in data.get('children', []):
-            child_node = self.build_tree_node_from_dict(child_data)
-            node.children.append(child_node)
-        return node
+        label = self.service.undo()
+        self._after_history_change(f"系统: 已撤销：{label}\n" if label else "系统: 没有可撤销的操作。\n")
+
+    def redo_node_operation(self):
+        """
+        重做上一次被撤销的节点操作
+        """
+        label = self.service.redo()
+        self._after_history_change(f"系统: 已重做：{label}\n" if label else "系统: 没有可重做的操作。\n")
+
+    def create_checkpoint(self):
+        """
+        为树的当前内容创建命名检查点，之后可以随时恢复
+        """
+        name = simpledialog.askstring("创建检查点", "请输入检查点名称：")
+        if name and name.strip():
+            self.service.checkpoint(name.strip())
+            self.output_text.insert(tk.END, f"系统: 已创建检查点 '{name.strip()}'。\n")
+
+    def restore_checkpoint(self):
+        """
+        恢复到命名检查点，恢复后仍可撤销
+        """
+        names = list(self.service.history.checkpoints)
+        if not names:
+            self.output_text.insert(tk.END, "系统: 还没有检查点。\n")
+            return
+        name = simpledialog.askstring("恢复检查点", f"可用的检查点：{'、'.join(names)}\n请输入要恢复的检查点名称：",
+                                      initialvalue=names[-1])
+        if not name:
+            return
+        if self.service.restore_checkpoint(name.strip()):
+            self._after_history_change(f"系统: 已恢复检查点 '{name.strip()}'。\n")
+        else:
+            self.output_text.insert(tk.END, f"系统: 找不到检查点 '{name.strip()}'。\n")
+
+    def _after_history_change(self, message):
+        self.update_tree_display()
+        self.load_current_node_chats()
+        self.output_text.insert(tk.END, message)
+        if self.auto_save:
+            self.save_chat_records(auto=True)
+
+    def export_document(self):
+        """
+        将整棵树导出为 Markdown（节点主题作为各级标题）或独立的 HTML 文件，按所选扩展名决定格式。
+        导出边生成边写入，不会在内存中拼接整个文档。
+        """
+        file_path = filedialog.asksaveasfilename(title="导出", defaultextension=".md",
+                                                 filetypes=[("Markdown", "*.md"), ("HTML", "*.html")])
+        if file_path:
+            try:
+                write_export(self.tree.root, file_path)
+                self.output_text.insert(tk.END, f"系统: 已导出至 {file_path}\n")
+            except Exception as e:
+                self.output_text.insert(tk.END, f"系统: 导出失败：{e}\n")
+
+    def open_perf_panel(self):
+        """
+        打开性能面板：按模型和服务地址显示最近生成的首字延迟、生成速度、提示 token 数、
+        排队时间和错误率，每秒刷新。速度数据来自 Ollama 返回的计时字段。
+        """
+        panel = tk.Toplevel(self.root)
+        panel.title("性能面板")
+        panel.geometry("1400x400")
+        columns = [
+            ('model', "模型", 220, None),
+            ('endpoint', "服务地址", 220, None),
+            ('window', "最近次数", 80, "{:d}"),
+            ('error_rate', "错误率", 80, "{:.0%}"),
+            ('ttft_p50', "首字 p50", 90, "{:.2f}s"),
+            ('ttft_p95', "首字 p95", 90, "{:.2f}s"),
+            ('tokens_per_sec', "生成 tok/s", 100, "{:.1f}"),
+            ('prompt_tokens', "提示 tokens", 100, "{:.0f}"),
+            ('prompt_tokens_per_sec', "提示 tok/s", 100, "{:.0f}"),
+            ('queue_time_p50', "排队 p50", 90, "{:.2f}s"),
+            ('load_time', "加载", 80, "{:.2f}s"),
+        ]
+        table = ttk.Treeview(panel, columns=[c[0] for c in columns], show="headings")
+        for key, label, width, _ in columns:
+            table.heading(key, text=label)
+            table.column(key, width=width, anchor="w" if key in ('model', 'endpoint') else "e")
+        table.pack(fill="both", expand=True, padx=10, pady=10)
+
+        status_var = tk.StringVar(value="")
+        # 工作线程只修改该标记，由 refresh() 在 Tk 主线程中更新状态文字
+        probing = threading.Event()
+        button_frame = ttk.Frame(panel)
+        button_frame.pack(fill="x", padx=10, pady=(0, 10))
+        ttk.Label(button_frame, textvariable=status_var).pack(side=tk.LEFT)
+
+        def probe():
+            # 测速在后台线程中逐个模型进行，面板照常刷新
+            if probing.is_set():
+                return
+            probing.set()
+
+            def run():
+                try:
+                    self.service.probe_models(repeat=3)
+                finally:
+                    probing.clear()
+            threading.Thread(target=run, daemon=True).start()
+
+        ttk.Button(button_frame, text="关闭", command=panel.destroy).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="测试所有模型", command=probe).pack(side=tk.RIGHT, padx=5)
+
+        def refresh():
+            if not panel.winfo_exists():
+                return
+            status_var.set("正在测试所有模型..." if probing.is_set() else "")
+            table.delete(*table.get_children())
+            for row in self.service.scheduler.model_stats():
+                values = []
+                for key, _, _, pattern in columns:
+                    value = row[key]
+                    values.append("-" if value is None else pattern.format(value) if pattern else value)
+                table.insert("", "end", values=values)
+            panel.after(1000, refresh)
+        refresh()
+
+    def archive_cold_nodes(self):
+        """定期压缩长时间未打开的节点的聊天记录（archive_after_minutes），切换到这些节点时自动解压"""
+        try:
+            self.service.archive_cold_nodes()
+        except Exception as e:
+            logger.error(f"压缩冷节点失败: {e}")
+        self.root.after(ARCHIVE_INTERVAL_MS, self.archive_cold_nodes)
+
+    def export_tracing(self):
+        """
+        导出各阶段耗时统计：.jsonl 文件为最近的原始记录，其他扩展名为 Prometheus 文本格式。
+        统计需在设置文件中开启 enable_tracing（或设置环境变量 TREECHAT_TRACE=1）。
+        """
+        if not tracing.tracer.enabled:
+            self.output_text.insert(tk.END, "系统: 性能统计未开启，请在设置文件中设置 enable_tracing = True。\n")
+            return
+        file_path = filedialog.asksaveasfilename(title="导出性能统计", defaultextension=".prom",
+                                                 filetypes=[("Prometheus 文本", "*.prom"), ("JSON lines", "*.jsonl")])
+        if file_path:
+            try:
+                tracing.export(file_path)
+                self.output_text.insert(tk.END, f"系统: 性能统计已导出至 {file_path}\n")
+                self.output_text.insert(tk.END, tracing.tracer.format_summary() + "\n")
+            except Exception as e:
+                self.output_text.insert(tk.END, f"系统: 导出性能统计失败：{e}\n")
 
     def on_tree_select(self, event):
         """
@@ -1025,64 +1429,5 @@ class MainWindow:
 
     def load_ai_model_settings(self):
         """从配置文件加载AI模型设置"""
-        # 获取配置文件路径
-        if USE_APPDIRS:
-            # 使用用户数据目录存储配置
-            app_data_dir = user_data_dir("TreeChat", "TreeChat")
-            config_path = os.path.join(app_data_dir, "settings.ini")
-        else:
-            # 使用程序目录中的配置文件
-            config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "settings.ini")
-        
-        logger.info(f"加载AI模型设置，配置文件路径: {config_path}")
-        
-        config = configparser.ConfigParser()
-        try:
-            config.read(config_path, encoding="utf-8")
-            
-            # 首先加载服务地址
-            if config.has_option('设置', 'ollama_base_url'):
-                base_url = config.get('设置', 'ollama_base_url')
-                logger.info(f"从配置文件加载Ollama服务地址: {base_url}")
-                self.ai_model.set_base_url(base_url)
-            
-            # 添加启动时测试控制选项
-            skip_startup_test = False
-            if config.has_option('设置', 'skip_startup_model_test'):
-                skip_startup_test = config.getboolean('设置', 'skip_startup_model_test')
-            
-            # 加载模型设置
-            if config.has_option('设置', 'ai_model'):
-                model_name = config.get('设置', 'ai_model')
-                logger.info(f"从配置文件加载AI模型: {model_name}")
-                
-                # 先尝试刷新模型列表，但不强制执行测试
-                self.ai_model.load_available_models()
-                
-                # 尝试设置模型
-                success = self.ai_model.set_model(model_name)
-                if not success:
-                    logger.warning(f"无法设置模型 {model_name}，使用默认模型")
-                    # 如果失败，直接设置模型名称，让AIModel内部处理
-                    self.ai_model.model = model_name
-                    # 尝试将模型添加到可用列表
-                    if model_name not in self.ai_model.available_models:
-                        self.ai_model.available_models.append(model_name)
-                        
-            # 加载手动添加的模型列表（如果存在）
-            if config.has_option('设置', 'manual_models'):
-                manual_models_str = config.get('设置', 'manual_models')
-                if manual_models_str:
-                    manual_models = manual_models_str.split(',')
-                    for model in manual_models:
-                        model = model.strip()
-                        if model and model not in self.ai_model.available_models:
-                            self.ai_model.available_models.append(model)
-        except Exception as e:
-            logger.error(f"加载AI模型设置失败: {str(e)}")
-            # 使用默认设置
-            self.ai_model.set_model("deepseek-r1:8b  gemma3n:e4b")  # 使用用户实际拥有的模型
-            self.ai_model.set_base_url("http://localhost:11434")
-            # 使用默认设置
-            self.ai_model.set_model("gemma3n:e4b")  # 使用用户实际拥有的模型
-            self.ai_model.set_base_url("http://localhost:11434")
+        logger.info(f"加载AI模型设置，配置文件路径: {self.settings.config_path}")
+        apply_ai_model_settings(self.ai_model, self.settings)